@@ -9,7 +9,7 @@ from gaze_tracking import GazeTrackingFromVideo
 
 COUNT = 500
 
-gaze = GazeTrackingFromVideo(1, flip=True)
+gaze = GazeTrackingFromVideo(1, flip=True, threaded=True)
 
 data = pd.DataFrame(
     index=pd.RangeIndex(1, COUNT + 1), 
@@ -27,16 +27,18 @@ while True:
     # We send this frame to GazeTracking to analyze it
     count += 1
 
-    gaze.equalizehist = 0
+    gaze.equalizehist = False
     gaze.refresh(raw_frame)
     if gaze.pupils_located:
         r_count += 1
-    raw_frame_ret: np.ndarray = gaze.annotated_frame()
 
-    gaze.equalizehist = 1
-    gaze.refresh(raw_frame)
+    # the frame is analyzed again with the equalized histogram,
+    # only the stages following the equalization are computed
+    gaze.equalizehist = True
+    gaze.reanalyze()
     if gaze.pupils_located:
         h_count += 1
+    # drawn on an equalized copy, raw_frame is left untouched
     frame: np.ndarray = gaze.annotated_frame()
     text = ""
 
@@ -51,6 +53,13 @@ while True:
     else:
         ...
 
+    # both analyses are cached, switching between them is free
+    gaze.equalizehist = False
+    gaze.reanalyze()
+    raw_frame_ret: np.ndarray = gaze.annotated_frame()
+    gaze.equalizehist = True
+    gaze.reanalyze()
+
     pic = np.hstack((raw_frame_ret, frame))
     cv2.imwrite("output.png", pic)
 
@@ -1,13 +1,37 @@
 from .gaze_tracking import GazeTracking, GazeTrackingFromVideo
 from .eye import Eye, LEFT_EYE, RIGHT_EYE, BOTH_EYES
-from .calibration import Calibration
+from .calibration import AdaptiveCalibration, Calibration
 from .pupil import Pupil
+from .detector import AutoDetector, CascadeDetector, FaceTracker, HogDetector
+from .buffers import FrameBuffers
+from .context import FrameContext
+from .sample import SAMPLE_DTYPE
+from .history import SampleHistory
+from .events import EventDetector
+from .face import EyePair, Face
+from .profiles import CalibrationProfile, ProfileStore
+from .aio import AsyncGazeTracking
 
 __all__ = [
     "GazeTracking",
     "GazeTrackingFromVideo",
+    "AsyncGazeTracking",
     "Eye",
     "Pupil",
+    "AdaptiveCalibration",
+    "FaceTracker",
+    "HogDetector",
+    "CascadeDetector",
+    "AutoDetector",
+    "FrameBuffers",
+    "FrameContext",
+    "SAMPLE_DTYPE",
+    "SampleHistory",
+    "EventDetector",
+    "EyePair",
+    "Face",
+    "CalibrationProfile",
+    "ProfileStore",
     "LEFT_EYE",
     "RIGHT_EYE",
     "BOTH_EYES"
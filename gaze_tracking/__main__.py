@@ -1,54 +1,175 @@
+import os
 import sys
+import time
 import cv2
+import numpy as np
 from argparse import ArgumentParser
 
 from . import GazeTracking, GazeTrackingFromVideo
+from .parallel import analyze_video, collect_images, iter_images
+from .export import SampleRecorder
+from .profiles import ProfileStore
+from .pupil import BACKENDS, DEFAULT_BACKEND
+from .stats import StatsReporter
+from .writer import ThreadedVideoWriter
+from . import server
 
 
 def main(*argv: str) -> None:
-    parse = ArgumentParser("gaze tracking")
-    parse.add_argument("-i", "--image", help="the image path to track")
+    if argv and argv[0] == "serve":
+        server.main(*argv[1:])
+        return
+
+    parse = ArgumentParser("gaze tracking", epilog="'python -m gaze_tracking serve --help' starts a local server")
+    parse.add_argument("-i", "--image",
+        help="the image path to track, or a directory, glob pattern or .txt list of images analyzed in batch")
     parse.add_argument("-v", "--video", help="video path or ID of camera to track")
     parse.add_argument("-e", "--equalizehist", action="store_true")
     parse.add_argument("-f", "--flip", action="store_true", help="flip video frame")
-    parse.add_argument("-o", "--output", help="output file name")
+    parse.add_argument("-t", "--track-face", action="store_true",
+        help="search the face only around the last detected face")
+    parse.add_argument("-s", "--scale", type=float, default=1.0,
+        help="scale of the frame the face detector runs on, e.g. 0.5 or 0.25")
+    parse.add_argument("-k", "--keyframes", type=int,
+        help="locate the landmarks every this number of frames and follow them with optical flow in between")
+    parse.add_argument("-a", "--adaptive", action="store_true",
+        help="keep refining the calibration on a background thread to follow the lighting changes")
+    parse.add_argument("-d", "--detector", default="hog", choices=["hog", "haar", "lbp", "auto"],
+        help="face detector backend, 'auto' picks the fastest one reliable on the first frames")
+    parse.add_argument("-p", "--pupil-backend", default=DEFAULT_BACKEND, choices=list(BACKENDS),
+        help="pupil localization backend, 'centroid' and 'gradients' are faster and less precise")
+    parse.add_argument("--threaded", action="store_true",
+        help="read the video frames on a background thread")
+    parse.add_argument("-j", "--jobs", type=int,
+        help="analyze a video file on this number of processes, the output file then receives the samples (.npy)")
+    parse.add_argument("--io-threads", type=int, default=4,
+        help="number of threads decoding the images of a batch in every process")
+    parse.add_argument("-o", "--output",
+        help="output file name, or the directory receiving the annotated images of a batch")
+    parse.add_argument("--export",
+        help="stream the gaze samples to this file (.jsonl, .csv or .npz)")
+    parse.add_argument("--stats", help="periodically dump the analysis statistics to this JSON file")
+    parse.add_argument("--metrics-port", type=int,
+        help="serve the analysis statistics in the Prometheus text format on this local port")
+    parse.add_argument("--profile",
+        help="user name of the calibration profile, loaded at start and saved once calibrated")
+    parse.add_argument("--camera", help="camera name of the calibration profile, the video argument by default")
+    parse.add_argument("--profiles", help="directory of the calibration profiles")
+    parse.add_argument("--no-display", action="store_true", help="do not show the frames")
     parse.add_argument("--fourcc",
         help="video writer fourcc, only used when the output path is given",
         default="XVID", choices=["I420", "MJPG", "MP4V", "XVID", "PIMI", "FLVI", "DIVX"])
 
     args = parse.parse_args(argv)
-    if args.image:
-        gaze = GazeTracking(args.image, equalizehist=args.equalizehist)
+    batch = args.image is not None and (
+        os.path.isdir(args.image) or any(c in args.image for c in "*?[") or args.image.lower().endswith(".txt"))
+    recorder = SampleRecorder(args.export, with_source=batch) if args.export else None
+    store = ProfileStore(args.profiles) if args.profiles else ProfileStore()
+    camera = args.camera or args.video or "0"
+    profile = store.load(args.profile, camera) if args.profile else None
+    if profile is not None:
+        print(f"calibration profile loaded from {store.path(args.profile, camera)}")
+    if batch:
+        paths = collect_images(args.image)
+        start = time.perf_counter()
+        done = located = 0
+        for chunk, samples in iter_images(
+                paths, args.jobs, io_threads=args.io_threads, annotate_dir=args.output,
+                equalizehist=args.equalizehist, detection_scale=args.scale,
+                pupil_backend=args.pupil_backend, face_detector=args.detector):
+            if recorder is not None:
+                recorder.write(samples, chunk)
+            done += len(chunk)
+            located += int(samples["located"].sum())
+            elapsed = time.perf_counter() - start
+            print(f"\r{done}/{len(paths)} images, {done / elapsed:.1f} images/s", end="", file=sys.stderr)
+        duration = time.perf_counter() - start
+        print(file=sys.stderr)
+        print(f"{done} images analyzed in {duration:.1f}s ({done / max(duration, 1e-9):.1f} images/s), "
+              f"pupils located in {located / max(done, 1):.2%} of them")
+    elif args.image:
+        gaze = GazeTracking(
+            args.image, equalizehist=args.equalizehist, detection_scale=args.scale,
+            pupil_backend=args.pupil_backend, face_detector=args.detector)
+        if recorder is not None:
+            recorder.record(gaze)
         gaze.annotated_frame()
         if args.output:
             gaze.save(args.output)
-        gaze.show()
-        cv2.waitKey(0)
-    if args.video or not args.image:
+        if not args.no_display:
+            gaze.show()
+            cv2.waitKey(0)
+    if args.jobs and args.video and not args.video.isdigit():
+        # their state would restart at every chunk of frames
+        if args.track_face or args.keyframes:
+            parse.error("--track-face and --keyframes cannot be used with --jobs on a video file")
+        start = time.perf_counter()
+        samples = analyze_video(
+            args.video, args.jobs, flip=args.flip, equalizehist=args.equalizehist,
+            detection_scale=args.scale, profile=profile, pupil_backend=args.pupil_backend,
+            face_detector=args.detector)
+        duration = time.perf_counter() - start
+        print(f"{len(samples)} frames analyzed in {duration:.1f}s ({len(samples) / duration:.1f} fps), "
+              f"pupils located in {np.mean(samples['located']):.2%} of them")
+        if args.output:
+            np.save(args.output, samples)
+        if recorder is not None:
+            recorder.write(samples)
+    elif args.video or not args.image:
         if args.video is None:
             video = 0
         elif args.video.isdigit():
             video = int(args.video)
         else:
             video = args.video
-        gaze = GazeTrackingFromVideo(video, equalizehist=args.equalizehist, flip=args.flip)
+        gaze = GazeTrackingFromVideo(
+            video, equalizehist=args.equalizehist, flip=args.flip,
+            track_face=args.track_face, detection_scale=args.scale, threaded=args.threaded,
+            keyframe_interval=args.keyframes, instrument=bool(args.stats or args.metrics_port),
+            profile=profile, adaptive_calibration=args.adaptive, pupil_backend=args.pupil_backend,
+            face_detector=args.detector)
+        reporter = None
+        if args.stats or args.metrics_port:
+            reporter = StatsReporter(gaze.stats, args.stats, args.metrics_port)
         fps = gaze.fps
 
+        out = None
         if args.output:
-            fourcc = cv2.VideoWriter_fourcc(*args.fourcc)
-            out = cv2.VideoWriter(args.output, fourcc, fps, (gaze.width, gaze.height), True)
+            out = ThreadedVideoWriter(args.output, args.fourcc, fps, (gaze.width, gaze.height))
 
         for _ in gaze:
+            if recorder is not None:
+                recorder.record(gaze, gaze.timestamp)
+            if out is None and args.no_display:
+                continue
+
             gaze.annotated_frame()
-            if args.output:
-                out.write(gaze.frame)
-            gaze.show()
-            
-            if cv2.waitKey(max(1000 // fps, 10)) == 27:
-                break
+            if out is not None:
+                # the frames read from the capture are new arrays, so no copy is needed,
+                # but the equalized frames share a scratch buffer
+                out.write(gaze.frame.copy() if gaze.equalizehist else gaze.frame)
+            if not args.no_display:
+                gaze.show()
+                if cv2.waitKey(max(1000 // fps, 10)) == 27:
+                    break
         
         gaze.release()
-        if args.output:
+        if reporter is not None:
+            reporter.close()
+        if gaze.face_tracker is not None:
+            print(f"face tracking hit rate: {gaze.face_tracker.hit_rate:.2%}")
+        if gaze.dropped_frames:
+            print(f"dropped frames: {gaze.dropped_frames}")
+        if out is not None:
             out.release()
+        calibration = gaze.calibration
+        if args.profile and calibration.is_complete() and (profile is None or calibration.rejected or args.adaptive):
+            path = store.save(calibration.to_profile(args.profile, camera))
+            print(f"calibration profile saved to {path}")
+
+    if recorder is not None:
+        recorder.close()
+        print(f"{recorder.count} samples exported to {recorder.path}")
 
-main(*sys.argv[1:])
\ No newline at end of file
+if __name__ == "__main__":
+    main(*sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,127 @@
+import asyncio
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Optional, Tuple, Union
+import numpy as np
+import cv2
+
+from .gaze_tracking import GazeTrackingFromVideo
+
+
+_END = object()
+
+
+class AsyncGazeTracking(object):
+    """
+    This class tracks the gaze in a video or camera stream for asyncio code.
+    The frames are read and analyzed on an executor, never on the event
+    loop, so many streams can be multiplexed in one loop:
+
+        async with AsyncGazeTracking(0) as tracker:
+            async for sample in tracker:
+                print(sample["horizontal_ratio"])
+    """
+    __slots__ = ["gaze", "with_frame", "_executor", "_own_executor", "_prefetch", "_queue", "_task",
+                 "_pending", "_released"]
+
+    def __init__(
+        self,
+        capture: Union[str, int, cv2.VideoCapture] = 0,
+        *,
+        executor: Optional[Executor] = None,
+        prefetch: int = 2,
+        with_frame: bool = False,
+        **kwds: Any
+    ):
+        """
+        Arguments:
+            capture: Video path, ID of camera or opened VideoCapture
+            executor (concurrent.futures.Executor): Executor reading and analyzing the frames,
+                a dedicated thread by default; the frames of a stream are always analyzed one at a time
+            prefetch (int): Maximum number of samples analyzed ahead of the consumer,
+                the stream is not read further until they are consumed
+            with_frame (bool): Yield (sample, frame) pairs instead of samples
+            kwds: Arguments passed to GazeTrackingFromVideo
+        """
+        self.gaze = GazeTrackingFromVideo(capture, **kwds)
+        self.with_frame = with_frame
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(1, thread_name_prefix="gaze-async")
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # _pending is the step running on the executor, which cannot be interrupted
+        self._pending: Optional[Future] = None
+        self._released = False
+        self._prefetch = max(prefetch, 1)
+
+    def _step(self) -> Any:
+        """Reads and analyzes the next frame, on the executor
+
+        Returns:
+            The sample of the frame (see sample.SAMPLE_DTYPE), with the frame if requested,
+            or _END at the end of the stream
+        """
+        try:
+            frame = next(self.gaze)
+        except StopIteration:
+            return _END
+        sample = self.gaze.sample
+        return (sample, frame) if self.with_frame else sample
+
+    async def _produce(self) -> None:
+        queue = self._queue
+        try:
+            while True:
+                self._pending = self._executor.submit(self._step)
+                item = await asyncio.wrap_future(self._pending)
+                await queue.put(item)
+                if item is _END:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+
+    def __aiter__(self) -> "AsyncGazeTracking":
+        return self
+
+    async def __anext__(self) -> Union[np.void, Tuple[np.void, np.ndarray]]:
+        if self._released:
+            raise StopAsyncIteration
+        if self._task is None:
+            self._queue = asyncio.Queue(self._prefetch)
+            self._task = asyncio.ensure_future(self._produce())
+
+        item = await self._queue.get()
+        if item is _END or isinstance(item, Exception):
+            # kept for the next calls, the stream is over
+            self._queue.put_nowait(item)
+            if item is _END:
+                raise StopAsyncIteration
+            raise item
+        return item
+
+    async def release(self) -> None:
+        """Stops reading the stream and releases it, once the frame being
+        analyzed, if any, is done
+        """
+        if self._released:
+            return
+        self._released = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        pending = self._pending
+        if pending is not None and not pending.done():
+            await asyncio.wait([asyncio.wrap_future(pending)])
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.gaze.release)
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self) -> "AsyncGazeTracking":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.release()
@@ -0,0 +1,483 @@
+import os
+import sys
+import glob
+import json
+import time
+import platform
+from argparse import ArgumentParser
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import cv2
+import dlib
+
+from . import models
+from .eye import LEFT_EYE, RIGHT_EYE, Eye
+from .pupil import BACKENDS, Pupil
+from .calibration import Calibration
+from .detector import FaceTracker, available_detectors
+from .gaze_tracking import GazeTracking
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _max_rss() -> Optional[int]:
+    """Returns the peak resident memory of the process in bytes, if known"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _rss_delta(before: Optional[int], count: int) -> Optional[float]:
+    after = _max_rss()
+    if before is None or after is None:
+        return None
+    return (after - before) / count
+
+
+def bench_startup(instances: int = 5) -> Dict[str, Optional[float]]:
+    """Measures the construction time and memory of GazeTracking instances,
+    with the models shared through the registry and loaded per instance.
+
+    Arguments:
+        instances (int): Number of instances created in each mode
+    """
+    trackers: List[GazeTracking] = []
+    models.clear()
+
+    rss = _max_rss()
+    start = time.perf_counter()
+    trackers.append(GazeTracking())
+    first = time.perf_counter() - start
+    first_rss = _rss_delta(rss, 1)
+
+    rss = _max_rss()
+    start = time.perf_counter()
+    for _ in range(instances):
+        trackers.append(GazeTracking())
+    shared = (time.perf_counter() - start) / instances
+    shared_rss = _rss_delta(rss, instances)
+
+    rss = _max_rss()
+    start = time.perf_counter()
+    for _ in range(instances):
+        models.clear()
+        trackers.append(GazeTracking())
+    unshared = (time.perf_counter() - start) / instances
+    unshared_rss = _rss_delta(rss, instances)
+
+    return {
+        "first_instance_seconds": first,
+        "first_instance_bytes": first_rss,
+        "shared_instance_seconds": shared,
+        "shared_instance_bytes": shared_rss,
+        "unshared_instance_seconds": unshared,
+        "unshared_instance_bytes": unshared_rss,
+    }
+
+
+STAGES = ("gray", "face_detection", "landmarks", "eye_isolation", "calibration", "pupil")
+RESOLUTIONS = ((640, 480), (1280, 720), (1920, 1080))
+# below this face detection rate, the end-to-end measures time the frames
+# without a face and are neither recorded nor compared
+MIN_DETECTION_RATE = 0.9
+END_TO_END = ("refresh", "refresh_fps", "batch_fps")
+
+
+def synthetic_frames(count: int = 20, size: Tuple[int, int] = (640, 480), seed: int = 0) -> List[np.ndarray]:
+    """Returns generated frames of a drawn face whose pupils move.
+    The HOG detector finds the face in every frame at the default size, but
+    not once run_suite stretches the frames to the 16:9 resolutions: the stages
+    after the detection then run on the box where the face was drawn, and the
+    end-to-end measures are left out (see bench_stages). Use a corpus of real
+    faces to measure them at every resolution.
+
+    Arguments:
+        count (int): Number of frames
+        size (tuple): (width, height) of the frames
+        seed (int): Seed of the background noise
+    """
+    width, height = size
+    rng = np.random.RandomState(seed)
+    background = rng.randint(60, 120, (height, width, 3)).astype(np.uint8)
+    center = (width // 2, height // 2)
+    unit = min(width, height) // 8
+
+    frames = []
+    for index in range(count):
+        frame = background.copy()
+        cv2.ellipse(frame, center, (int(unit * 1.6), unit * 2), 0, 0, 360, (150, 180, 220), -1)
+        shift = int(unit * 0.15 * np.sin(index / 3))
+        for side in (-1, 1):
+            eye = (center[0] + side * int(unit * 0.7), center[1] - unit // 3)
+            cv2.ellipse(frame, eye, (unit // 3, unit // 7), 0, 0, 360, (240, 240, 240), -1)
+            cv2.circle(frame, (eye[0] + shift, eye[1]), unit // 9, (30, 30, 30), -1)
+            cv2.line(frame, (eye[0] - unit // 3, eye[1] - unit // 4), (eye[0] + unit // 3, eye[1] - unit // 4),
+                     (40, 50, 60), max(unit // 20, 1))
+        cv2.ellipse(frame, (center[0], center[1] + unit), (unit // 2, unit // 6), 0, 0, 180, (60, 60, 140), -1)
+        frames.append(frame)
+    return frames
+
+
+def synthetic_eyes(count: int = 200, seed: int = 0) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Returns generated eye frames, isolated as Eye does, and the position of
+    their pupil, so that the pupil backends can be compared with the truth.
+
+    Arguments:
+        count (int): Number of eye frames
+        seed (int): Seed of the sizes, positions and noise
+    """
+    rng = np.random.RandomState(seed)
+    eyes = []
+    truths = np.empty((count, 2))
+    for index in range(count):
+        width, height = rng.randint(30, 70), rng.randint(14, 30)
+        margin = 5
+        frame = np.full((height + 2 * margin, width + 2 * margin), 255, np.uint8)
+        center = (margin + width // 2, margin + height // 2)
+        axes = (width // 2, height // 2)
+
+        eye = np.full_like(frame, rng.randint(150, 220))
+        radius = max(int(height * rng.uniform(0.35, 0.5)), 3)
+        pupil = (center[0] + int(rng.uniform(-0.6, 0.6) * (axes[0] - radius)),
+                 center[1] + int(rng.uniform(-0.3, 0.3) * axes[1]))
+        cv2.circle(eye, pupil, radius, int(rng.randint(40, 90)), -1)
+        cv2.circle(eye, pupil, max(radius // 2, 1), int(rng.randint(5, 35)), -1)
+        # eyelashes along the upper eyelid
+        cv2.ellipse(eye, center, axes, 0, 200, 340, int(rng.randint(20, 70)), max(height // 8, 1))
+        noise = rng.normal(0, 6, eye.shape)
+        eye = np.clip(eye + noise, 0, 255).astype(np.uint8)
+
+        mask = np.zeros_like(frame)
+        cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
+        np.copyto(frame, eye, where=mask.astype(bool))
+        eyes.append(frame)
+        truths[index] = pupil
+    return eyes, truths
+
+
+def bench_pupils(
+    eyes: List[np.ndarray],
+    truths: Optional[np.ndarray] = None,
+    repeat: int = 3
+) -> Dict[str, Any]:
+    """Measures the speed and accuracy of every pupil backend on the same eye frames.
+    The error is the distance to the true pupil positions, or to the positions
+    found by the default backend if they are unknown.
+
+    Arguments:
+        eyes (list): Isolated eye frames, see synthetic_eyes
+        truths (numpy.ndarray): (x, y) positions of the pupils
+        repeat (int): Number of passes over the eye frames
+    """
+    thresholds = [Calibration.find_best_threshold(eye) for eye in eyes]
+    if truths is None:
+        reference = [Pupil(eye, threshold) for eye, threshold in zip(eyes, thresholds)]
+        truths = np.array([(pupil.x, pupil.y) for pupil in reference], float)
+        truths[(truths < 0).any(axis=1)] = np.nan
+
+    results: Dict[str, Any] = {}
+    for backend in BACKENDS:
+        timings: List[float] = []
+        for _ in range(repeat):
+            positions = [_timed(timings, Pupil, eye, threshold, None, backend)
+                         for eye, threshold in zip(eyes, thresholds)]
+        positions = np.array([(pupil.x, pupil.y) for pupil in positions], float)
+        found = (positions >= 0).all(axis=1)
+        errors = np.hypot(*(positions - truths).T)[found & ~np.isnan(truths).any(axis=1)]
+
+        result = _summary(timings)
+        result["found_rate"] = float(found.mean())
+        result["mean_error_px"] = float(errors.mean()) if len(errors) else None
+        result["p95_error_px"] = float(np.percentile(errors, 95)) if len(errors) else None
+        results[backend] = result
+    return results
+
+
+def load_corpus(path: str, limit: int = 20) -> List[np.ndarray]:
+    """Reads the frames of a video file, or the images of a directory or glob pattern
+
+    Arguments:
+        path (str): Video path, image directory or glob pattern
+        limit (int): Maximum number of frames read
+    """
+    if os.path.isdir(path) or any(c in path for c in "*?["):
+        pattern = os.path.join(path, "*") if os.path.isdir(path) else path
+        frames = [cv2.imread(name) for name in sorted(glob.glob(pattern))]
+        frames = [frame for frame in frames if frame is not None][:limit]
+    else:
+        capture = cv2.VideoCapture(path)
+        frames = []
+        while len(frames) < limit:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            frames.append(frame)
+        capture.release()
+
+    if not frames:
+        raise OSError(f"no frame found in '{path}'")
+    return frames
+
+
+def _resize(frames: List[np.ndarray], size: Tuple[int, int]) -> List[np.ndarray]:
+    return [frame if frame.shape[1::-1] == size else cv2.resize(frame, size) for frame in frames]
+
+
+def _summary(timings: List[float]) -> Dict[str, float]:
+    """Returns the statistics of durations in seconds, in milliseconds"""
+    values = np.array(timings) * 1000
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+    }
+
+
+def _timed(timings: List[float], func: Callable[..., Any], *args: Any) -> Any:
+    start = time.perf_counter()
+    result = func(*args)
+    timings.append(time.perf_counter() - start)
+    return result
+
+
+def bench_stages(frames: List[np.ndarray], repeat: int = 3) -> Dict[str, Any]:
+    """Measures every stage of the analysis separately on the frames,
+    then the end-to-end refresh and the batch throughput. The end-to-end
+    measures are left out if the faces are detected in less than
+    MIN_DETECTION_RATE of the frames, as they would mostly time the frames
+    without a face.
+
+    Arguments:
+        frames (list): Frames of the corpus, all of the same size
+        repeat (int): Number of passes over the frames
+    """
+    detector = models.face_detector()
+    predictor = models.shape_predictor()
+    height, width = frames[0].shape[:2]
+    default_face = dlib.rectangle(width // 4, height // 5, width * 3 // 4, height * 4 // 5)
+
+    # a completed calibration, so that Eye does not calibrate while being timed
+    calibration = Calibration()
+    calibration.thresholds_left = [50] * calibration.nb_frames
+    calibration.thresholds_right = [50] * calibration.nb_frames
+
+    timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    detected = 0
+    for _ in range(repeat):
+        for frame in frames:
+            gray = _timed(timings["gray"], cv2.cvtColor, frame, cv2.COLOR_BGR2GRAY)
+            faces = _timed(timings["face_detection"], detector, gray)
+            detected += len(faces) > 0
+            face = faces[0] if len(faces) else default_face
+            landmarks = _timed(timings["landmarks"], predictor, gray, face)
+
+            eyes = [Eye(gray, landmarks, side, calibration) for side in (LEFT_EYE, RIGHT_EYE)]
+            start = time.perf_counter()
+            for eye, side in zip(eyes, (LEFT_EYE, RIGHT_EYE)):
+                eye._isolate(gray, side)
+            timings["eye_isolation"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            thresholds = [Calibration.find_best_threshold(eye.frame) for eye in eyes]
+            timings["calibration"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for eye, threshold in zip(eyes, thresholds):
+                Pupil(eye.frame, threshold)
+            timings["pupil"].append(time.perf_counter() - start)
+
+    result: Dict[str, Any] = {stage: _summary(values) for stage, values in timings.items()}
+    result["detection_rate"] = detected / (len(frames) * repeat)
+    if result["detection_rate"] < MIN_DETECTION_RATE:
+        return result
+
+    refresh: List[float] = []
+    gaze = GazeTracking()
+    for _ in range(repeat):
+        for frame in frames:
+            _timed(refresh, gaze.refresh, frame)
+    result["refresh"] = _summary(refresh)
+    result["refresh_fps"] = 1000 / result["refresh"]["mean_ms"]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        GazeTracking().analyze_batch(frames)
+    result["batch_fps"] = len(frames) * repeat / (time.perf_counter() - start)
+    return result
+
+
+def bench_detectors(frames: List[np.ndarray], repeat: int = 3) -> Dict[str, Any]:
+    """Measures the latency and detection rate of every available face detector
+    backend on the same frames, alone and wrapped in a FaceTracker.
+
+    Arguments:
+        frames (list): Frames of the corpus, in the order of the video
+        repeat (int): Number of passes over the frames
+    """
+    grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+    detectors: Dict[str, Any] = available_detectors()
+    detectors.update({f"{name}+tracker": FaceTracker(detector) for name, detector in list(detectors.items())})
+
+    results: Dict[str, Any] = {}
+    for name, detector in detectors.items():
+        timings: List[float] = []
+        detected = 0
+        for _ in range(repeat):
+            if isinstance(detector, FaceTracker):
+                detector.reset()
+            for gray in grays:
+                detected += len(_timed(timings, detector, gray)) > 0
+        result = _summary(timings)
+        result["detection_rate"] = detected / (len(grays) * repeat)
+        results[name] = result
+    return results
+
+
+def run_suite(
+    frames: Optional[List[np.ndarray]] = None,
+    resolutions: Tuple[Tuple[int, int], ...] = RESOLUTIONS,
+    repeat: int = 3
+) -> Dict[str, Any]:
+    """Runs bench_stages at every resolution, bench_detectors on the frames
+    at their own size, and bench_pupils on generated eye frames.
+
+    Arguments:
+        frames (list): Frames of the corpus, generated frames by default
+        resolutions (tuple): (width, height) the frames are resized to
+        repeat (int): Number of passes over the frames
+    """
+    if frames is None:
+        frames = synthetic_frames()
+    models.preload()
+
+    results: Dict[str, Any] = {}
+    for size in resolutions:
+        results[f"{size[0]}x{size[1]}"] = bench_stages(_resize(frames, size), repeat)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "dlib": getattr(dlib, "__version__", None),
+            "frames": len(frames),
+            "repeat": repeat,
+        },
+        "results": results,
+        "detectors": bench_detectors(frames, repeat),
+        "pupils": bench_pupils(*synthetic_eyes(), repeat=repeat),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.1) -> List[str]:
+    """Returns the regressions of the current results against the baseline:
+    stages or detectors slower, or throughputs lower, by more than the tolerance,
+    and detectors finding faces in fewer frames.
+
+    Arguments:
+        current (dict): Results of run_suite
+        baseline (dict): Results of run_suite saved earlier
+        tolerance (float): Relative slowdown accepted
+    """
+    regressions = []
+    for backend, result in current.get("pupils", {}).items():
+        reference = baseline.get("pupils", {}).get(backend)
+        if reference is not None and result["mean_ms"] > reference["mean_ms"] * (1 + tolerance):
+            regressions.append(f"pupil {backend}: {reference['mean_ms']:.3f}ms -> {result['mean_ms']:.3f}ms")
+    for name, result in current.get("detectors", {}).items():
+        reference = baseline.get("detectors", {}).get(name)
+        if reference is None:
+            continue
+        if result["mean_ms"] > reference["mean_ms"] * (1 + tolerance):
+            regressions.append(f"detector {name}: {reference['mean_ms']:.2f}ms -> {result['mean_ms']:.2f}ms")
+        # the detections are deterministic on the same corpus, any miss more is a regression
+        if result["detection_rate"] < reference["detection_rate"]:
+            regressions.append(f"detector {name} detection rate: "
+                               f"{reference['detection_rate']:.0%} -> {result['detection_rate']:.0%}")
+    for resolution, results in current["results"].items():
+        reference = baseline["results"].get(resolution)
+        if reference is None:
+            continue
+        # a baseline saved before the end-to-end measures were checked may hold them
+        end_to_end = min(results.get("detection_rate", 0), reference.get("detection_rate", 0)) >= MIN_DETECTION_RATE
+        for name, value in results.items():
+            if name not in reference or (name in END_TO_END and not end_to_end):
+                continue
+            if isinstance(value, dict):
+                now, before = value["mean_ms"], reference[name]["mean_ms"]
+                if now > before * (1 + tolerance):
+                    regressions.append(f"{resolution} {name}: {before:.2f}ms -> {now:.2f}ms")
+            elif name.endswith("_fps"):
+                now, before = value, reference[name]
+                if now < before / (1 + tolerance):
+                    regressions.append(f"{resolution} {name}: {before:.1f} -> {now:.1f}")
+    return regressions
+
+
+def _parse_resolutions(value: str) -> Tuple[Tuple[int, int], ...]:
+    return tuple(tuple(int(i) for i in size.split("x")) for size in value.split(","))
+
+
+def main(*argv: str) -> None:
+    parse = ArgumentParser("gaze tracking benchmark")
+    parse.add_argument("bench", choices=["startup", "stages", "pupils", "detectors", "compare"],
+        help="benchmark to run, 'compare' runs the stages and compares them with a baseline")
+    parse.add_argument("--eyes", type=int, default=200, help="number of generated eye frames of the pupil benchmark")
+    parse.add_argument("-n", "--instances", type=int, default=5, help="number of trackers created")
+    parse.add_argument("-c", "--corpus", help="video path, image directory or glob pattern of the frames")
+    parse.add_argument("--frames", type=int, default=20, help="maximum number of frames of the corpus")
+    parse.add_argument("-r", "--repeat", type=int, default=3, help="number of passes over the frames")
+    parse.add_argument("--resolutions", type=_parse_resolutions, default=RESOLUTIONS,
+        help="comma separated WIDTHxHEIGHT list")
+    parse.add_argument("-o", "--output", help="save the results as a JSON baseline")
+    parse.add_argument("-b", "--baseline", help="JSON baseline compared with")
+    parse.add_argument("-t", "--tolerance", type=float, default=0.1, help="relative slowdown accepted")
+
+    args = parse.parse_args(argv)
+    baseline = None
+    if args.bench == "compare":
+        if not args.baseline:
+            parse.error("compare needs a baseline")
+        try:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            parse.error(f"cannot read the baseline '{args.baseline}': {e}")
+        if not isinstance(baseline, dict) or not isinstance(baseline.get("results"), dict):
+            parse.error(f"'{args.baseline}' is not a baseline saved by the stages or compare benchmark")
+
+    if args.bench == "startup":
+        result = bench_startup(args.instances)
+    elif args.bench == "pupils":
+        result = bench_pupils(*synthetic_eyes(args.eyes), repeat=args.repeat)
+    elif args.bench == "detectors":
+        frames = load_corpus(args.corpus, args.frames) if args.corpus else synthetic_frames(args.frames)
+        result = bench_detectors(frames, args.repeat)
+    else:
+        frames = load_corpus(args.corpus, args.frames) if args.corpus else synthetic_frames(args.frames)
+        result = run_suite(frames, args.resolutions, args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+
+    if args.bench in ("stages", "compare"):
+        for resolution, results in result["results"].items():
+            if results["detection_rate"] < MIN_DETECTION_RATE:
+                print(f"{resolution}: faces detected in {results['detection_rate']:.0%} of the frames, "
+                      f"the end-to-end measures are left out", file=sys.stderr)
+
+    if baseline is not None:
+        regressions = compare(result, baseline, args.tolerance)
+        for regression in regressions:
+            print("regression:", regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
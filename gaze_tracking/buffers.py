@@ -0,0 +1,51 @@
+from typing import Dict, Tuple
+import numpy as np
+
+
+class FrameBuffers(object):
+    """
+    This class owns scratch arrays reused from one frame to the next,
+    so that the steady-state analysis does not allocate new images.
+    """
+    __slots__ = ["_buffers", "growth", "allocations"]
+
+    def __init__(self, growth: float = 1.5):
+        """
+        Arguments:
+            growth (float): Headroom given to a buffer when it has to grow, so
+                that small size variations (e.g. eye crops) do not reallocate it
+        """
+        self._buffers: Dict[str, np.ndarray] = {}
+        self.growth = growth
+        self.allocations = 0
+
+    def get(self, name: str, shape: Tuple[int, ...], dtype: type = np.uint8) -> np.ndarray:
+        """Returns a contiguous array of the given shape backed by the named buffer.
+        The content of the array is undefined.
+
+        Arguments:
+            name (str): Name of the buffer
+            shape (tuple): Shape of the returned array
+            dtype: Type of the array elements
+        """
+        size = 1
+        for dim in shape:
+            size *= dim
+
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.size < size:
+            capacity = size if buffer is None else int(size * self.growth)
+            buffer = np.empty(capacity, dtype)
+            self._buffers[name] = buffer
+            self.allocations += 1
+
+        return buffer[:size].reshape(shape)
+
+    @property
+    def nbytes(self) -> int:
+        """Returns the memory held by all the buffers"""
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def clear(self) -> None:
+        """Releases all the buffers"""
+        self._buffers.clear()
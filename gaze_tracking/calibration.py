@@ -1,7 +1,14 @@
 from __future__ import division
+import time
+import queue
+import threading
+import weakref
+from collections import deque
+from typing import Optional, Tuple
 import cv2
 import numpy as np
 from .pupil import Pupil
+from .profiles import CalibrationProfile
 
 
 class Calibration(object):
@@ -9,17 +16,67 @@ class Calibration(object):
     This class calibrates the pupil detection algorithm by finding the
     best binarization threshold value for the person and the webcam.
     """
-    __slots__ = ["nb_frames", "thresholds_left", "thresholds_right"]
+    __slots__ = ["nb_frames", "threshold_step", "thresholds_left", "thresholds_right",
+                 "checks", "tolerance", "measured_left", "measured_right", "rejected"]
 
-    def __init__(self):
+    def __init__(self, threshold_step: int = 5):
+        """
+        Arguments:
+            threshold_step (int): Gap between two candidate thresholds
+        """
         self.nb_frames = 20
+        self.threshold_step = threshold_step
         self.thresholds_left = []
         self.thresholds_right = []
 
+        # checks is the number of frames a loaded profile is checked on,
+        # measured_* the thresholds found on them
+        self.checks = 0
+        self.tolerance = 2 * threshold_step
+        self.measured_left = []
+        self.measured_right = []
+        self.rejected = False
+
     def is_complete(self) -> bool:
         """Returns true if the calibration is completed"""
         return len(self.thresholds_left) >= self.nb_frames and len(self.thresholds_right) >= self.nb_frames
 
+    def is_checking(self) -> bool:
+        """Returns true if a loaded profile is still being checked"""
+        return self.checks > 0
+
+    def load(self, profile: CalibrationProfile, checks: int = 5, tolerance: Optional[int] = None) -> None:
+        """Completes the calibration with the thresholds of a profile.
+        The profile is then checked on the next frames: if the thresholds
+        found on them are too far from the profile, the calibration restarts.
+
+        Arguments:
+            profile (profiles.CalibrationProfile): Thresholds saved by an earlier session
+            checks (int): Number of frames the profile is checked on, 0 to trust it
+            tolerance (int): Maximum gap between the profile and the measured thresholds,
+                two threshold steps by default
+        """
+        self.threshold_step = profile.threshold_step
+        self.thresholds_left = [profile.threshold_left] * self.nb_frames
+        self.thresholds_right = [profile.threshold_right] * self.nb_frames
+        self.checks = checks
+        self.tolerance = 2 * profile.threshold_step if tolerance is None else tolerance
+        self.measured_left = []
+        self.measured_right = []
+        self.rejected = False
+
+    def to_profile(self, user: str, camera: str) -> CalibrationProfile:
+        """Returns the profile of the completed calibration
+
+        Arguments:
+            user (str): Name of the user
+            camera (str): Name of the camera
+        """
+        if not self.is_complete():
+            raise ValueError("the calibration is not complete")
+        return CalibrationProfile(
+            user, camera, self.threshold(1), self.threshold(2), self.threshold_step)
+
     def threshold(self, side: int) -> int:
         """Returns the threshold value for the given eye.
 
@@ -48,34 +105,224 @@ class Calibration(object):
         return nb_blacks / nb_pixels
 
     @staticmethod
-    def find_best_threshold(eye_frame: np.ndarray) -> int:
+    def find_best_threshold(eye_frame: np.ndarray, step: int = 5, out: Optional[np.ndarray] = None) -> int:
         """Calculates the optimal threshold to binarize the
         frame for the given eye.
 
-        Argument:
+        The eye frame is filtered once, then the iris size of every
+        candidate threshold is read from the cumulative histogram.
+
+        Arguments:
             eye_frame (numpy.ndarray): Frame of the eye to be analyzed
+            step (int): Gap between two candidate thresholds
+            out (numpy.ndarray): Scratch array of the eye frame shape
         """
         average_iris_size = 0.48
-        trials = {}
 
-        for threshold in range(5, 100, 5):
-            iris_frame = Pupil.image_processing(eye_frame, threshold)
-            trials[threshold] = Calibration.iris_size(iris_frame)
+        frame = Pupil.smoothing(eye_frame, out)[5:-5, 5:-5]
+        nb_pixels = frame.size
+        # nb_blacks[t] is the number of pixels binarized to black with the threshold t
+        nb_blacks = np.cumsum(np.bincount(frame.ravel(), minlength=256))
 
-        best_threshold, iris_size = min(trials.items(), key=(lambda p: abs(p[1] - average_iris_size)))
-        return best_threshold
+        thresholds = np.arange(5, 100, step)
+        iris_sizes = nb_blacks[thresholds] / nb_pixels
+        return int(thresholds[np.argmin(np.abs(iris_sizes - average_iris_size))])
 
-    def evaluate(self, eye_frame: np.ndarray, side: int) -> None:
+    def evaluate(self, eye_frame: np.ndarray, side: int, out: Optional[np.ndarray] = None) -> None:
         """Improves calibration by taking into consideration the
         given image.
 
         Arguments:
             eye_frame (numpy.ndarray): Frame of the eye
             side: Indicates whether it's the left eye (0) or the right eye (1)
+            out (numpy.ndarray): Scratch array of the eye frame shape
         """
-        threshold = self.find_best_threshold(eye_frame)
+        threshold = self.find_best_threshold(eye_frame, self.threshold_step, out)
 
         if side == 1:
             self.thresholds_left.append(threshold)
         elif side == 2:
             self.thresholds_right.append(threshold)
+
+    def submit(self, eye_frame: np.ndarray, side: int) -> None:
+        """Hands the frame of an eye over once the calibration is complete.
+        The thresholds of a complete calibration are frozen, so the frame is
+        ignored; see AdaptiveCalibration.
+
+        Arguments:
+            eye_frame (numpy.ndarray): Frame of the eye
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+        """
+
+    def close(self) -> None:
+        """Releases the resources of the calibration"""
+
+    def check(self, eye_frame: np.ndarray, side: int, out: Optional[np.ndarray] = None) -> None:
+        """Compares the loaded profile with the threshold found on the given image.
+        Once both eyes are checked on enough frames, the profile is kept or the
+        calibration restarts from the thresholds measured meanwhile.
+
+        Arguments:
+            eye_frame (numpy.ndarray): Frame of the eye
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+            out (numpy.ndarray): Scratch array of the eye frame shape
+        """
+        threshold = self.find_best_threshold(eye_frame, self.threshold_step, out)
+        if side == 1:
+            self.measured_left.append(threshold)
+        elif side == 2:
+            self.measured_right.append(threshold)
+        if min(len(self.measured_left), len(self.measured_right)) < self.checks:
+            return
+
+        gap = max(
+            abs(sum(self.measured_left) / len(self.measured_left) - self.threshold(1)),
+            abs(sum(self.measured_right) / len(self.measured_right) - self.threshold(2)))
+        if gap > self.tolerance:
+            self.thresholds_left = self.measured_left
+            self.thresholds_right = self.measured_right
+            self.rejected = True
+        self.measured_left = []
+        self.measured_right = []
+        self.checks = 0
+
+
+def _stop_refining(samples: "queue.Queue[Optional[Tuple[np.ndarray, int]]]") -> None:
+    """Asks the background thread of an adaptive calibration to stop. If the
+    queue is full, the thread stops at the next frame, finding its
+    calibration collected.
+    """
+    try:
+        samples.put_nowait(None)
+    except queue.Full:
+        pass
+
+
+def _refine(reference: "weakref.ReferenceType[AdaptiveCalibration]",
+            samples: "queue.Queue[Optional[Tuple[np.ndarray, int]]]") -> None:
+    """Runs the background thread of an adaptive calibration. The thread only
+    holds a weak reference to it, so that the calibration can be collected.
+    """
+    while True:
+        item = samples.get()
+        calibration = reference()
+        if item is None or calibration is None:
+            break
+        eye_frame, side = item
+        calibration._update(calibration.find_best_threshold(eye_frame, calibration.threshold_step), side)
+        calibration.updates += 1
+        del calibration
+
+
+class AdaptiveCalibration(Calibration):
+    """
+    This class keeps refining the thresholds after the calibration:
+    eye frames are sampled at a low rate and handed over to a background
+    thread, which replaces the thresholds with the average of a rolling
+    window. The frame loop only reads the latest thresholds, so the lighting
+    changes are followed without any calibration cost on the analysis.
+    The thread starts with the first frame sampled, and stops on close() or
+    once the calibration is collected.
+    """
+    __slots__ = ["interval", "updates", "_thresholds", "_next_sample", "_queue", "_thread", "_finalizer",
+                 "__weakref__"]
+
+    def __init__(self, threshold_step: int = 5, window: int = 20, interval: float = 0.5):
+        """
+        Arguments:
+            threshold_step (int): Gap between two candidate thresholds
+            window (int): Number of latest thresholds averaged for every eye
+            interval (float): Minimum number of seconds between two samples of an eye
+        """
+        super().__init__(threshold_step)
+        self.nb_frames = 1
+        self.interval = interval
+        self.updates = 0
+        # thresholds_* are rolling windows, only appended to by the background
+        # thread once the first threshold of every eye is found
+        self.thresholds_left = deque(maxlen=window)
+        self.thresholds_right = deque(maxlen=window)
+        # _thresholds is replaced as a whole, so a reader never sees a partial update
+        self._thresholds: Tuple[Optional[int], Optional[int]] = (None, None)
+        self._next_sample = [0.0, 0.0]
+        self._queue: "queue.Queue[Optional[Tuple[np.ndarray, int]]]" = queue.Queue(2)
+        self._thread: Optional[threading.Thread] = None
+        self._finalizer = weakref.finalize(self, _stop_refining, self._queue)
+
+    def __getstate__(self) -> None:
+        raise TypeError("an adaptive calibration cannot be shared with other processes")
+
+    def is_complete(self) -> bool:
+        """Returns true once every eye has a threshold"""
+        left, right = self._thresholds
+        return left is not None and right is not None
+
+    def threshold(self, side: int) -> int:
+        """Returns the latest threshold value for the given eye.
+
+        Argument:
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+        """
+        if side not in (1, 2):
+            raise NotImplementedError
+        return self._thresholds[side - 1]
+
+    def _update(self, threshold: int, side: int) -> None:
+        thresholds = self.thresholds_left if side == 1 else self.thresholds_right
+        thresholds.append(threshold)
+        average = int(sum(thresholds) / len(thresholds))
+        left, right = self._thresholds
+        self._thresholds = (average, right) if side == 1 else (left, average)
+
+    def evaluate(self, eye_frame: np.ndarray, side: int, out: Optional[np.ndarray] = None) -> None:
+        """Finds the first threshold of an eye in the frame loop, the next
+        ones are found in the background.
+
+        Arguments:
+            eye_frame (numpy.ndarray): Frame of the eye
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+            out (numpy.ndarray): Scratch array of the eye frame shape
+        """
+        if self._thresholds[side - 1] is None:
+            self._update(self.find_best_threshold(eye_frame, self.threshold_step, out), side)
+
+    def load(self, profile: CalibrationProfile, checks: int = 0, tolerance: Optional[int] = None) -> None:
+        """Starts from the thresholds of a profile, which the background
+        thread then adapts, so the profile needs no check.
+        """
+        self.threshold_step = profile.threshold_step
+        self.thresholds_left.clear()
+        self.thresholds_right.clear()
+        self._update(profile.threshold_left, 1)
+        self._update(profile.threshold_right, 2)
+
+    def submit(self, eye_frame: np.ndarray, side: int) -> None:
+        """Samples the frame of an eye for the background thread, unless the
+        eye was sampled less than `interval` seconds ago or the thread is busy.
+
+        Arguments:
+            eye_frame (numpy.ndarray): Frame of the eye
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+        """
+        now = time.monotonic()
+        if now < self._next_sample[side - 1]:
+            return
+        if self._thread is None:
+            if not self._finalizer.alive:
+                return
+            self._thread = threading.Thread(
+                target=_refine, args=(weakref.ref(self), self._queue), name="gaze-calibration", daemon=True)
+            self._thread.start()
+        try:
+            # the eye frame is a scratch array reused by the next frame
+            self._queue.put_nowait((eye_frame.copy(), side))
+            self._next_sample[side - 1] = now + self.interval
+        except queue.Full:
+            pass
+
+    def close(self) -> None:
+        """Stops the background thread"""
+        self._finalizer.detach()
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
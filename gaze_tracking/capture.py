@@ -0,0 +1,137 @@
+import time
+import queue
+import threading
+from typing import Optional, Tuple
+import numpy as np
+import cv2
+
+
+# put by the reader thread once it stops, for whatever reason
+_END = None
+
+
+class ThreadedCapture(object):
+    """
+    This class reads a VideoCapture on a background thread and hands the
+    frames over through a bounded queue, so that decoding and analysis
+    run concurrently.
+    """
+    __slots__ = ["capture", "drop_stale", "video_time", "_dropped", "_lock", "_queue", "_stop", "_ended", "_thread"]
+
+    def __init__(
+        self,
+        capture: cv2.VideoCapture,
+        queue_size: int = 4,
+        drop_stale: bool = False,
+        video_time: bool = False
+    ):
+        """
+        Arguments:
+            capture (cv2.VideoCapture): Opened capture to read from
+            queue_size (int): Maximum number of frames waiting for the analysis
+            drop_stale (bool): Always hand over the latest frame and drop the older ones,
+                instead of waiting until every frame is processed
+            video_time (bool): Stamp the frames with their position in the video
+                (e.g. a file) instead of the time they are read at
+        """
+        self.capture = capture
+        self.drop_stale = drop_stale
+        self.video_time = video_time
+        # _dropped is counted by both threads, under _lock
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Tuple[bool, Optional[np.ndarray], float]]]" = \
+            queue.Queue(max(queue_size, 1))
+        self._stop = threading.Event()
+        self._ended = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="gaze-capture", daemon=True)
+        self._thread.start()
+
+    @property
+    def dropped(self) -> int:
+        """Returns the number of frames read but never handed over"""
+        with self._lock:
+            return self._dropped
+
+    def _count_dropped(self) -> None:
+        with self._lock:
+            self._dropped += 1
+
+    def _put(self, item: Tuple[bool, Optional[np.ndarray], float]) -> None:
+        """Queues a frame, dropping the oldest one if stale frames are dropped"""
+        while not self._stop.is_set():
+            if self.drop_stale:
+                try:
+                    self._queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self._count_dropped()
+                    except queue.Empty:
+                        pass
+            else:
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+    def _run(self) -> None:
+        try:
+            while not self._stop.is_set():
+                ret, frame = self.capture.read()
+                if self.video_time:
+                    timestamp = self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                else:
+                    timestamp = time.time()
+                self._put((ret, frame, timestamp))
+                if not ret:
+                    break
+        finally:
+            # the end is also signaled when the queue is full, read then sees _ended
+            self._ended.set()
+            try:
+                self._queue.put_nowait(_END)
+            except queue.Full:
+                pass
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray], float]:
+        """Returns the next frame as (ret, frame, timestamp), see video_time.
+        If stale frames are dropped, this is the latest captured frame.
+        ret is false at the end of the stream, once the reader thread stopped.
+        """
+        while True:
+            if self._stop.is_set():
+                return False, None, time.time()
+            try:
+                item = self._queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self._ended.is_set() and self._queue.empty():
+                    return False, None, time.time()
+
+        if self.drop_stale:
+            while item is not _END and item[0]:
+                try:
+                    newer = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if newer is _END:
+                    # the last frame is still handed over, the end comes next
+                    self._queue.put_nowait(_END)
+                    break
+                item = newer
+                self._count_dropped()
+        if item is _END:
+            # kept for the next calls
+            self._queue.put_nowait(_END)
+            return False, None, time.time()
+        return item
+
+    def release(self) -> None:
+        """Stops the reader thread and releases the capture"""
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.capture.release()
@@ -0,0 +1,105 @@
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import numpy as np
+import cv2
+
+from .buffers import FrameBuffers
+
+
+class FrameContext(object):
+    """
+    This class holds the intermediates of the analysis of a frame: the
+    grayscale frame, its equalized version, the faces, the landmarks and
+    the eyes. Each one is computed on first use and kept under the options
+    it depends on, so that analyzing the frame again with other options
+    only recomputes the stages depending on them.
+    """
+    __slots__ = ["frame", "hits", "misses", "_cache", "_buffers_key"]
+
+    def __init__(self, frame: np.ndarray):
+        """
+        Arguments:
+            frame (numpy.ndarray): BGR frame to analyze, never modified
+        """
+        self.frame = frame
+        self.hits = 0
+        self.misses = 0
+        self._cache: Dict[Tuple[str, Hashable], Any] = {}
+        self._buffers_key: Optional[Hashable] = None
+
+    def get(self, stage: str, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Returns the intermediate of the stage computed with the options key,
+        computing it on first use
+
+        Arguments:
+            stage (str): Name of the stage, e.g. 'faces'
+            key: Options the intermediate depends on
+            loader: Function computing the intermediate
+        """
+        try:
+            value = self._cache[stage, key]
+        except KeyError:
+            self.misses += 1
+            value = loader()
+            self._cache[stage, key] = value
+            return value
+        self.hits += 1
+        return value
+
+    def peek(self, stage: str, key: Hashable) -> Any:
+        """Returns the intermediate of the stage computed with the options key, or None"""
+        value = self._cache.get((stage, key))
+        if value is not None:
+            self.hits += 1
+        return value
+
+    def put(self, stage: str, key: Hashable, value: Any) -> None:
+        """Stores the intermediate of the stage computed with the options key"""
+        self._cache[stage, key] = value
+
+    def owns_buffers(self, key: Hashable) -> bool:
+        """Returns true if the intermediates of the options key may use the scratch
+        buffers of the tracker. They hold those of the first options the frame is
+        analyzed with, the intermediates of the other options get their own arrays.
+        """
+        if self._buffers_key is None:
+            self._buffers_key = key
+        return self._buffers_key == key
+
+    def gray(
+        self,
+        equalized: bool = False,
+        buffers: Optional[FrameBuffers] = None,
+        avoid: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Returns the grayscale frame, with an equalized histogram if requested
+
+        Arguments:
+            equalized (bool): Equalize the histogram of the grayscale frame
+            buffers (buffers.FrameBuffers): Scratch arrays receiving the grayscale frames
+            avoid (numpy.ndarray): Array still in use, e.g. the previous frame of the
+                optical flow, which the returned frame must not overwrite
+        """
+        equalized = bool(equalized)
+        name = "gray_equalized" if equalized else "gray"
+        gray = self._cache.get((name, None))
+        if gray is not None:
+            self.hits += 1
+            return gray
+
+        self.misses += 1
+        out = self._buffer(buffers, name, avoid)
+        if equalized:
+            gray = cv2.equalizeHist(self.gray(False, buffers, avoid), dst=out)
+        else:
+            gray = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY, dst=out)
+        self._cache[name, None] = gray
+        return gray
+
+    def _buffer(self, buffers: Optional[FrameBuffers], name: str, avoid: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        if buffers is None:
+            return None
+        shape = self.frame.shape[:2]
+        out = buffers.get(name, shape)
+        if avoid is not None and np.may_share_memory(avoid, out):
+            out = buffers.get(name + "_next", shape)
+        return out
@@ -0,0 +1,299 @@
+from __future__ import division
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
+import cv2
+import dlib
+
+from . import models
+
+
+def scale_rectangle(rect: dlib.rectangle, factor: float) -> dlib.rectangle:
+    """Returns the rectangle with all its coordinates multiplied by the factor
+
+    Arguments:
+        rect (dlib.rectangle): Rectangle to scale
+        factor (float): Scale factor
+    """
+    return dlib.rectangle(
+        int(round(rect.left() * factor)), int(round(rect.top() * factor)),
+        int(round(rect.right() * factor)), int(round(rect.bottom() * factor)))
+
+
+class FaceTracker(object):
+    """
+    This class wraps a face detector and remembers the last detected face.
+    The following frames are only searched in an expanded region around
+    that face, with a full-frame detection every few frames or when
+    the face is lost.
+    """
+    __slots__ = ["detector", "interval", "margin", "box", "countdown", "roi_hits", "full_scans"]
+
+    def __init__(self, detector: Any, interval: int = 30, margin: float = 0.5):
+        """
+        Arguments:
+            detector: Callable returning the faces found in a grayscale frame
+            interval (int): Maximum number of frames between two full-frame detections
+            margin (float): Expansion of the last face box, relative to its size
+        """
+        self.detector = detector
+        self.interval = interval
+        self.margin = margin
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the last face and the statistics"""
+        self.box: Optional[dlib.rectangle] = None
+        self.countdown = 0
+        self.roi_hits = 0
+        self.full_scans = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Returns the fraction of frames resolved in the region of interest"""
+        total = self.roi_hits + self.full_scans
+        if total == 0:
+            return 0.0
+        return self.roi_hits / total
+
+    def _search_roi(self, frame: np.ndarray) -> Optional[dlib.rectangle]:
+        """Searches the face in the region around the last face box.
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        box = self.box
+        height, width = frame.shape[:2]
+        dx = int(box.width() * self.margin)
+        dy = int(box.height() * self.margin)
+        min_x = max(box.left() - dx, 0)
+        min_y = max(box.top() - dy, 0)
+        max_x = min(box.right() + dx, width)
+        max_y = min(box.bottom() + dy, height)
+        if max_x <= min_x or max_y <= min_y:
+            return None
+
+        roi = np.ascontiguousarray(frame[min_y:max_y, min_x:max_x])
+        faces = self.detector(roi)
+        if len(faces) == 0:
+            return None
+
+        faces = [dlib.rectangle(face.left() + min_x, face.top() + min_y,
+                                face.right() + min_x, face.bottom() + min_y) for face in faces]
+        return max(faces, key=lambda face: box.intersect(face).area())
+
+    def __call__(self, frame: np.ndarray) -> List[dlib.rectangle]:
+        """Returns the faces found in the frame, the tracked face first.
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame
+        """
+        if self.box is not None and self.countdown > 0:
+            face = self._search_roi(frame)
+            if face is not None:
+                self.box = face
+                self.countdown -= 1
+                self.roi_hits += 1
+                return [face]
+
+        faces = list(self.detector(frame))
+        self.full_scans += 1
+        if faces:
+            self.box = faces[0]
+            self.countdown = self.interval
+        else:
+            self.box = None
+            self.countdown = 0
+        return faces
+
+
+class HogDetector(object):
+    """
+    This class detects faces with the dlib HOG detector, the most reliable
+    and the slowest backend.
+    """
+    __slots__ = ["upsample", "threshold"]
+
+    def __init__(self, upsample: int = 0, threshold: float = 0.0):
+        """
+        Arguments:
+            upsample (int): Number of times the frame is upsampled, to find smaller faces
+            threshold (float): Adjustment of the detection threshold, positive to reject more faces
+        """
+        self.upsample = upsample
+        self.threshold = threshold
+
+    def __call__(self, frame: np.ndarray) -> List[dlib.rectangle]:
+        """Returns the faces found in the grayscale frame"""
+        detector = models.face_detector()
+        if self.threshold:
+            return list(detector.run(frame, self.upsample, self.threshold)[0])
+        return list(detector(frame, self.upsample))
+
+
+CASCADES = {
+    "haar": "haarcascade_frontalface_default.xml",
+    "lbp": "lbpcascade_frontalface_improved.xml",
+}
+
+
+class CascadeDetector(object):
+    """
+    This class detects faces with an OpenCV Haar or LBP cascade, much cheaper
+    than the HOG detector but with more misses and false detections.
+    """
+    __slots__ = ["path", "scale_factor", "min_neighbors", "min_size", "_classifier"]
+
+    def __init__(
+        self,
+        kind: str = "haar",
+        path: Optional[str] = None,
+        scale_factor: float = 1.1,
+        min_neighbors: int = 5,
+        min_size: Tuple[int, int] = (30, 30),
+        shared: bool = True
+    ):
+        """
+        Arguments:
+            kind (str): 'haar' or 'lbp', the name of the frontal face cascade looked for
+                in the cascades shipped with OpenCV
+            path (str): Path of the cascade XML file, overriding the kind
+            scale_factor (float): Scale between two levels of the detection pyramid
+            min_neighbors (int): Number of overlapping detections needed to keep a face
+            min_size (tuple): (width, height) of the smallest face
+            shared (bool): Use the classifier shared by the whole process, false to load
+                one for this detector, e.g. when several threads detect faces at once
+        """
+        if not hasattr(cv2, "CascadeClassifier"):
+            raise OSError("this OpenCV build has no cascade classifier")
+        if path is None:
+            if kind not in CASCADES:
+                raise ValueError(f"unknown cascade '{kind}', expected one of {', '.join(CASCADES)}")
+            directory = getattr(getattr(cv2, "data", None), "haarcascades", "")
+            path = os.path.join(directory, CASCADES[kind])
+        self.path = path
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = tuple(min_size)
+        # loaded now, so that a missing cascade fails at once
+        self._classifier = None if shared else models.load_cascade(path)
+        if shared:
+            models.cascade(path)
+
+    def __call__(self, frame: np.ndarray) -> List[dlib.rectangle]:
+        """Returns the faces found in the grayscale frame, the largest first"""
+        classifier = models.cascade(self.path) if self._classifier is None else self._classifier
+        boxes = classifier.detectMultiScale(
+            frame, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors, minSize=self.min_size)
+        boxes = sorted(boxes, key=lambda box: box[2] * box[3], reverse=True)
+        return [dlib.rectangle(int(x), int(y), int(x + w - 1), int(y + h - 1)) for x, y, w, h in boxes]
+
+
+# the factories take shared, see CascadeDetector
+DETECTORS: Dict[str, Callable[..., Any]] = {
+    "hog": lambda shared=True: HogDetector(),
+    "haar": lambda shared=True: CascadeDetector("haar", shared=shared),
+    "lbp": lambda shared=True: CascadeDetector("lbp", shared=shared),
+}
+
+
+def available_detectors(shared: bool = True) -> Dict[str, Any]:
+    """Returns the detector backends which can be created, by name
+
+    Arguments:
+        shared (bool): Use the models shared by the whole process, see CascadeDetector
+    """
+    detectors = {}
+    for name, factory in DETECTORS.items():
+        try:
+            detectors[name] = factory(shared=shared)
+        except (OSError, cv2.error):
+            pass
+    return detectors
+
+
+def measure_detector(detector: Any, frames: Sequence[np.ndarray]) -> Tuple[float, float]:
+    """Returns the mean latency in seconds and the detection rate,
+    the fraction of frames with a face, of a detector on grayscale frames
+    """
+    start = time.perf_counter()
+    detected = sum(len(detector(frame)) > 0 for frame in frames)
+    return (time.perf_counter() - start) / len(frames), detected / len(frames)
+
+
+def select_detector(
+    frames: Sequence[np.ndarray],
+    min_detection_rate: float = 0.9,
+    detectors: Optional[Dict[str, Any]] = None
+) -> Tuple[str, Any]:
+    """Returns the fastest detector whose detection rate on the frames reaches
+    the floor, or the one detecting the most faces if none does.
+
+    Arguments:
+        frames (list): Grayscale frames representative of the session
+        min_detection_rate (float): Minimum fraction of frames where a face is found
+        detectors (dict): Candidate detectors by name, the available backends by default
+
+    Returns:
+        The name of the detector and the detector
+    """
+    detectors = detectors if detectors is not None else available_detectors()
+    measures = {name: measure_detector(detector, frames) for name, detector in detectors.items()}
+    passing = [name for name, (_, rate) in measures.items() if rate >= min_detection_rate]
+    if passing:
+        name = min(passing, key=lambda name: measures[name][0])
+    else:
+        name = max(measures, key=lambda name: (measures[name][1], -measures[name][0]))
+    return name, detectors[name]
+
+
+class AutoDetector(object):
+    """
+    This class detects faces with the HOG detector on the first frames,
+    then switches to the fastest backend meeting the detection-rate floor
+    on those frames.
+    """
+    __slots__ = ["min_detection_rate", "warmup", "shared", "detector", "name", "_frames"]
+
+    def __init__(self, min_detection_rate: float = 0.9, warmup: int = 10, shared: bool = True):
+        """
+        Arguments:
+            min_detection_rate (float): Minimum fraction of frames where a face is found
+            warmup (int): Number of first frames the backends are compared on
+            shared (bool): Use the models shared by the whole process, see CascadeDetector
+        """
+        self.min_detection_rate = min_detection_rate
+        self.warmup = warmup
+        self.shared = shared
+        self.detector: Any = HogDetector()
+        self.name: Optional[str] = None
+        self._frames: List[np.ndarray] = []
+
+    def __call__(self, frame: np.ndarray) -> List[dlib.rectangle]:
+        """Returns the faces found in the grayscale frame"""
+        if self.name is None:
+            # the frame may be a scratch array, reused by the next frame
+            self._frames.append(frame.copy())
+            if len(self._frames) >= self.warmup:
+                self.name, self.detector = select_detector(
+                    self._frames, self.min_detection_rate, available_detectors(self.shared))
+                self._frames = []
+        return self.detector(frame)
+
+
+def create_detector(detector: Union[str, Any] = "hog", shared: bool = True) -> Any:
+    """Returns the face detector backend of the given name, or the detector itself if it is not a name
+
+    Arguments:
+        detector: 'hog', 'haar', 'lbp', 'auto', or a callable returning
+            the faces found in a grayscale frame as dlib rectangles
+        shared (bool): Use the models shared by the whole process, see CascadeDetector
+    """
+    if not isinstance(detector, str):
+        return detector
+    if detector == "auto":
+        return AutoDetector(shared=shared)
+    if detector not in DETECTORS:
+        raise ValueError(f"unknown face detector '{detector}', expected one of {', '.join(DETECTORS)} or auto")
+    return DETECTORS[detector](shared=shared)
@@ -0,0 +1,379 @@
+from __future__ import division
+import math
+from typing import List, Optional, Tuple
+import numpy as np
+
+from .sample import BLINKING_THRESHOLD
+
+
+FIXATION = 0
+SACCADE = 1
+BLINK = 2
+EVENT_NAMES = ("fixation", "saccade", "blink")
+
+# One row per event. The times are the timestamps of the first and last samples of the
+# event, in seconds. The position is the mean gaze ratios of a fixation or the landing
+# position of a saccade, nan for a blink. The amplitude is the dispersion of a fixation
+# (width plus height of the gaze ratios it covers) or the distance covered by a saccade,
+# nan for a blink.
+EVENT_DTYPE = np.dtype([
+    ("kind", np.uint8),
+    ("start", np.float64),
+    ("end", np.float64),
+    ("samples", np.int32),
+    ("horizontal_ratio", np.float64),
+    ("vertical_ratio", np.float64),
+    ("amplitude", np.float64),
+])
+
+
+def _event(kind: int, start: float, end: float, samples: int,
+           horizontal: float = math.nan, vertical: float = math.nan, amplitude: float = math.nan) -> np.void:
+    return np.array((kind, start, end, samples, horizontal, vertical, amplitude), EVENT_DTYPE)[()]
+
+
+class EventDetector(object):
+    """
+    This class turns the stream of samples into fixation, saccade and blink
+    events, in constant time and memory per sample:
+
+    - a saccade starts when the gaze moves faster than saccade_velocity and
+      ends when it slows down under release_velocity (I-VT with hysteresis),
+    - the samples between the saccades are grouped into fixations as long as
+      their dispersion stays under max_dispersion (I-DT), and a fixation is
+      reported if it lasts at least min_fixation,
+    - a blink starts when the blinking ratio exceeds blink_close and ends when
+      it falls under blink_open, and is reported if it lasts between
+      min_blink and max_blink.
+
+    The velocities are in gaze ratios per second, so the samples need timestamps.
+    The gaps longer than max_gap without located pupils end the fixations and
+    saccades. See detect_events for exported sample arrays.
+    """
+    __slots__ = ["saccade_velocity", "release_velocity", "max_dispersion", "min_fixation", "max_gap",
+                 "blink_close", "blink_open", "min_blink", "max_blink", "tracking", "tracking_changed",
+                 "_last_time", "_last_located", "_blink_start", "_blink_samples",
+                 "_previous", "_saccade", "_saccade_start", "_saccade_samples",
+                 "_fixation_samples", "_fixation_start", "_fixation_end", "_sums", "_bounds"]
+
+    def __init__(
+        self,
+        *,
+        saccade_velocity: float = 2.0,
+        release_velocity: float = 1.0,
+        max_dispersion: float = 0.1,
+        min_fixation: float = 0.1,
+        max_gap: float = 0.25,
+        blink_close: float = BLINKING_THRESHOLD,
+        blink_open: float = BLINKING_THRESHOLD - 0.4,
+        min_blink: float = 0.05,
+        max_blink: float = 0.5
+    ):
+        """
+        Arguments:
+            saccade_velocity (float): Gaze velocity starting a saccade, in gaze ratios per second
+            release_velocity (float): Gaze velocity under which a saccade ends
+            max_dispersion (float): Maximum width plus height of the gaze ratios of a fixation
+            min_fixation (float): Minimum duration of a fixation in seconds
+            max_gap (float): Maximum number of seconds between two located samples of an event
+            blink_close (float): Blinking ratio starting a blink
+            blink_open (float): Blinking ratio under which a blink ends
+            min_blink (float): Minimum duration of a blink in seconds
+            max_blink (float): Maximum duration of a blink in seconds, the eyes are closed beyond it
+        """
+        if release_velocity > saccade_velocity:
+            raise ValueError("the release velocity must not exceed the saccade velocity")
+        if blink_open > blink_close:
+            raise ValueError("the blink opening ratio must not exceed the closing one")
+        self.saccade_velocity = saccade_velocity
+        self.release_velocity = release_velocity
+        self.max_dispersion = max_dispersion
+        self.min_fixation = min_fixation
+        self.max_gap = max_gap
+        self.blink_close = blink_close
+        self.blink_open = blink_open
+        self.min_blink = min_blink
+        self.max_blink = max_blink
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the ongoing events"""
+        # tracking tells whether the pupils are followed, with max_gap of hysteresis,
+        # tracking_changed is the time it last changed
+        self.tracking = False
+        self.tracking_changed = math.nan
+        self._last_time = math.nan
+        self._last_located = math.nan
+        self._blink_start: Optional[float] = None
+        self._blink_samples = 0
+        # _previous is the last located sample (time, horizontal, vertical) of the ongoing events
+        self._previous: Optional[Tuple[float, float, float]] = None
+        self._saccade = False
+        self._saccade_start = (math.nan, math.nan, math.nan)
+        self._saccade_samples = 0
+        self._fixation_samples = 0
+        self._fixation_start = self._fixation_end = math.nan
+        self._sums = [0.0, 0.0]
+        # min and max of the horizontal and vertical ratios of the fixation
+        self._bounds = [0.0, 0.0, 0.0, 0.0]
+
+    @property
+    def state(self) -> Optional[int]:
+        """Returns the kind of the ongoing event, None if there is none yet"""
+        if self._blink_start is not None:
+            return BLINK
+        if self._saccade:
+            return SACCADE
+        if self._fixation_samples and self._fixation_end - self._fixation_start >= self.min_fixation:
+            return FIXATION
+        return None
+
+    def update(self, sample: np.void) -> List[np.void]:
+        """Returns the events ended by a new sample, usually none
+
+        Arguments:
+            sample (numpy.void): Sample of a frame (see sample.SAMPLE_DTYPE), e.g. gaze.sample
+        """
+        time = float(sample["timestamp"])
+        located = bool(sample["located"])
+        events: List[np.void] = []
+        self._last_time = time
+        if math.isnan(self.tracking_changed):
+            # not tracking since the first sample
+            self.tracking_changed = time
+
+        ratio = float(sample["blinking_ratio"])
+        if self._blink_start is None:
+            if ratio > self.blink_close:
+                self._close(events)
+                self._blink_start = time
+                self._blink_samples = 0
+        elif not ratio >= self.blink_open:
+            self._end_blink(time, events)
+        if self._blink_start is not None:
+            self._blink_samples += 1
+            if located:
+                self._last_located = time
+            return events
+
+        if located:
+            self._last_located = time
+            if not self.tracking:
+                self.tracking = True
+                self.tracking_changed = time
+        elif self.tracking and not time - self._last_located <= self.max_gap:
+            self.tracking = False
+            self.tracking_changed = time
+
+        horizontal = float(sample["horizontal_ratio"])
+        vertical = float(sample["vertical_ratio"])
+        previous = self._previous
+        if not (located and math.isfinite(time) and math.isfinite(horizontal) and math.isfinite(vertical)):
+            if previous is not None and time - previous[0] > self.max_gap:
+                self._close(events)
+            return events
+
+        if previous is not None and not time - previous[0] <= self.max_gap:
+            self._close(events)
+            previous = None
+        self._previous = (time, horizontal, vertical)
+        if previous is None:
+            self._start_fixation(time, horizontal, vertical)
+            return events
+
+        elapsed = time - previous[0]
+        velocity = math.hypot(horizontal - previous[1], vertical - previous[2]) / elapsed if elapsed > 0 else 0.0
+        if self._saccade:
+            if velocity < self.release_velocity:
+                self._end_saccade(previous, events)
+                self._start_fixation(time, horizontal, vertical)
+            else:
+                self._saccade_samples += 1
+        elif velocity > self.saccade_velocity:
+            self._end_fixation(events)
+            self._saccade = True
+            self._saccade_start = previous
+            self._saccade_samples = 2
+        else:
+            self._add_fixation(time, horizontal, vertical, events)
+        return events
+
+    def flush(self) -> List[np.void]:
+        """Returns the ongoing events, ended at the last sample, e.g. at the end of a recording"""
+        events: List[np.void] = []
+        if self._blink_start is not None:
+            self._end_blink(self._last_time, events)
+        self._close(events)
+        return events
+
+    def _close(self, events: List[np.void]) -> None:
+        """Ends the ongoing fixation or saccade at the last located sample"""
+        if self._saccade:
+            self._end_saccade(self._previous, events)
+        else:
+            self._end_fixation(events)
+        self._previous = None
+
+    def _end_blink(self, time: float, events: List[np.void]) -> None:
+        start = self._blink_start
+        if self.min_blink <= time - start <= self.max_blink:
+            events.append(_event(BLINK, start, time, self._blink_samples))
+        self._blink_start = None
+
+    def _end_saccade(self, end: Tuple[float, float, float], events: List[np.void]) -> None:
+        start = self._saccade_start
+        amplitude = math.hypot(end[1] - start[1], end[2] - start[2])
+        events.append(_event(SACCADE, start[0], end[0], self._saccade_samples, end[1], end[2], amplitude))
+        self._saccade = False
+
+    def _start_fixation(self, time: float, horizontal: float, vertical: float) -> None:
+        self._fixation_samples = 1
+        self._fixation_start = self._fixation_end = time
+        self._sums[0] = horizontal
+        self._sums[1] = vertical
+        bounds = self._bounds
+        bounds[0] = bounds[1] = horizontal
+        bounds[2] = bounds[3] = vertical
+
+    def _add_fixation(self, time: float, horizontal: float, vertical: float, events: List[np.void]) -> None:
+        bounds = self._bounds
+        low_h = min(bounds[0], horizontal)
+        high_h = max(bounds[1], horizontal)
+        low_v = min(bounds[2], vertical)
+        high_v = max(bounds[3], vertical)
+        if (high_h - low_h) + (high_v - low_v) > self.max_dispersion:
+            self._end_fixation(events)
+            self._start_fixation(time, horizontal, vertical)
+            return
+        bounds[:] = low_h, high_h, low_v, high_v
+        self._fixation_samples += 1
+        self._fixation_end = time
+        self._sums[0] += horizontal
+        self._sums[1] += vertical
+
+    def _end_fixation(self, events: List[np.void]) -> None:
+        count = self._fixation_samples
+        if count and self._fixation_end - self._fixation_start >= self.min_fixation:
+            bounds = self._bounds
+            events.append(_event(
+                FIXATION, self._fixation_start, self._fixation_end, count, self._sums[0] / count,
+                self._sums[1] / count, (bounds[1] - bounds[0]) + (bounds[3] - bounds[2])))
+        self._fixation_samples = 0
+
+
+def _hysteresis(stay: np.ndarray, enter: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the (first, end) indices of the runs where a state entered on an `enter`
+    element holds while `stay` is true, `end` being exclusive
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], stay.view(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    entries = np.flatnonzero(enter & stay)
+    position = np.searchsorted(entries, starts)
+    valid = position < len(entries)
+    first = entries[np.minimum(position, max(len(entries) - 1, 0))] if len(entries) else starts
+    valid &= first < ends
+    return first[valid], ends[valid]
+
+
+def _fixations(
+    detector: EventDetector, times: np.ndarray, horizontal: np.ndarray, vertical: np.ndarray,
+    start: int, stop: int, rows: List[tuple]
+) -> None:
+    """Splits the samples [start, stop) between two saccades into fixations of bounded dispersion"""
+    while start < stop:
+        # the window doubles until the dispersion is exceeded, so every sample is scanned a few times
+        size = 64
+        while True:
+            end = min(start + size, stop)
+            h = horizontal[start:end]
+            v = vertical[start:end]
+            dispersion = (np.maximum.accumulate(h) - np.minimum.accumulate(h)) + \
+                (np.maximum.accumulate(v) - np.minimum.accumulate(v))
+            over = np.flatnonzero(dispersion > detector.max_dispersion)
+            if len(over) or end == stop:
+                break
+            size *= 2
+        split = start + int(over[0]) if len(over) else stop
+        if times[split - 1] - times[start] >= detector.min_fixation:
+            h = horizontal[start:split]
+            v = vertical[start:split]
+            rows.append((FIXATION, times[start], times[split - 1], split - start, h.mean(), v.mean(),
+                         (h.max() - h.min()) + (v.max() - v.min())))
+        start = split
+
+
+def detect_events(samples: np.ndarray, fps: Optional[float] = None, **kwds: float) -> np.ndarray:
+    """Returns the fixation, saccade and blink events of a recording as an array
+    of EVENT_DTYPE ordered by start, the same ones as EventDetector finds
+    sample by sample, computed on the whole arrays at once.
+
+    Arguments:
+        samples (numpy.ndarray): Array of SAMPLE_DTYPE, e.g. loaded by export.load_samples
+        fps (float): Frame rate giving the timestamps of the samples, their own timestamps by default
+        kwds: Thresholds of EventDetector
+    """
+    detector = EventDetector(**kwds)
+    count = len(samples)
+    if fps is not None:
+        times = np.arange(count) / fps
+    else:
+        times = samples["timestamp"].astype(np.float64)
+    rows: List[tuple] = []
+    if count == 0:
+        return np.array(rows, EVENT_DTYPE)
+
+    # blinks: the samples from a ratio over blink_close to the first under blink_open
+    ratio = samples["blinking_ratio"]
+    with np.errstate(invalid="ignore"):
+        first, end = _hysteresis(ratio >= detector.blink_open, ratio > detector.blink_close)
+    blink_end = times[np.minimum(end, count - 1)]
+    duration = blink_end - times[first]
+    keep = (duration >= detector.min_blink) & (duration <= detector.max_blink)
+    for index in np.flatnonzero(keep):
+        rows.append((BLINK, times[first[index]], blink_end[index], end[index] - first[index],
+                     np.nan, np.nan, np.nan))
+    marks = np.zeros(count + 1, np.int32)
+    np.add.at(marks, first, 1)
+    np.add.at(marks, end, -1)
+    blinking = np.cumsum(marks[:-1]) > 0
+
+    # gaze: the located samples outside the blinks, connected if they are close enough in time
+    horizontal_all = samples["horizontal_ratio"]
+    vertical_all = samples["vertical_ratio"]
+    valid = samples["located"] & ~blinking & np.isfinite(times) & \
+        np.isfinite(horizontal_all) & np.isfinite(vertical_all)
+    indices = np.flatnonzero(valid)
+    if len(indices):
+        blinks_before = np.cumsum(blinking)[indices]
+        t = times[indices]
+        horizontal = horizontal_all[indices].astype(np.float64)
+        vertical = vertical_all[indices].astype(np.float64)
+        elapsed = np.diff(t)
+        connected = np.concatenate(([False], (elapsed <= detector.max_gap) & (np.diff(blinks_before) == 0)))
+        distance = np.hypot(np.diff(horizontal), np.diff(vertical))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            velocity = np.concatenate(([0.0], np.where(elapsed > 0, distance / elapsed, 0.0)))
+
+        # saccades: from the sample before the onset to the last one before the release
+        first, end = _hysteresis(
+            connected & (velocity >= detector.release_velocity), connected & (velocity > detector.saccade_velocity))
+        for onset, stop in zip(first, end):
+            start = onset - 1
+            last = stop - 1
+            rows.append((SACCADE, t[start], t[last], stop - onset + 1, horizontal[last], vertical[last],
+                         math.hypot(horizontal[last] - horizontal[start], vertical[last] - vertical[start])))
+
+        # fixations: the runs of samples outside the saccades, split at the gaps
+        marks = np.zeros(len(t) + 1, np.int32)
+        np.add.at(marks, first, 1)
+        np.add.at(marks, end, -1)
+        outside = np.cumsum(marks[:-1]) == 0
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], outside.view(np.int8), [0]))))
+        breaks = np.flatnonzero(outside & ~connected)
+        for start, stop in zip(edges[::2], edges[1::2]):
+            cuts = breaks[(breaks > start) & (breaks < stop)]
+            for low, high in zip(np.concatenate(([start], cuts)), np.concatenate((cuts, [stop]))):
+                _fixations(detector, t, horizontal, vertical, int(low), int(high), rows)
+
+    events = np.array(rows, EVENT_DTYPE)
+    return events[np.lexsort((events["end"], events["start"]))]
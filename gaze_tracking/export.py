@@ -0,0 +1,268 @@
+import os
+import csv
+import json
+import queue
+import zipfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from .face import EyePair
+from .sample import SAMPLE_DTYPE, compute_directions, empty_samples
+
+
+FORMATS = ("jsonl", "csv", "npz")
+
+
+def _guess_format(path: str) -> str:
+    """Returns the export format matching the extension of the path"""
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    if ext in ("jsonl", "json"):
+        return "jsonl"
+    elif ext in FORMATS:
+        return ext
+    raise ValueError(f"unknown export format for '{path}', expected one of {', '.join(FORMATS)}")
+
+
+def _columns(samples: np.ndarray, flatten: bool) -> List[Tuple[str, List[Any]]]:
+    """Returns the fields of the samples as lists of Python values, nan replaced by None.
+    The (x, y) fields are split into two columns if flatten is true.
+    """
+    columns = []
+    for name in samples.dtype.names:
+        values = samples[name]
+        if values.ndim == 2 and flatten:
+            columns.append((name + ".x", values[:, 0].tolist()))
+            columns.append((name + ".y", values[:, 1].tolist()))
+            continue
+
+        values = values.tolist()
+        if samples.dtype[name].kind == "f":
+            values = [None if value != value else value for value in values]
+        columns.append((name, values))
+    return columns
+
+
+class _JsonlWriter(object):
+    def __init__(self, path: str, with_source: bool):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, samples: np.ndarray, sources: Optional[List[str]]) -> None:
+        columns = _columns(samples, False)
+        if sources is not None:
+            columns.insert(0, ("source", sources))
+        names = [name for name, _ in columns]
+        lines = [json.dumps(dict(zip(names, row))) for row in zip(*(values for _, values in columns))]
+        self.file.write("\n".join(lines) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class _CsvWriter(object):
+    def __init__(self, path: str, with_source: bool):
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        header = [name for name, _ in _columns(empty_samples(0), True)]
+        self.writer.writerow(["source"] + header if with_source else header)
+
+    def write(self, samples: np.ndarray, sources: Optional[List[str]]) -> None:
+        columns = _columns(samples, True)
+        if sources is not None:
+            columns.insert(0, ("source", sources))
+        self.writer.writerows(zip(*(values for _, values in columns)))
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class _NpzWriter(object):
+    def __init__(self, path: str, with_source: bool):
+        self.file = zipfile.ZipFile(path, "w")
+        self.count = 0
+
+    def write(self, samples: np.ndarray, sources: Optional[List[str]]) -> None:
+        with self.file.open(f"chunk_{self.count:08d}.npy", "w", force_zip64=True) as f:
+            np.lib.format.write_array(f, np.ascontiguousarray(samples))
+        if sources is not None:
+            with self.file.open(f"source_{self.count:08d}.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, np.array(sources, dtype=str))
+        self.count += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+
+_WRITERS = {
+    "jsonl": _JsonlWriter,
+    "csv": _CsvWriter,
+    "npz": _NpzWriter,
+}
+
+
+class SampleRecorder(object):
+    """
+    This class streams the samples of a session to a JSONL, CSV or NPZ file.
+    The samples are gathered in chunks which are written on a background
+    thread, so the memory used stays the same whatever the session length.
+    """
+    __slots__ = ["path", "format", "chunk_size", "with_source", "count", "_chunk", "_index",
+                 "_queue", "_thread", "_error"]
+
+    def __init__(
+        self,
+        path: str,
+        format: Optional[str] = None,
+        chunk_size: int = 1024,
+        max_pending: int = 8,
+        with_source: bool = False
+    ):
+        """
+        Arguments:
+            path (str): Path of the exported file
+            format (str): One of 'jsonl', 'csv' or 'npz', guessed from the path extension by default
+            chunk_size (int): Number of samples written at once
+            max_pending (int): Maximum number of chunks waiting to be written
+            with_source (bool): Adds a 'source' column naming where every sample
+                comes from, e.g. the path of an image, given to write
+        """
+        self.path = path
+        self.format = format or _guess_format(path)
+        if self.format not in _WRITERS:
+            raise ValueError(f"unknown export format '{self.format}'")
+        self.chunk_size = chunk_size
+        self.with_source = with_source
+        self.count = 0
+        self._chunk = empty_samples(chunk_size)
+        self._index = 0
+        self._error: Optional[BaseException] = None
+
+        # the file is opened here so that an invalid path fails immediately
+        writer = _WRITERS[self.format](path, with_source)
+        self._queue: "queue.Queue[Optional[Tuple[np.ndarray, Optional[List[str]]]]]" = \
+            queue.Queue(max(max_pending, 1))
+        self._thread = threading.Thread(target=self._run, args=(writer,), name="gaze-export", daemon=True)
+        self._thread.start()
+
+    def _run(self, writer: Any) -> None:
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if self._error is None:
+                    try:
+                        writer.write(*item)
+                    except Exception as e:
+                        self._error = e
+        finally:
+            writer.close()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise OSError(f"failed to export samples to '{self.path}'") from self._error
+
+    def record(self, gaze: EyePair, timestamp: Optional[float] = None) -> None:
+        """Records the positions found in the current frame of the tracker
+
+        Arguments:
+            gaze (EyePair): Tracker or face to record
+            timestamp (float): Time of the frame in seconds
+        """
+        self._check()
+        if timestamp is not None:
+            self._chunk["timestamp"][self._index] = timestamp
+        gaze._fill_sample(self._chunk, self._index)
+        self._index += 1
+        self.count += 1
+        if self._index >= self.chunk_size:
+            self.flush()
+
+    def write(self, samples: np.ndarray, sources: Optional[List[str]] = None) -> None:
+        """Records samples already analyzed, e.g. by analyze_batch
+
+        Arguments:
+            samples (numpy.ndarray): Array of SAMPLE_DTYPE
+            sources (list): Source of every sample, if the recorder has a source column
+        """
+        self._check()
+        self.flush()
+        for start in range(0, len(samples), self.chunk_size):
+            chunk = samples[start:start + self.chunk_size].copy()
+            self._queue.put((chunk, self._sources(sources, start, len(chunk))))
+        self.count += len(samples)
+
+    def _sources(self, sources: Optional[List[str]], start: int, count: int) -> Optional[List[str]]:
+        if not self.with_source:
+            return None
+        if sources is None:
+            return [""] * count
+        return [str(source) for source in sources[start:start + count]]
+
+    def flush(self) -> None:
+        """Hands the samples recorded so far over to the writer thread"""
+        if self._index == 0:
+            return
+        self._queue.put((compute_directions(self._chunk[:self._index]), self._sources(None, 0, self._index)))
+        self._chunk = empty_samples(self.chunk_size)
+        self._index = 0
+
+    def close(self) -> None:
+        """Writes the remaining samples and closes the file"""
+        if self._thread.is_alive():
+            self.flush()
+            self._queue.put(None)
+            self._thread.join()
+        self._check()
+
+    def __enter__(self) -> "SampleRecorder":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def _parse(name: str, value: str) -> Any:
+    if name in ("located", "is_left", "is_right", "is_center", "is_blinking"):
+        return value == "True"
+    return float(value) if value else np.nan
+
+
+def load_samples(path: str, format: Optional[str] = None) -> np.ndarray:
+    """Reads the samples exported by a SampleRecorder, without the source column
+
+    Arguments:
+        path (str): Path of the exported file
+        format (str): One of 'jsonl', 'csv' or 'npz', guessed from the path extension by default
+    """
+    format = format or _guess_format(path)
+    if format == "npz":
+        with np.load(path) as data:
+            chunks = [data[name] for name in sorted(data.files) if name.startswith("chunk_")]
+        return np.concatenate(chunks) if chunks else empty_samples(0)
+
+    rows: List[Dict[str, Any]] = []
+    with open(path, encoding="utf-8", newline="") as f:
+        if format == "jsonl":
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            for row in csv.DictReader(f):
+                record: Dict[str, Any] = {}
+                for key, value in row.items():
+                    name, _, axis = key.partition(".")
+                    if name not in SAMPLE_DTYPE.names:
+                        continue
+                    value = _parse(name, value)
+                    if axis:
+                        record.setdefault(name, [0, 0])[axis == "y"] = value
+                    else:
+                        record[name] = value
+                rows.append(record)
+
+    samples = empty_samples(len(rows))
+    for name in SAMPLE_DTYPE.names:
+        values = [row[name] for row in rows]
+        if SAMPLE_DTYPE[name].kind == "f":
+            values = [np.nan if value is None else value for value in values]
+        samples[name] = values
+    return samples
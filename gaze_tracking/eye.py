@@ -1,10 +1,13 @@
 import math
+import time
 import numpy as np
 import cv2
-from typing import Any, Tuple
+from typing import Any, Optional, Tuple
 
-from .pupil import Pupil
+from .pupil import DEFAULT_BACKEND, Pupil
 from .calibration import Calibration
+from .buffers import FrameBuffers
+from .stats import Stats
 
 
 LEFT_EYE = 1
@@ -32,15 +35,30 @@ class Eye(object):
     LEFT_EYE_POINTS = [36, 37, 38, 39, 40, 41]
     RIGHT_EYE_POINTS = [42, 43, 44, 45, 46, 47]
 
-    def __init__(self, original_frame: np.ndarray, landmarks: Any, side: int, calibration: Calibration):
+    def __init__(
+        self,
+        original_frame: np.ndarray,
+        landmarks: Any,
+        side: int,
+        calibration: Calibration,
+        buffers: Optional[FrameBuffers] = None,
+        stats: Optional[Stats] = None,
+        pupil_backend: str = DEFAULT_BACKEND
+    ):
         """Detects and isolates the eye in a new frame, sends data to the calibration
         and initializes Pupil object.
 
         Arguments:
             original_frame (numpy.ndarray): Frame passed by the user
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
+            landmarks (dlib.full_object_detection or numpy.ndarray): Facial landmarks for the face region,
+                or an array of their (x, y) coordinates
             side: Indicates whether it's the left eye (0) or the right eye (1)
             calibration (calibration.Calibration): Manages the binarization threshold value
+            buffers (buffers.FrameBuffers): Scratch arrays reused for the eye and iris frames,
+                which are then only valid until the next frame
+            stats (stats.Stats): Collects the latency of the isolation, calibration
+                and pupil detection
+            pupil_backend (str): Name of the pupil localization backend, see pupil.BACKENDS
         """
         if side == LEFT_EYE:
             points = self.LEFT_EYE_POINTS
@@ -49,42 +67,89 @@ class Eye(object):
         else:
             return
 
-        region: np.ndarray = np.array([(landmarks.part(point).x, landmarks.part(point).y) for point in points])
+        if isinstance(landmarks, np.ndarray):
+            region: np.ndarray = landmarks[points]
+        else:
+            region = np.array([(landmarks.part(point).x, landmarks.part(point).y) for point in points])
         region = region.astype(np.int32)
         self.landmark_points = region
         
         self.blinking = self._blinking_ratio()
-        self._isolate(original_frame)
+        if stats is not None:
+            start = time.perf_counter()
+        self._isolate(original_frame, side, buffers)
+        if stats is not None:
+            start = stats.lap("eye_isolation", start)
+
+        iris_frame = None
+        if buffers is not None:
+            iris_frame = buffers.get(f"iris{side}", self.frame.shape)
 
         if not calibration.is_complete():
-            calibration.evaluate(self.frame, side)
+            calibration.evaluate(self.frame, side, iris_frame)
+            if stats is not None:
+                start = stats.lap("calibration", start)
+        elif calibration.is_checking():
+            calibration.check(self.frame, side, iris_frame)
+            if stats is not None:
+                start = stats.lap("calibration", start)
+        else:
+            calibration.submit(self.frame, side)
 
         threshold = calibration.threshold(side)
-        self.pupil: Pupil = Pupil(self.frame, threshold)
+        self.pupil: Pupil = Pupil(self.frame, threshold, iris_frame, pupil_backend)
+        if stats is not None:
+            stats.lap("pupil", start)
 
-    def _isolate(self, frame: np.ndarray) -> None:
+    def with_pupil(self, threshold: int, pupil_backend: str = DEFAULT_BACKEND) -> "Eye":
+        """Returns the eye with its pupil located at another threshold or by
+        another backend, sharing the eye frame of this one. The calibration is
+        not involved, it already received this eye frame.
+
+        Arguments:
+            threshold (int): Threshold value used to binarize the eye frame
+            pupil_backend (str): Name of the pupil localization backend, see pupil.BACKENDS
+        """
+        if self.pupil.threshold == threshold and self.pupil.backend == pupil_backend:
+            return self
+        eye = Eye.__new__(Eye)
+        eye.landmark_points = self.landmark_points
+        eye.frame = self.frame
+        eye.origin = self.origin
+        eye.center = self.center
+        eye.blinking = self.blinking
+        eye.pupil = Pupil(self.frame, threshold, None, pupil_backend)
+        return eye
+
+    def _isolate(self, frame: np.ndarray, side: int, buffers: Optional[FrameBuffers] = None) -> None:
         """Isolate an eye, to have a frame without other part of the face.
 
         Arguments:
             frame (numpy.ndarray): Frame containing the face
-            landmarks (dlib.full_object_detection): Facial landmarks for the face region
-            points (list): Points of an eye (from the 68 Multi-PIE landmarks)
+            side: Indicates whether it's the left eye (0) or the right eye (1)
+            buffers (buffers.FrameBuffers): Scratch arrays reused for the eye frame
         """
-        # Applying a mask to get only the eye
-        height, width = frame.shape[:2]
-        black_frame = np.zeros((height, width), np.uint8)
-        mask = np.full((height, width), 255, np.uint8)
-        cv2.fillPoly(mask, [self.landmark_points], (0, 0, 0))
-        eye: np.ndarray = cv2.bitwise_not(black_frame, frame.copy(), mask=mask)
-
         # Cropping on the eye
         margin = 5
-        min_x = np.min(self.landmark_points[:, 0]) - margin
-        max_x = np.max(self.landmark_points[:, 0]) + margin
-        min_y = np.min(self.landmark_points[:, 1]) - margin
-        max_y = np.max(self.landmark_points[:, 1]) + margin
+        height, width = frame.shape[:2]
+        min_x = max(int(np.min(self.landmark_points[:, 0])) - margin, 0)
+        max_x = min(int(np.max(self.landmark_points[:, 0])) + margin, width)
+        min_y = max(int(np.min(self.landmark_points[:, 1])) - margin, 0)
+        max_y = min(int(np.max(self.landmark_points[:, 1])) + margin, height)
+        roi = frame[min_y:max_y, min_x:max_x]
+
+        # Applying a mask to get only the eye, only on the cropped region
+        if buffers is None:
+            mask = np.empty(roi.shape, np.uint8)
+            eye = np.empty(roi.shape, np.uint8)
+        else:
+            mask = buffers.get("eye_mask", roi.shape)
+            eye = buffers.get(f"eye{side}", roi.shape)
+        mask.fill(255)
+        cv2.fillPoly(mask, [self.landmark_points], 0, offset=(-min_x, -min_y))
+        np.bitwise_or(roi, mask, out=eye)
 
-        self.frame: np.ndarray = eye[min_y:max_y, min_x:max_x]
+        self.frame: np.ndarray = eye
         self.origin: Tuple[int, int] = (min_x, min_y)
         
         height, width = self.frame.shape[:2]
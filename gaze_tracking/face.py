@@ -0,0 +1,230 @@
+from __future__ import division
+import time
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+import dlib
+
+from .eye import LEFT_EYE, RIGHT_EYE, Eye
+from .calibration import Calibration
+from .pupil import DEFAULT_BACKEND
+from .buffers import FrameBuffers
+from .stats import Stats
+from .sample import BLINKING_THRESHOLD, LEFT_THRESHOLD, RIGHT_THRESHOLD
+
+
+class EyePair(object):
+    """
+    This class holds the two eyes of a face and provides
+    the gaze information computed from them.
+    """
+    __slots__ = ["eye_left", "eye_right"]
+
+    @property
+    def pupils_located(self):
+        """Check that the pupils have been located"""
+        if self.eye_left is None or self.eye_right is None:
+            return False
+
+        return all(i > 0 for i in [
+            self.eye_left.pupil.x, self.eye_left.pupil.y, self.eye_right.pupil.x, self.eye_right.pupil.y])
+
+    def _fill_sample(self, samples: np.ndarray, index: int) -> None:
+        """Writes the positions of the eyes and pupils into a row of samples"""
+        eye_left = self.eye_left
+        eye_right = self.eye_right
+        if eye_left is None or eye_right is None:
+            return
+
+        samples["eye_left_origin"][index] = eye_left.origin
+        samples["eye_left_size"][index] = eye_left.frame.shape[1::-1]
+        samples["eye_right_origin"][index] = eye_right.origin
+        samples["eye_right_size"][index] = eye_right.frame.shape[1::-1]
+        samples["blinking_ratio"][index] = (eye_left.blinking + eye_right.blinking) / 2
+        if self.pupils_located:
+            samples["located"][index] = True
+            samples["pupil_left"][index] = self.pupil_left_coords()
+            samples["pupil_right"][index] = self.pupil_right_coords()
+
+    def pupil_left_coords(self):
+        """Returns the coordinates of the left pupil"""
+        x = self.eye_left.origin[0] + self.eye_left.pupil.x
+        y = self.eye_left.origin[1] + self.eye_left.pupil.y
+        return (x, y)
+
+    def pupil_right_coords(self):
+        """Returns the coordinates of the right pupil"""
+        x = self.eye_right.origin[0] + self.eye_right.pupil.x
+        y = self.eye_right.origin[1] + self.eye_right.pupil.y
+        return (x, y)
+
+    def horizontal_ratio(self):
+        """Returns a number between 0.0 and 1.0 that indicates the
+        horizontal direction of the gaze. The extreme right is 0.0,
+        the center is 0.5 and the extreme left is 1.0
+        """
+        pupil_left = self.eye_left.pupil.x / (self.eye_left.center[0] * 2 - 10)
+        pupil_right = self.eye_right.pupil.x / (self.eye_right.center[0] * 2 - 10)
+        return (pupil_left + pupil_right) / 2
+
+    def vertical_ratio(self):
+        """Returns a number between 0.0 and 1.0 that indicates the
+        vertical direction of the gaze. The extreme top is 0.0,
+        the center is 0.5 and the extreme bottom is 1.0
+        """
+        pupil_left = self.eye_left.pupil.y / (self.eye_left.center[1] * 2 - 10)
+        pupil_right = self.eye_right.pupil.y / (self.eye_right.center[1] * 2 - 10)
+        return (pupil_left + pupil_right) / 2
+
+    def is_right(self) -> bool:
+        """Returns true if the user is looking to the right"""
+        if self.pupils_located:
+            return self.horizontal_ratio() <= RIGHT_THRESHOLD
+        return False
+
+    def is_left(self) -> bool:
+        """Returns true if the user is looking to the left"""
+        if self.pupils_located:
+            return self.horizontal_ratio() >= LEFT_THRESHOLD
+        return False
+
+    def is_center(self) -> bool:
+        """Returns true if the user is looking to the center"""
+        if self.pupils_located:
+            return self.is_right() is not True and self.is_left() is not True
+        return False
+
+    def is_blinking(self) -> bool:
+        """Returns true if the user closes his eyes"""
+        if self.pupils_located:
+            blinking_ratio = (self.eye_left.blinking + self.eye_right.blinking) / 2
+            return blinking_ratio > BLINKING_THRESHOLD
+        return False
+
+
+def _overlap(rect1: dlib.rectangle, rect2: dlib.rectangle) -> float:
+    """Returns the intersection over union of two rectangles"""
+    intersection = rect1.intersect(rect2).area()
+    union = rect1.area() + rect2.area() - intersection
+    if union <= 0:
+        return 0.0
+    return intersection / union
+
+
+class FaceTrack(object):
+    """
+    This class holds the state kept for a face from one frame to the next:
+    its calibration and its scratch buffers.
+    """
+    __slots__ = ["track_id", "rect", "calibration", "buffers", "missing"]
+
+    def __init__(self, track_id: int, rect: dlib.rectangle, calibration: Calibration):
+        self.track_id = track_id
+        self.rect = rect
+        self.calibration = calibration
+        self.buffers = FrameBuffers()
+        self.missing = 0
+
+
+class FaceTracks(object):
+    """
+    This class matches the faces detected in a frame with the faces of
+    the previous frames, so that every person keeps a stable track ID.
+    """
+    __slots__ = ["tracks", "min_overlap", "max_missing", "calibration_factory", "_next_id"]
+
+    def __init__(
+        self,
+        min_overlap: float = 0.3,
+        max_missing: int = 15,
+        calibration_factory: Callable[[], Calibration] = Calibration
+    ):
+        """
+        Arguments:
+            min_overlap (float): Minimum intersection over union between a face
+                and the last position of a track to match them
+            max_missing (int): Number of frames a track is kept without its face
+            calibration_factory (callable): Returns the calibration of a new track
+        """
+        self.tracks: Dict[int, FaceTrack] = {}
+        self.min_overlap = min_overlap
+        self.max_missing = max_missing
+        self.calibration_factory = calibration_factory
+        self._next_id = 0
+
+    def update(self, rects: List[dlib.rectangle]) -> List[FaceTrack]:
+        """Returns the track of every detected face, in the order of the faces
+
+        Arguments:
+            rects (list): Faces detected in the frame
+        """
+        pairs = sorted(
+            ((_overlap(track.rect, rect), track_id, index)
+             for track_id, track in self.tracks.items() for index, rect in enumerate(rects)),
+            reverse=True)
+
+        matched: List[Optional[FaceTrack]] = [None] * len(rects)
+        seen = set()
+        for overlap, track_id, index in pairs:
+            if overlap < self.min_overlap:
+                break
+            if matched[index] is None and track_id not in seen:
+                matched[index] = self.tracks[track_id]
+                seen.add(track_id)
+
+        for track_id, track in list(self.tracks.items()):
+            if track_id in seen:
+                track.missing = 0
+            else:
+                track.missing += 1
+                if track.missing > self.max_missing:
+                    del self.tracks[track_id]
+                    track.calibration.close()
+
+        for index, rect in enumerate(rects):
+            track = matched[index]
+            if track is None:
+                track = FaceTrack(self._next_id, rect, self.calibration_factory())
+                self.tracks[self._next_id] = track
+                self._next_id += 1
+                matched[index] = track
+            track.rect = rect
+        return matched
+
+    def close(self) -> None:
+        """Releases the calibrations of the tracks"""
+        for track in self.tracks.values():
+            track.calibration.close()
+
+
+class Face(EyePair):
+    """
+    This class holds the eyes of one of the faces found in a frame.
+    """
+    __slots__ = ["track_id", "rect"]
+
+    def __init__(
+        self,
+        frame: np.ndarray,
+        track: FaceTrack,
+        predictor: Any,
+        stats: Optional[Stats] = None,
+        pupil_backend: str = DEFAULT_BACKEND
+    ):
+        """Locates the landmarks, eyes and pupils of the face.
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame containing the face
+            track (FaceTrack): Track of the face, holding its calibration
+            predictor (dlib.shape_predictor): Facial landmark predictor
+            stats (stats.Stats): Collects the latency of the stages
+            pupil_backend (str): Name of the pupil localization backend, see pupil.BACKENDS
+        """
+        self.track_id = track.track_id
+        self.rect = track.rect
+        if stats is not None:
+            start = time.perf_counter()
+        landmarks = predictor(frame, track.rect)
+        if stats is not None:
+            stats.lap("landmarks", start)
+        self.eye_left = Eye(frame, landmarks, LEFT_EYE, track.calibration, track.buffers, stats, pupil_backend)
+        self.eye_right = Eye(frame, landmarks, RIGHT_EYE, track.calibration, track.buffers, stats, pupil_backend)
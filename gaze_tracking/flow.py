@@ -0,0 +1,80 @@
+from typing import Any, Optional
+import numpy as np
+import cv2
+
+from .eye import Eye
+
+
+EYE_POINTS = Eye.LEFT_EYE_POINTS + Eye.RIGHT_EYE_POINTS
+
+
+class LandmarkFlow(object):
+    """
+    This class carries the eye landmarks found by the predictor on a keyframe
+    forward to the following frames with pyramidal Lucas-Kanade optical flow.
+    """
+    __slots__ = ["interval", "max_error", "landmarks", "previous", "countdown",
+                 "keyframes", "propagated"]
+
+    def __init__(self, interval: int = 5, max_error: float = 1.0):
+        """
+        Arguments:
+            interval (int): Maximum number of frames from a keyframe to the next one,
+                e.g. 5 for a keyframe and 4 frames followed with optical flow
+            max_error (float): Maximum forward-backward error of a point in pixels,
+                above which the landmarks are considered drifting
+        """
+        self.interval = interval
+        self.max_error = max_error
+        self.keyframes = 0
+        self.propagated = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the landmarks, the next frame is a keyframe"""
+        self.landmarks: Optional[np.ndarray] = None
+        self.previous: Optional[np.ndarray] = None
+        self.countdown = 0
+
+    def keyframe(self, frame: np.ndarray, landmarks: Any) -> np.ndarray:
+        """Stores the landmarks found by the predictor on the frame.
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame, which must stay unchanged until the next frame
+            landmarks (dlib.full_object_detection): Facial landmarks of the face
+
+        Returns:
+            The landmarks as an array of (x, y) points
+        """
+        self.landmarks = np.array([(point.x, point.y) for point in landmarks.parts()], np.int32)
+        self.previous = frame
+        # the number of frames followed before the next keyframe
+        self.countdown = self.interval - 1
+        self.keyframes += 1
+        return self.landmarks
+
+    def propagate(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        """Moves the eye landmarks of the previous frame to the given one.
+
+        Arguments:
+            frame (numpy.ndarray): Grayscale frame, which must stay unchanged until the next frame
+
+        Returns:
+            The landmarks as an array of (x, y) points, or None if a keyframe is needed
+        """
+        if self.landmarks is None or self.countdown <= 0:
+            return None
+
+        points = self.landmarks[EYE_POINTS].astype(np.float32).reshape(-1, 1, 2)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self.previous, frame, points, None)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(frame, self.previous, moved, None)
+        error = np.abs(back - points).reshape(-1, 2).max(axis=1)
+        if not (status.all() and back_status.all() and (error <= self.max_error).all()):
+            self.reset()
+            return None
+
+        self.landmarks[EYE_POINTS] = np.rint(moved.reshape(-1, 2))
+        self.previous = frame
+        self.countdown -= 1
+        self.propagated += 1
+        return self.landmarks
@@ -1,11 +1,23 @@
 from __future__ import division
-import os
-from typing import Union
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Union
 import numpy as np
 import cv2
-import dlib
+from . import models
 from .eye import BOTH_EYES, LEFT_EYE, RIGHT_EYE, Eye
-from .calibration import Calibration
+from .calibration import AdaptiveCalibration, Calibration
+from .profiles import CalibrationProfile
+from .pupil import BACKENDS, DEFAULT_BACKEND
+from .detector import FaceTracker, create_detector, scale_rectangle
+from .buffers import FrameBuffers
+from .context import FrameContext
+from .capture import ThreadedCapture
+from .face import EyePair, Face, FaceTracks
+from .flow import LandmarkFlow
+from .stats import Stats
+from .history import SampleHistory
+from .sample import compute_directions, empty_samples
 
 
 def hisEqulColor(img: np.ndarray) -> np.ndarray:
@@ -18,27 +30,128 @@ def hisEqulColor(img: np.ndarray) -> np.ndarray:
     return img
 
 
-class GazeTracking(object):
+def _calibration_state(calibration: Calibration) -> Dict[str, Any]:
+    """Returns the calibration gauges of the stats snapshot"""
+    return {
+        "calibration_complete": calibration.is_complete(),
+        "calibration_frames": min(len(calibration.thresholds_left), len(calibration.thresholds_right)),
+        "threshold_left": calibration.threshold(LEFT_EYE) if calibration.thresholds_left else None,
+        "threshold_right": calibration.threshold(RIGHT_EYE) if calibration.thresholds_right else None,
+    }
+
+
+class GazeTracking(EyePair):
     """
     This class tracks the user's gaze.
     It provides useful information like the position of the eyes
     and pupils and allows to know if the eyes are open or closed
     """
 
-    __slots__ = ["frame", "eye_left", "eye_right", "calibration",
-                "equalizehist", "_face_detector", "_predictor"]
-
-    def __init__(self, frame: Union[np.ndarray, str, None] = None, *, equalizehist: bool = False):
-        self.equalizehist = int(equalizehist)
-        self.calibration = Calibration()
-
-        # _face_detector is used to detect faces
-        self._face_detector = dlib.get_frontal_face_detector()
-
-        # _predictor is used to get facial landmarks of a given face
-        cwd = os.path.abspath(os.path.dirname(__file__))
-        model_path = os.path.abspath(os.path.join(cwd, "trained_models/shape_predictor_68_face_landmarks.dat"))
-        self._predictor = dlib.shape_predictor(model_path)
+    __slots__ = ["frame", "timestamp", "context", "history", "calibration", "equalizehist", "detection_scale",
+                "face_tracker", "landmark_flow", "buffers", "faces", "face_tracks",
+                "instrumentation", "pupil_backend", "_calibration_options", "_face_detector", "_predictor",
+                "_executor", "_sample"]
+
+    def __init__(
+        self,
+        frame: Union[np.ndarray, str, None] = None,
+        *,
+        equalizehist: bool = False,
+        track_face: bool = False,
+        redetect_interval: int = 30,
+        detection_scale: float = 1.0,
+        predictor_path: Optional[str] = None,
+        multi_face: bool = False,
+        workers: Optional[int] = None,
+        keyframe_interval: Optional[int] = None,
+        instrument: bool = False,
+        profile: Optional[CalibrationProfile] = None,
+        profile_checks: int = 5,
+        adaptive_calibration: bool = False,
+        pupil_backend: str = DEFAULT_BACKEND,
+        face_detector: Union[str, Any] = "hog",
+        history: int = 0
+    ):
+        """
+        Arguments:
+            frame (numpy.ndarray or str): Frame or image path to analyze at once
+            equalizehist (bool): Equalize the histogram of the frame before the detection
+            track_face (bool): Search the face only around the last detected face
+            redetect_interval (int): Maximum number of frames between two full-frame
+                detections when the face is tracked
+            detection_scale (float): Scale of the frame copy the face detector runs on,
+                e.g. 0.5 to detect faces at half resolution
+            predictor_path (str): Path of the facial landmark model, the bundled one by default
+            multi_face (bool): Analyze every face found in the frame, see `faces`
+            workers (int): Number of threads analyzing the faces concurrently in multi-face mode
+            keyframe_interval (int): Run the face detection and landmark prediction only every
+                this number of frames, and follow the eye landmarks with optical flow in between
+            instrument (bool): Collect the latency of every stage and the detection rates, see `stats`
+            profile (profiles.CalibrationProfile): Thresholds of an earlier session, which complete
+                the calibration at once; in multi-face mode, every face starts from them
+            profile_checks (int): Number of first frames the profile is checked on, the calibration
+                restarting if it no longer fits; 0 to trust the profile
+            adaptive_calibration (bool): Keep refining the thresholds on a background thread
+                after the calibration, to follow the lighting changes
+            pupil_backend (str): Name of the pupil localization backend, 'contours' (the most precise),
+                'centroid' or 'gradients' (faster), see pupil.BACKENDS
+            face_detector: Face detector backend, 'hog' (the most reliable), 'haar' or 'lbp'
+                (OpenCV cascades, faster), 'auto' to pick the fastest one detecting faces in
+                90% of the first frames, or a detector such as detector.HogDetector(upsample=1)
+            history (int): Number of the last samples kept in `history`, 0 to keep none
+        """
+        if detection_scale <= 0:
+            raise ValueError("detection scale must be positive")
+        if multi_face and (track_face or keyframe_interval):
+            raise ValueError("face tracking and keyframes only follow a single face")
+        if pupil_backend not in BACKENDS:
+            raise ValueError(f"unknown pupil backend '{pupil_backend}', expected one of {', '.join(BACKENDS)}")
+        self.pupil_backend = pupil_backend
+        self.equalizehist = bool(equalizehist)
+        self.detection_scale = detection_scale
+        # _calibration_options builds the calibration, and those of the faces in multi-face mode
+        self._calibration_options = (adaptive_calibration, profile, profile_checks)
+        self.calibration = self._new_calibration()
+
+        # instrumentation collects the stage latencies, None when disabled
+        self.instrumentation: Optional[Stats] = Stats() if instrument else None
+
+        # buffers holds the scratch arrays reused from one frame to the next
+        self.buffers = FrameBuffers()
+
+        # context holds the intermediates of the current frame, see reanalyze
+        self.context: Optional[FrameContext] = None
+
+        # _sample is the sample of the current frame, computed on first use,
+        # history keeps those of the last frames
+        self.timestamp = float("nan")
+        self._sample: Optional[np.void] = None
+        self.history: Optional[SampleHistory] = SampleHistory(history) if history else None
+
+        # _face_detector is used to detect faces, its model is shared by all the trackers
+        self._face_detector = create_detector(face_detector)
+
+        # face_tracker restricts the detection to the region of the last face
+        self.face_tracker: Optional[FaceTracker] = None
+        if track_face:
+            self.face_tracker = FaceTracker(self._face_detector, redetect_interval)
+
+        # landmark_flow follows the eye landmarks between keyframes
+        self.landmark_flow: Optional[LandmarkFlow] = None
+        if keyframe_interval:
+            self.landmark_flow = LandmarkFlow(keyframe_interval)
+
+        # _predictor is used to get facial landmarks of a given face, shared by all the trackers
+        self._predictor = models.shape_predictor(predictor_path)
+
+        # faces holds the faces found in the frame in multi-face mode,
+        # face_tracks keeps their calibration from one frame to the next
+        self.faces: List[Face] = []
+        self.face_tracks: Optional[FaceTracks] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if multi_face:
+            self.face_tracks = FaceTracks(calibration_factory=self._new_calibration)
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix="gaze-face")
 
         if frame is not None:
             if isinstance(frame, str):
@@ -47,142 +160,353 @@ class GazeTracking(object):
                     raise OSError("Invalid frame path.")
             self.refresh(frame)
 
-    @property
-    def pupils_located(self):
-        """Check that the pupils have been located"""
-        if self.eye_left is None or self.eye_right is None:
-            return False
-
-        return all(i > 0 for i in [
-            self.eye_left.pupil.x, self.eye_left.pupil.y, self.eye_right.pupil.x, self.eye_right.pupil.y])
+    def _new_calibration(self) -> Calibration:
+        """Returns a new calibration built with the options of the tracker"""
+        adaptive_calibration, profile, profile_checks = self._calibration_options
+        calibration = AdaptiveCalibration() if adaptive_calibration else Calibration()
+        if profile is not None:
+            calibration.load(profile, profile_checks)
+        return calibration
+
+    def _detect_faces(self, frame: np.ndarray) -> List[Any]:
+        """Returns the faces found in the grayscale frame, in full resolution coordinates"""
+        stats = self.instrumentation
+        if stats is not None:
+            start = time.perf_counter()
+
+        scale = self.detection_scale
+        if scale != 1.0:
+            height, width = frame.shape[:2]
+            size = (max(int(width * scale), 1), max(int(height * scale), 1))
+            small = self.buffers.get("detection", (size[1], size[0]))
+            frame = cv2.resize(frame, size, dst=small, interpolation=cv2.INTER_AREA)
+
+        if self.face_tracker is not None:
+            faces = self.face_tracker(frame)
+        else:
+            faces = self._face_detector(frame)
+
+        if scale != 1.0:
+            faces = [scale_rectangle(face, 1 / scale) for face in faces]
+        if stats is not None:
+            stats.lap("face_detection", start)
+        return faces
+
+    def _landmarks(self, frame: np.ndarray, face: Any) -> Any:
+        """Returns the facial landmarks of the face"""
+        stats = self.instrumentation
+        if stats is None:
+            return self._predictor(frame, face)
+        start = time.perf_counter()
+        landmarks = self._predictor(frame, face)
+        stats.lap("landmarks", start)
+        return landmarks
 
     def _analyze(self):
         """Detects the face and initialize Eye objects"""
-        frame = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
-        if self.equalizehist == 1:
-            frame = cv2.equalizeHist(frame)
-        faces = self._face_detector(frame)
+        stats = self.instrumentation
+        if stats is not None:
+            start = time.perf_counter()
+
+        context = self.context
+        equalized = bool(self.equalizehist)
+        flow = self.landmark_flow
+        # the previous frame is still needed by the optical flow
+        frame = context.gray(equalized, self.buffers, flow.previous if flow is not None else None)
+        if stats is not None:
+            stats.lap("gray", start)
+
+        if flow is not None:
+            self._analyze_keyframes(frame, flow)
+            return
+
+        key = (equalized, self.detection_scale)
+        faces = context.get("faces", key, lambda: self._detect_faces(frame))
+        if self.face_tracks is not None:
+            self._analyze_faces(frame, faces)
+            return
 
         try:
-            landmarks = self._predictor(frame, faces[0])
-            self.eye_left = Eye(frame, landmarks, LEFT_EYE, self.calibration)
-            self.eye_right = Eye(frame, landmarks, RIGHT_EYE, self.calibration)
+            landmarks = context.get("landmarks", key, lambda: self._landmarks(frame, faces[0]))
+            self.eye_left = self._eye(frame, landmarks, LEFT_EYE, key)
+            self.eye_right = self._eye(frame, landmarks, RIGHT_EYE, key)
 
         except IndexError:
             self.eye_left = None
             self.eye_right = None
 
-    def refresh(self, frame: np.ndarray):
+    def _eye(self, frame: np.ndarray, landmarks: Any, side: int, key: Any) -> Eye:
+        """Returns the eye of the side, reusing its eye frame if the frame
+        was already analyzed with the same preprocessing
+        """
+        context = self.context
+        key = key + (side,)
+        eye = context.peek("eye", key)
+        if eye is None:
+            buffers = self.buffers if context.owns_buffers(key[:-1]) else None
+            eye = Eye(frame, landmarks, side, self.calibration, buffers, self.instrumentation, self.pupil_backend)
+        else:
+            eye = eye.with_pupil(self.calibration.threshold(side), self.pupil_backend)
+        context.put("eye", key, eye)
+        return eye
+
+    def _analyze_keyframes(self, frame: np.ndarray, flow: LandmarkFlow) -> None:
+        """Initializes Eye objects from the landmarks followed by optical flow,
+        or from a new detection on keyframes
+        """
+        stats = self.instrumentation
+        if stats is not None:
+            start = time.perf_counter()
+
+        landmarks = flow.propagate(frame)
+        if stats is not None:
+            stats.lap("landmark_flow", start)
+        if landmarks is None:
+            faces = self._detect_faces(frame)
+            if len(faces) == 0:
+                self.eye_left = None
+                self.eye_right = None
+                return
+            landmarks = flow.keyframe(frame, self._landmarks(frame, faces[0]))
+            if stats is not None:
+                stats.count("keyframes")
+
+        self.eye_left = Eye(
+            frame, landmarks, LEFT_EYE, self.calibration, self.buffers, stats, self.pupil_backend)
+        self.eye_right = Eye(
+            frame, landmarks, RIGHT_EYE, self.calibration, self.buffers, stats, self.pupil_backend)
+        if not self.pupils_located:
+            # the landmarks may have drifted, the next frame is a keyframe
+            flow.reset()
+
+    def _analyze_faces(self, frame: np.ndarray, faces: List[Any]) -> None:
+        """Initializes a Face object for every face, concurrently"""
+        tracks = self.face_tracks.update(list(faces))
+        stats = self.instrumentation
+        backend = self.pupil_backend
+        if len(tracks) > 1:
+            self.faces = list(self._executor.map(
+                lambda track: Face(frame, track, self._predictor, stats, backend), tracks))
+        else:
+            self.faces = [Face(frame, track, self._predictor, stats, backend) for track in tracks]
+
+        if self.faces:
+            self.eye_left = self.faces[0].eye_left
+            self.eye_right = self.faces[0].eye_right
+        else:
+            self.eye_left = None
+            self.eye_right = None
+
+    def refresh(self, frame: np.ndarray, timestamp: Optional[float] = None):
         """Refreshes the frame and analyzes it.
 
         Arguments:
             frame (numpy.ndarray): The frame to analyze
+            timestamp (float): Time of the frame in seconds, the current time by default
         """
         self.frame = frame
-        if self.equalizehist == 2:
-            self.equalizehist = 1
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.context = FrameContext(frame)
+        self._refresh()
+
+    def reanalyze(self) -> None:
+        """Analyzes the current frame again, e.g. after changing equalizehist,
+        detection_scale, pupil_backend or the calibration. The intermediates of
+        the frame (grayscale frame, faces, landmarks, eye frames) are reused,
+        only the stages depending on the changed options are computed, and the
+        eye frames already analyzed are not sent to the calibration again.
+        The faces of multi-face mode and the landmarks of keyframe mode are
+        located again.
+        """
+        if self.context is None:
+            raise ValueError("no frame to analyze again, refresh the tracker first")
+        self.frame = self.context.frame
+        self._refresh(again=True)
+
+    def _refresh(self, again: bool = False) -> None:
+        stats = self.instrumentation
+        if stats is None:
+            self._analyze()
+            self._record(again)
+            return
+
+        start = time.perf_counter()
         self._analyze()
+        self._record(again)
+        stats.lap("refresh", start)
+        stats.count("frames")
+        if self.eye_left is not None:
+            stats.count("faces_detected")
+        if self.pupils_located:
+            stats.count("pupils_located")
+        if self.faces:
+            stats.count("faces", len(self.faces))
+
+    def _record(self, again: bool) -> None:
+        """Forgets the sample of the previous analysis, and keeps the new one in the history"""
+        self._sample = None
+        history = self.history
+        if history is not None:
+            if again:
+                history.replace_last(self.sample)
+            else:
+                history.append(self.sample)
 
-    def pupil_left_coords(self):
-        """Returns the coordinates of the left pupil"""
-        x = self.eye_left.origin[0] + self.eye_left.pupil.x
-        y = self.eye_left.origin[1] + self.eye_left.pupil.y
-        return (x, y)
-
-    def pupil_right_coords(self):
-        """Returns the coordinates of the right pupil"""
-        x = self.eye_right.origin[0] + self.eye_right.pupil.x
-        y = self.eye_right.origin[1] + self.eye_right.pupil.y
-        return (x, y)
-
-    def horizontal_ratio(self):
-        """Returns a number between 0.0 and 1.0 that indicates the
-        horizontal direction of the gaze. The extreme right is 0.0,
-        the center is 0.5 and the extreme left is 1.0
+    @property
+    def sample(self) -> np.void:
+        """Returns the sample of the current frame (see sample.SAMPLE_DTYPE),
+        a record holding no image
         """
-        pupil_left = self.eye_left.pupil.x / (self.eye_left.center[0] * 2 - 10)
-        pupil_right = self.eye_right.pupil.x / (self.eye_right.center[0] * 2 - 10)
-        return (pupil_left + pupil_right) / 2
-
-    def vertical_ratio(self):
-        """Returns a number between 0.0 and 1.0 that indicates the
-        vertical direction of the gaze. The extreme top is 0.0,
-        the center is 0.5 and the extreme bottom is 1.0
+        if self._sample is None:
+            samples = empty_samples(1)
+            samples["timestamp"][0] = self.timestamp
+            self._fill_sample(samples, 0)
+            self._sample = compute_directions(samples)[0]
+        return self._sample
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the instrumentation: the latency histograms of the
+        stages, the counters, the detection rates and the calibration state.
+        Only the calibration state is available if the instrumentation is disabled.
+        In multi-face mode, the calibration gauges aggregate the faces tracked
+        (all complete, fewest frames, mean thresholds) and `faces` holds the
+        calibration state of every track.
         """
-        pupil_left = self.eye_left.pupil.y / (self.eye_left.center[1] * 2 - 10)
-        pupil_right = self.eye_right.pupil.y / (self.eye_right.center[1] * 2 - 10)
-        return (pupil_left + pupil_right) / 2
-
-    def is_right(self) -> bool:
-        """Returns true if the user is looking to the right"""
-        if self.pupils_located:
-            return self.horizontal_ratio() <= 0.35
-        return False
-
-    def is_left(self) -> bool:
-        """Returns true if the user is looking to the left"""
-        if self.pupils_located:
-            return self.horizontal_ratio() >= 0.65
-        return False
-
-    def is_center(self) -> bool:
-        """Returns true if the user is looking to the center"""
-        if self.pupils_located:
-            return self.is_right() is not True and self.is_left() is not True
-        return False
+        if self.instrumentation is not None:
+            snapshot = self.instrumentation.snapshot()
+        else:
+            snapshot = {"stages": {}, "counters": {}}
+        snapshot["enabled"] = self.instrumentation is not None
+
+        counters = snapshot["counters"]
+        frames = counters.get("frames", 0)
+        snapshot["gauges"] = {
+            "detection_rate": counters.get("faces_detected", 0) / frames if frames else None,
+            "pupil_rate": counters.get("pupils_located", 0) / frames if frames else None,
+        }
+        if self.face_tracks is None:
+            snapshot["gauges"].update(_calibration_state(self.calibration))
+            return snapshot
+
+        faces = {track.track_id: _calibration_state(track.calibration)
+                 for track in list(self.face_tracks.tracks.values())}
+        snapshot["faces"] = faces
+        states = list(faces.values())
+        snapshot["gauges"].update({
+            "calibration_complete": bool(states) and all(state["calibration_complete"] for state in states),
+            "calibration_frames": min((state["calibration_frames"] for state in states), default=0),
+        })
+        for name in ("threshold_left", "threshold_right"):
+            thresholds = [state[name] for state in states if state[name] is not None]
+            snapshot["gauges"][name] = sum(thresholds) / len(thresholds) if thresholds else None
+        return snapshot
+
+    def analyze_batch(
+        self,
+        frames: Iterable[np.ndarray],
+        timestamps: Optional[Iterable[float]] = None
+    ) -> np.ndarray:
+        """Analyzes the frames one after the other and returns the results
+        as a structured array, one row per frame (see sample.SAMPLE_DTYPE).
+        The gaze ratios and directions are computed for the whole batch at once.
 
-    def is_blinking(self) -> bool:
-        """Returns true if the user closes his eyes"""
-        if self.pupils_located:
-            blinking_ratio = (self.eye_left.blinking + self.eye_right.blinking) / 2
-            return blinking_ratio > 3.8
-        return False
-    
-    def annotated_eye(self, side: int = BOTH_EYES, line_size: int = 1) -> np.ndarray:
-        """Returns the main frame with eyes highlighted"""
+        Arguments:
+            frames: List of frames, or an array of frames stacked on the first axis
+            timestamps: Time of every frame in seconds, the time each frame is analyzed at by default
+        """
+        if not isinstance(frames, (list, tuple, np.ndarray)):
+            frames = list(frames)
+        if timestamps is None:
+            timestamps = [None] * len(frames)
+        elif not isinstance(timestamps, (list, tuple, np.ndarray)):
+            timestamps = list(timestamps)
+        if len(timestamps) != len(frames):
+            raise ValueError("expected one timestamp per frame")
+
+        samples = empty_samples(len(frames))
+        for index, (frame, timestamp) in enumerate(zip(frames, timestamps)):
+            self.refresh(frame, timestamp)
+            self._fill_sample(samples, index)
+            samples["timestamp"][index] = self.timestamp
+
+        return compute_directions(samples)
+
+    def _located_pairs(self) -> List[EyePair]:
+        """Returns the faces whose pupils have been located"""
+        return [pair for pair in (self.faces or [self]) if pair.pupils_located]
+
+    def _draw_eyes(self, pairs: List[EyePair], side: int, line_size: int) -> None:
+        """Draws the eye frames of the faces on the main frame"""
         frame = self.frame
-        if not self.pupils_located:
-            return frame
-
         color = (233, 128, 0)
-        if side & LEFT_EYE:
-            pos1 = self.eye_left.origin
-            pos2 = (pos1[0] + self.eye_left.center[0] * 2, pos1[1] + self.eye_left.center[1] * 2)
-            cv2.rectangle(frame, pos1, pos2, color, line_size)
-        if side & RIGHT_EYE:
-            pos1 = self.eye_right.origin
-            pos2 = (pos1[0] + self.eye_right.center[0] * 2, pos1[1] + self.eye_right.center[1] * 2)
-            cv2.rectangle(frame, pos1, pos2, color, line_size)
-
-        return frame.copy()
-
-    def annotated_pupil(self, side: int = BOTH_EYES, line_size: int = 1) -> np.ndarray:
-        """Returns the main frame with pupils highlighted"""
+        for pair in pairs:
+            if side & LEFT_EYE:
+                pos1 = pair.eye_left.origin
+                pos2 = (pos1[0] + pair.eye_left.center[0] * 2, pos1[1] + pair.eye_left.center[1] * 2)
+                cv2.rectangle(frame, pos1, pos2, color, line_size)
+            if side & RIGHT_EYE:
+                pos1 = pair.eye_right.origin
+                pos2 = (pos1[0] + pair.eye_right.center[0] * 2, pos1[1] + pair.eye_right.center[1] * 2)
+                cv2.rectangle(frame, pos1, pos2, color, line_size)
+
+    def _draw_pupils(self, pairs: List[EyePair], side: int, line_size: int) -> None:
+        """Draws the pupils of the faces on the main frame"""
         frame = self.frame
-        if not self.pupils_located:
-            return frame
-
         line_len = 3 + 2 * line_size
-
         color = (0, 255, 0)
-        if side & LEFT_EYE:
-            x_left, y_left = self.pupil_left_coords()
-            cv2.line(frame, (x_left - line_len, y_left), (x_left + line_len, y_left), color, line_size)
-            cv2.line(frame, (x_left, y_left - line_len), (x_left, y_left + line_len), color, line_size)
-        if side & RIGHT_EYE:
-            x_right, y_right = self.pupil_right_coords()
-            cv2.line(frame, (x_right - line_len, y_right), (x_right + line_len, y_right), color, line_size)
-            cv2.line(frame, (x_right, y_right - line_len), (x_right, y_right + line_len), color, line_size)
-
-        return frame.copy()
+        for pair in pairs:
+            if side & LEFT_EYE:
+                x_left, y_left = pair.pupil_left_coords()
+                cv2.line(frame, (x_left - line_len, y_left), (x_left + line_len, y_left), color, line_size)
+                cv2.line(frame, (x_left, y_left - line_len), (x_left, y_left + line_len), color, line_size)
+            if side & RIGHT_EYE:
+                x_right, y_right = pair.pupil_right_coords()
+                cv2.line(frame, (x_right - line_len, y_right), (x_right + line_len, y_right), color, line_size)
+                cv2.line(frame, (x_right, y_right - line_len), (x_right, y_right + line_len), color, line_size)
+
+    def annotated_eye(self, side: int = BOTH_EYES, line_size: int = 1) -> np.ndarray:
+        """Returns the main frame with eyes highlighted.
+        The main frame is drawn on in place.
+        """
+        self._draw_eyes(self._located_pairs(), side, line_size)
+        return self.frame
+
+    def annotated_pupil(self, side: int = BOTH_EYES, line_size: int = 1) -> np.ndarray:
+        """Returns the main frame with pupils highlighted.
+        The main frame is drawn on in place.
+        """
+        self._draw_pupils(self._located_pairs(), side, line_size)
+        return self.frame
     
     def annotated_frame(self, side: int = BOTH_EYES, line_size: int = 1) -> np.ndarray:
-        if self.equalizehist == 1:
-            self.frame = hisEqulColor(self.frame)
-            self.equalizehist = 2
+        """Returns the main frame with eyes and pupils highlighted.
+        The main frame is drawn on in place, copy it first to keep the original.
+        With equalizehist, the main frame becomes an equalized copy of the frame,
+        held in a scratch buffer which the next frame overwrites.
+        """
+        if self.equalizehist:
+            context = self.context
+            self.frame = context.get("display", "equalized", self._equalized_frame)
+
+        pairs = self._located_pairs()
+        self._draw_eyes(pairs, side, line_size)
+        self._draw_pupils(pairs, side, line_size)
+        return self.frame
+
+    def _equalized_frame(self) -> np.ndarray:
+        """Returns the frame equalized into its scratch buffer"""
+        frame = self.context.frame
+        out = self.buffers.get("display", frame.shape)
+        np.copyto(out, frame)
+        return hisEqulColor(out)
 
-        self.annotated_eye(side, line_size)
-        return self.annotated_pupil(side,  line_size)
+    def release(self) -> None:
+        """Stops the background threads of the tracker"""
+        self.calibration.close()
+        if self.face_tracks is not None:
+            self.face_tracks.close()
+        if self._executor is not None:
+            self._executor.shutdown()
 
     def show(self, win_name: str = "Demo") -> None:
         cv2.imshow(win_name, self.frame)
@@ -196,9 +520,28 @@ class GazeTrackingFromVideo(GazeTracking):
     This class inherits from 'GazeTracking'.
     It provides an encapsulation iter to read from VideoCapture.
     """
-    __slots__ = ["capture", "flip"]
-
-    def __init__(self, capture: Union[str, int, cv2.VideoCapture] = 0, *, equalizehist: bool = False,  flip: bool = False):
+    __slots__ = ["capture", "flip", "live", "reader"]
+
+    def __init__(
+        self,
+        capture: Union[str, int, cv2.VideoCapture] = 0,
+        *,
+        flip: bool = False,
+        threaded: bool = False,
+        drop_stale: Optional[bool] = None,
+        queue_size: int = 4,
+        **kwds: Any
+    ):
+        """
+        Arguments:
+            capture: Video path, ID of camera or opened VideoCapture
+            flip (bool): Flip the frames horizontally
+            threaded (bool): Read the frames on a background thread
+            drop_stale (bool): Only analyze the latest frame read by the background thread,
+                by default true for cameras and false for video files
+            queue_size (int): Maximum number of frames waiting for the analysis
+            kwds: Arguments passed to GazeTracking
+        """
         if isinstance(capture, cv2.VideoCapture):
             self.capture = capture
         elif isinstance(capture, int):
@@ -206,8 +549,25 @@ class GazeTrackingFromVideo(GazeTracking):
         else:
             self.capture = cv2.VideoCapture(capture)
 
+        # live captures are stamped with the time the frames are read at,
+        # the others (video files) with the position of the frames in the video
+        self.live = isinstance(capture, int) or (
+            isinstance(capture, cv2.VideoCapture) and capture.get(cv2.CAP_PROP_FRAME_COUNT) <= 0)
         self.flip = flip
-        super().__init__(equalizehist=equalizehist)
+        super().__init__(**kwds)
+
+        self.reader: Optional[ThreadedCapture] = None
+        if threaded:
+            if drop_stale is None:
+                drop_stale = isinstance(capture, int)
+            self.reader = ThreadedCapture(self.capture, queue_size, drop_stale, video_time=not self.live)
+
+    @property
+    def dropped_frames(self) -> int:
+        """Returns the number of frames read but never analyzed"""
+        if self.reader is None:
+            return 0
+        return self.reader.dropped
     
     @property
     def width(self) -> int:
@@ -226,13 +586,27 @@ class GazeTrackingFromVideo(GazeTracking):
             return int(fps)
     
     def release(self) -> None:
-        self.capture.release()
+        if self.reader is not None:
+            self.reader.release()
+        else:
+            self.capture.release()
+        super().release()
     
+    def _timestamp(self) -> float:
+        """Returns the timestamp of the frame just read from the capture"""
+        if self.live:
+            return time.time()
+        return self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+
     def __iter__(self) -> "GazeTrackingFromVideo":
         return self
     
     def __next__(self) -> np.ndarray:
-        ret, raw_frame = self.capture.read()
+        if self.reader is not None:
+            ret, raw_frame, timestamp = self.reader.read()
+        else:
+            ret, raw_frame = self.capture.read()
+            timestamp = self._timestamp()
         if not ret:
             self.release()
             raise StopIteration(raw_frame)
@@ -240,5 +614,5 @@ class GazeTrackingFromVideo(GazeTracking):
         if self.flip:
             raw_frame = cv2.flip(raw_frame, 1)
         
-        self.refresh(raw_frame)
+        self.refresh(raw_frame, timestamp)
         return self.frame
\ No newline at end of file
@@ -0,0 +1,134 @@
+from __future__ import division
+import warnings
+from typing import Optional, Tuple
+import numpy as np
+
+from .sample import empty_samples
+
+
+class SampleHistory(object):
+    """
+    This class keeps the samples of the last frames in a ring of fixed size,
+    backed by an array of SAMPLE_DTYPE, so that a long session holds neither
+    images nor growing lists. The window queries run on the whole array at once.
+    """
+    __slots__ = ["capacity", "count", "_samples", "_next"]
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Arguments:
+            capacity (int): Number of samples kept, the oldest ones are overwritten
+        """
+        if capacity <= 0:
+            raise ValueError("the history capacity must be positive")
+        self.capacity = capacity
+        # count is the number of samples appended since the creation
+        self.count = 0
+        self._samples = empty_samples(capacity)
+        self._next = 0
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def append(self, sample: np.void) -> None:
+        """Stores a sample (see sample.SAMPLE_DTYPE), overwriting the oldest one if the ring is full"""
+        self._samples[self._next] = sample
+        self._next = (self._next + 1) % self.capacity
+        self.count += 1
+
+    def replace_last(self, sample: np.void) -> None:
+        """Replaces the last sample, e.g. with the result of a new analysis of its frame"""
+        if self.count == 0:
+            self.append(sample)
+            return
+        self._samples[(self._next - 1) % self.capacity] = sample
+
+    def clear(self) -> None:
+        self._samples[:] = empty_samples(self.capacity)
+        self._next = 0
+        self.count = 0
+
+    def samples(self, last: Optional[int] = None) -> np.ndarray:
+        """Returns a copy of the samples kept, from the oldest to the newest
+
+        Arguments:
+            last (int): Only return this number of the last samples
+        """
+        size = len(self)
+        if last is not None:
+            size = min(size, last)
+        start = self._next - size
+        if start >= 0:
+            return self._samples[start:self._next].copy()
+        return np.concatenate((self._samples[start:], self._samples[:self._next]))
+
+    def window(self, duration: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        """Returns the samples of a time window, from the oldest to the newest.
+        The samples without timestamp are left out of the time windows.
+
+        Arguments:
+            duration (float): Length of the window in seconds, all the samples kept by default
+            end (float): Time the window ends at, the timestamp of the last sample by default
+        """
+        samples = self.samples()
+        if duration is None or len(samples) == 0:
+            return samples
+        timestamps = samples["timestamp"]
+        if end is None:
+            end = timestamps[-1]
+        with np.errstate(invalid="ignore"):
+            return samples[(timestamps > end - duration) & (timestamps <= end)]
+
+    def mean_ratios(self, duration: Optional[float] = None) -> Tuple[float, float]:
+        """Returns the mean horizontal and vertical gaze ratios of the window,
+        over the frames where the pupils were located; nan if there is none
+
+        Arguments:
+            duration (float): Length of the window in seconds, all the samples kept by default
+        """
+        samples = self.window(duration)
+        located = samples[samples["located"]]
+        if len(located) == 0:
+            return float("nan"), float("nan")
+        return float(located["horizontal_ratio"].mean()), float(located["vertical_ratio"].mean())
+
+    def detection_rate(self, duration: Optional[float] = None) -> float:
+        """Returns the fraction of frames of the window where the eyes were found, nan if it is empty
+
+        Arguments:
+            duration (float): Length of the window in seconds, all the samples kept by default
+        """
+        samples = self.window(duration)
+        if len(samples) == 0:
+            return float("nan")
+        return float(np.count_nonzero(samples["eye_left_size"][:, 0] >= 0) / len(samples))
+
+    def pupil_rate(self, duration: Optional[float] = None) -> float:
+        """Returns the fraction of frames of the window where the pupils were located, nan if it is empty
+
+        Arguments:
+            duration (float): Length of the window in seconds, all the samples kept by default
+        """
+        samples = self.window(duration)
+        if len(samples) == 0:
+            return float("nan")
+        return float(np.count_nonzero(samples["located"]) / len(samples))
+
+    def blink_rate(self, duration: Optional[float] = None) -> float:
+        """Returns the number of blinks per minute in the window, counting the frames
+        where is_blinking becomes true, over the time the window covers; nan if it
+        covers no time
+
+        Arguments:
+            duration (float): Length of the window in seconds, all the samples kept by default
+        """
+        samples = self.window(duration)
+        timestamps = samples["timestamp"]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            span = np.nanmax(timestamps) - np.nanmin(timestamps) if len(samples) else np.nan
+        if not span > 0:
+            return float("nan")
+        blinking = samples["is_blinking"]
+        blinks = np.count_nonzero(blinking[1:] & ~blinking[:-1])
+        return float(blinks * 60 / span)
@@ -0,0 +1,80 @@
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+import cv2
+import dlib
+
+
+_cwd = os.path.abspath(os.path.dirname(__file__))
+PREDICTOR_PATH = os.path.abspath(os.path.join(_cwd, "trained_models/shape_predictor_68_face_landmarks.dat"))
+
+_lock = threading.Lock()
+_models: Dict[str, Any] = {}
+
+
+def _get(key: str, loader: Callable[[], Any]) -> Any:
+    """Returns the model stored under the key, loading it on first use"""
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = loader()
+                _models[key] = model
+    return model
+
+
+def face_detector() -> Any:
+    """Returns the dlib frontal face detector shared by the whole process"""
+    return _get("face_detector", dlib.get_frontal_face_detector)
+
+
+def shape_predictor(path: Optional[str] = None) -> Any:
+    """Returns the facial landmark predictor shared by the whole process
+
+    Arguments:
+        path (str): Path of the predictor model, the bundled 68 landmarks model by default
+    """
+    path = path or PREDICTOR_PATH
+    return _get("shape_predictor:" + path, lambda: dlib.shape_predictor(path))
+
+
+def load_cascade(path: str) -> Any:
+    """Returns a new OpenCV cascade classifier loaded from the path. A classifier
+    is not thread-safe, so threads running detections concurrently need their own.
+
+    Arguments:
+        path (str): Path of the cascade XML file
+    """
+    classifier = cv2.CascadeClassifier(path)
+    if classifier.empty():
+        raise OSError(f"cannot load the cascade '{path}'")
+    return classifier
+
+
+def cascade(path: str) -> Any:
+    """Returns the OpenCV cascade classifier loaded from the path, shared by the whole process
+
+    Arguments:
+        path (str): Path of the cascade XML file
+    """
+    return _get("cascade:" + path, lambda: load_cascade(path))
+
+
+def preload(path: Optional[str] = None) -> None:
+    """Loads the models and runs them once, so that processes forked
+    afterwards share them instead of loading their own copy.
+
+    Arguments:
+        path (str): Path of the predictor model, the bundled 68 landmarks model by default
+    """
+    frame = np.zeros((100, 100), np.uint8)
+    face_detector()(frame)
+    shape_predictor(path)(frame, dlib.rectangle(10, 10, 90, 90))
+
+
+def clear() -> None:
+    """Forgets the loaded models, the next trackers will load them again"""
+    with _lock:
+        _models.clear()
@@ -0,0 +1,326 @@
+from __future__ import division
+import os
+import glob
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import cv2
+
+from . import models
+from .calibration import Calibration
+from .gaze_tracking import GazeTracking
+from .sample import compute_directions, empty_samples
+
+
+IMAGE_EXTENSIONS = (".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp")
+
+_worker: Optional[GazeTracking] = None
+
+
+def _init_worker(calibration: Optional[Calibration], kwds: Dict[str, Any]) -> None:
+    """Creates the tracker of a worker process with the shared calibration"""
+    global _worker
+    _worker = GazeTracking(**kwds)
+    if calibration is not None:
+        _worker.calibration = calibration
+
+
+def _analyze_frames(gaze: GazeTracking, capture: cv2.VideoCapture, count: Optional[int], flip: bool) -> np.ndarray:
+    """Analyzes at most count frames read from the capture, all of them until
+    the end of the stream if count is None
+
+    Returns:
+        The samples of the frames read, directions included
+    """
+    chunks: List[np.ndarray] = []
+    remaining = count
+    while remaining is None or remaining > 0:
+        size = 256 if remaining is None else remaining
+        samples = empty_samples(size)
+        index = 0
+        while index < size:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            if flip:
+                frame = cv2.flip(frame, 1)
+            gaze.refresh(frame)
+            gaze._fill_sample(samples, index)
+            samples["timestamp"][index] = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            index += 1
+        chunks.append(samples[:index])
+        if index < size:
+            break
+        if remaining is not None:
+            remaining -= index
+    return compute_directions(np.concatenate(chunks))
+
+
+def _seek(path: str, start: int) -> cv2.VideoCapture:
+    """Opens the video positioned on the frame start. Seeking is not frame
+    accurate with every codec and backend, so the position reached is checked,
+    and the frames are decoded from the beginning if it is not the requested one.
+    """
+    capture = cv2.VideoCapture(path)
+    if start == 0:
+        return capture
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    position = int(capture.get(cv2.CAP_PROP_POS_FRAMES))
+    if position > start or position < 0:
+        capture.release()
+        capture = cv2.VideoCapture(path)
+        position = 0
+    while position < start and capture.grab():
+        position += 1
+    return capture
+
+
+def _analyze_range(path: str, start: int, stop: Optional[int], flip: bool) -> np.ndarray:
+    """Analyzes the frames [start, stop) of the video in a worker process,
+    until the end of the stream if stop is None
+    """
+    capture = _seek(path, start)
+    try:
+        return _analyze_frames(_worker, capture, None if stop is None else stop - start, flip)
+    finally:
+        capture.release()
+
+
+def _calibrate(path: str, flip: bool, limit: int, kwds: Dict[str, Any]) -> Tuple[np.ndarray, Calibration]:
+    """Analyzes the beginning of the video sequentially until the calibration
+    is complete, as a sequential run would, reading at most limit frames.
+
+    Returns:
+        The samples of the frames analyzed and the calibration, not complete
+        if the video or the limit was reached first
+    """
+    gaze = GazeTracking(**kwds)
+    capture = cv2.VideoCapture(path)
+    chunks: List[np.ndarray] = []
+    count = 0
+    try:
+        while count < limit and (not gaze.calibration.is_complete() or gaze.calibration.is_checking()):
+            samples = _analyze_frames(gaze, capture, 1, flip)
+            if len(samples) == 0:
+                break
+            chunks.append(samples)
+            count += 1
+    finally:
+        capture.release()
+        gaze.release()
+
+    samples = np.concatenate(chunks) if chunks else empty_samples(0)
+    return samples, gaze.calibration
+
+
+def analyze_video(
+    path: str,
+    jobs: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    *,
+    flip: bool = False,
+    calibration_frames: int = 300,
+    **kwds: Any
+) -> np.ndarray:
+    """Analyzes a video file on a pool of processes and returns one sample
+    per frame, in frame order (see sample.SAMPLE_DTYPE).
+
+    The calibration is first completed sequentially on the beginning of the
+    video, then shared with every worker, so the thresholds are the same as
+    in a sequential run. If it is not complete after calibration_frames
+    frames, e.g. when no face is found, the workers complete it on their own
+    frames, and the thresholds differ from a sequential run. The frame count
+    of the container is only used to split the video; the last worker reads
+    until the end of the stream.
+
+    The face tracking and the keyframes (track_face, keyframe_interval) follow
+    the frames of a chunk only, their state restarts at every chunk, so their
+    results depend on the chunks and differ from a sequential run.
+
+    Arguments:
+        path (str): Path of the video file
+        jobs (int): Number of worker processes, the number of CPUs by default
+        chunk_size (int): Number of frames analyzed by a worker at once
+        flip (bool): Flip the frames horizontally
+        calibration_frames (int): Maximum number of frames analyzed sequentially to
+            complete the calibration
+        kwds: Arguments passed to the GazeTracking of every worker
+    """
+    if kwds.get("adaptive_calibration"):
+        raise ValueError("the workers share a frozen calibration, it cannot be adaptive")
+    if kwds.get("multi_face"):
+        raise ValueError("the workers share the calibration of a single face, multi-face mode is not supported")
+    if kwds.get("track_face") or kwds.get("keyframe_interval"):
+        warnings.warn("the face tracking and keyframes restart at every chunk, "
+                      "the results depend on the chunks", RuntimeWarning, stacklevel=2)
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise OSError(f"cannot open the video '{path}'")
+    # often an estimate, e.g. computed from the duration
+    total = max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+    capture.release()
+
+    head, calibration = _calibrate(path, flip, calibration_frames, kwds)
+    start = len(head)
+    if not calibration.is_complete() or calibration.is_checking():
+        if start < calibration_frames:
+            # the whole video was analyzed
+            return head
+        warnings.warn(f"the calibration is not complete after {start} frames, every worker "
+                      "completes it on its own frames", RuntimeWarning, stacklevel=2)
+
+    # loaded before the pool is created, so that forked workers share the models
+    models.preload(kwds.get("predictor_path"))
+    jobs = jobs or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max((total - start) // (jobs * 4), 1)
+    ranges: List[Tuple[int, Optional[int]]] = [(i, i + chunk_size) for i in range(start, total, chunk_size)]
+    # the last range goes to the end of the stream, whatever the frame count says
+    if ranges:
+        ranges[-1] = (ranges[-1][0], None)
+    else:
+        ranges = [(start, None)]
+
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(calibration, kwds)) as executor:
+        futures = [executor.submit(_analyze_range, path, i, j, flip) for i, j in ranges]
+        chunks = [head] + [future.result() for future in futures]
+    return np.concatenate(chunks)
+
+
+def collect_images(source: str) -> List[str]:
+    """Returns the image paths of a directory, a glob pattern or a text file
+    listing one path per line.
+
+    Arguments:
+        source (str): Directory, glob pattern, file list (.txt) or single image path
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)
+                 if name.lower().endswith(IMAGE_EXTENSIONS)]
+    elif any(c in source for c in "*?["):
+        paths = glob.glob(source, recursive=True)
+    elif source.lower().endswith(".txt"):
+        with open(source, encoding="utf-8") as f:
+            paths = [line.strip() for line in f if line.strip()]
+        return paths
+    else:
+        paths = [source]
+    return sorted(paths)
+
+
+def _annotated_path(path: str, root: Optional[str], annotate_dir: str) -> str:
+    """Returns the path of the annotated image, keeping the path of the image
+    relative to the root of the batch so that images of the same name in
+    different directories do not overwrite each other
+    """
+    if root is None:
+        return os.path.join(annotate_dir, os.path.basename(path))
+    output = os.path.join(annotate_dir, os.path.relpath(os.path.abspath(path), root))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    return output
+
+
+def _batch_root(paths: List[str]) -> Optional[str]:
+    """Returns the deepest directory containing all the images, None if there is none (different drives)"""
+    try:
+        return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    except ValueError:
+        return None
+
+
+def _analyze_images(
+    paths: List[str],
+    io_threads: int,
+    annotate_dir: Optional[str],
+    root: Optional[str] = None
+) -> np.ndarray:
+    """Analyzes images in a worker process, decoding them on I/O threads.
+    Every image is analyzed with a new calibration, built with the options of
+    the tracker, as a single image would be.
+    """
+    gaze = _worker
+    samples = empty_samples(len(paths))
+    with ThreadPoolExecutor(io_threads) as pool:
+        for index, (path, frame) in enumerate(zip(paths, pool.map(cv2.imread, paths))):
+            if frame is None:
+                continue
+            gaze.calibration.close()
+            gaze.calibration = gaze._new_calibration()
+            gaze.refresh(frame)
+            gaze._fill_sample(samples, index)
+            if annotate_dir is not None:
+                cv2.imwrite(_annotated_path(path, root, annotate_dir), gaze.annotated_frame())
+    return compute_directions(samples)
+
+
+def iter_images(
+    paths: List[str],
+    jobs: Optional[int] = None,
+    chunk_size: int = 64,
+    io_threads: int = 4,
+    annotate_dir: Optional[str] = None,
+    **kwds: Any
+) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """Analyzes images on a pool of processes, each decoding its images on I/O
+    threads, and yields the results in the order of the paths, chunk by chunk.
+    Only a few chunks are in flight at once, so the memory does not grow with
+    the number of images.
+
+    Arguments:
+        paths (list): Paths of the images
+        jobs (int): Number of worker processes, the number of CPUs by default
+        chunk_size (int): Number of images analyzed by a worker at once
+        io_threads (int): Number of threads decoding the images in every worker
+        annotate_dir (str): Directory receiving the annotated images, under their
+            path relative to the deepest directory containing all the images
+        kwds: Arguments passed to the GazeTracking of every worker
+
+    Yields:
+        The paths of a chunk and their samples (see sample.SAMPLE_DTYPE),
+        where the images which could not be read are not located
+    """
+    root = None
+    if annotate_dir is not None:
+        os.makedirs(annotate_dir, exist_ok=True)
+        root = _batch_root(paths) if paths else None
+    models.preload(kwds.get("predictor_path"))
+    jobs = jobs or os.cpu_count() or 1
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(None, kwds)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, executor.submit(_analyze_images, chunk, io_threads, annotate_dir, root)))
+            if len(pending) >= jobs * 2:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+
+def analyze_images(
+    paths: List[str],
+    jobs: Optional[int] = None,
+    progress: Optional[Callable[[int, int, float], None]] = None,
+    **kwds: Any
+) -> np.ndarray:
+    """Analyzes images on a pool of processes and returns one sample per image,
+    in the order of the paths. See iter_images for the arguments.
+
+    Arguments:
+        progress: Called after every chunk with the number of images done,
+            the total number of images and the elapsed seconds
+    """
+    start = time.perf_counter()
+    results = [empty_samples(0)]
+    done = 0
+    for chunk, samples in iter_images(paths, jobs, **kwds):
+        results.append(samples)
+        done += len(chunk)
+        if progress is not None:
+            progress(done, len(paths), time.perf_counter() - start)
+    return np.concatenate(results)
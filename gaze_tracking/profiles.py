@@ -0,0 +1,117 @@
+import os
+import re
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".gaze_tracking", "profiles")
+
+
+class CalibrationProfile(object):
+    """
+    This class holds the binarization thresholds found for a user in front
+    of a camera, so that the next sessions start calibrated.
+    """
+    __slots__ = ["user", "camera", "threshold_left", "threshold_right", "threshold_step", "created"]
+
+    def __init__(
+        self,
+        user: str,
+        camera: str,
+        threshold_left: int,
+        threshold_right: int,
+        threshold_step: int = 5,
+        created: Optional[float] = None
+    ):
+        """
+        Arguments:
+            user (str): Name of the user
+            camera (str): Name of the camera, e.g. its ID or model
+            threshold_left (int): Binarization threshold of the left eye
+            threshold_right (int): Binarization threshold of the right eye
+            threshold_step (int): Gap between two candidate thresholds of the calibration
+            created (float): Time the profile was calibrated, now by default
+        """
+        self.user = user
+        self.camera = camera
+        self.threshold_left = int(threshold_left)
+        self.threshold_right = int(threshold_right)
+        self.threshold_step = int(threshold_step)
+        self.created = time.time() if created is None else created
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CalibrationProfile":
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def __repr__(self) -> str:
+        return (f"CalibrationProfile(user={self.user!r}, camera={self.camera!r}, "
+                f"threshold_left={self.threshold_left}, threshold_right={self.threshold_right})")
+
+
+def _slug(name: str) -> str:
+    """Returns the name with the characters not allowed in file names replaced"""
+    return re.sub(r"[^\w.-]", "_", str(name)) or "_"
+
+
+class ProfileStore(object):
+    """
+    This class saves the calibration profiles as JSON files of a directory,
+    one file per user and camera.
+    """
+    __slots__ = ["directory"]
+
+    def __init__(self, directory: str = DEFAULT_DIRECTORY):
+        """
+        Arguments:
+            directory (str): Directory of the profile files, created when a profile is saved
+        """
+        self.directory = directory
+
+    def path(self, user: str, camera: str) -> str:
+        """Returns the path of the profile file of the user and camera"""
+        return os.path.join(self.directory, f"{_slug(user)}@{_slug(camera)}.json")
+
+    def load(self, user: str, camera: str) -> Optional[CalibrationProfile]:
+        """Returns the profile of the user and camera, or None if there is none"""
+        try:
+            with open(self.path(user, camera), encoding="utf-8") as f:
+                return CalibrationProfile.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def save(self, profile: CalibrationProfile) -> str:
+        """Writes the profile, replacing the previous one of the user and camera
+
+        Returns:
+            The path of the profile file
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(profile.user, profile.camera)
+        # written next to the profile then renamed, so a reader never sees a partial file
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(profile.to_dict(), f, indent=2)
+        os.replace(temporary, path)
+        return path
+
+    def delete(self, user: str, camera: str) -> None:
+        """Removes the profile of the user and camera, if any"""
+        try:
+            os.remove(self.path(user, camera))
+        except FileNotFoundError:
+            pass
+
+    def profiles(self) -> List[CalibrationProfile]:
+        """Returns all the saved profiles"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    profiles.append(CalibrationProfile.from_dict(json.load(f)))
+        return profiles
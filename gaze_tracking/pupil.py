@@ -1,55 +1,193 @@
+from typing import Callable, Dict, Optional, Tuple
 import numpy as np
 import cv2
 
 
+_KERNEL = np.ones((3, 3), np.uint8)
+
+# a backend locates the pupil in an eye frame binarized with the threshold,
+# it returns the (x, y) position, (-1, -1) if not found, and the iris frame
+Backend = Callable[[np.ndarray, int, Optional[np.ndarray]], Tuple[int, int, Optional[np.ndarray]]]
+BACKENDS: Dict[str, Backend] = {}
+DEFAULT_BACKEND = "contours"
+
+
+def register_backend(name: str, backend: Backend) -> None:
+    """Makes a pupil localization backend available to the trackers
+
+    Arguments:
+        name (str): Name of the backend, e.g. given to GazeTracking(pupil_backend=name)
+        backend: Function(eye_frame, threshold, out) returning (x, y, iris_frame)
+    """
+    BACKENDS[name] = backend
+
+
+def _contours(eye_frame: np.ndarray, threshold: int, out: Optional[np.ndarray]) -> Tuple[int, int, np.ndarray]:
+    """Locates the pupil at the centroid of the second largest contour of the
+    smoothed and binarized eye frame, the largest one being the frame border
+    """
+    iris_frame = Pupil.image_processing(eye_frame, threshold, out)
+
+    contours, _ = cv2.findContours(iris_frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2:]
+    contours = sorted(contours, key=cv2.contourArea)
+
+    try:
+        moments = cv2.moments(contours[-2])
+        return int(moments['m10'] / moments['m00']), int(moments['m01'] / moments['m00']), iris_frame
+    except (IndexError, ZeroDivisionError):
+        return -1, -1, iris_frame
+
+
+def _downscale(eye_frame: np.ndarray, width: int) -> Tuple[np.ndarray, float]:
+    """Returns the eye frame reduced to the given width at most, and the reduction factor"""
+    factor = eye_frame.shape[1] / width
+    if factor <= 1:
+        return eye_frame, 1.0
+    size = (width, max(int(round(eye_frame.shape[0] / factor)), 1))
+    return cv2.resize(eye_frame, size, interpolation=cv2.INTER_AREA), factor
+
+
+def _scratch(out: Optional[np.ndarray], shape: Tuple[int, ...]) -> Optional[np.ndarray]:
+    """Returns an array of the given shape backed by the beginning of out,
+    which holds the eye frame shape, or None without out
+    """
+    if out is None:
+        return None
+    return out.reshape(-1)[:shape[0] * shape[1]].reshape(shape)
+
+
+def _centroid(eye_frame: np.ndarray, threshold: int, out: Optional[np.ndarray]) -> Tuple[int, int, np.ndarray]:
+    """Locates the pupil at the centroid of the pixels darker than the
+    threshold, on a copy of the eye frame reduced to 24 pixels wide.
+    The reduced iris frame is written into out.
+    """
+    small, factor = _downscale(eye_frame, 24)
+    _, iris_frame = cv2.threshold(small, threshold, 255, cv2.THRESH_BINARY, _scratch(out, small.shape))
+
+    moments = cv2.moments(cv2.bitwise_not(iris_frame), True)
+    if moments['m00'] == 0:
+        return -1, -1, iris_frame
+    x = (moments['m10'] / moments['m00'] + 0.5) * factor - 0.5
+    y = (moments['m01'] / moments['m00'] + 0.5) * factor - 0.5
+    return int(x), int(y), iris_frame
+
+
+def _gradients(eye_frame: np.ndarray, threshold: int, out: Optional[np.ndarray]) -> Tuple[int, int, np.ndarray]:
+    """Locates the pupil at the point which the strongest intensity gradients
+    are best aligned with, pointing away from it (the means of gradients method),
+    on a copy of the eye frame reduced to 24 pixels wide. Only the pixels darker
+    than the threshold are candidates. The reduced iris frame is written into out.
+    """
+    small, factor = _downscale(eye_frame, 24)
+    _, iris_frame = cv2.threshold(small, threshold, 255, cv2.THRESH_BINARY, _scratch(out, small.shape))
+    cy, cx = np.nonzero(iris_frame == 0)
+    if len(cx) == 0:
+        return -1, -1, iris_frame
+
+    image = small.astype(np.float32)
+    gx = cv2.Sobel(image, cv2.CV_32F, 1, 0, ksize=3).ravel()
+    gy = cv2.Sobel(image, cv2.CV_32F, 0, 1, ksize=3).ravel()
+    magnitude = np.hypot(gx, gy)
+    # the 64 strongest gradients, at most, are enough to outline the iris
+    points = np.argpartition(magnitude, -64)[-64:] if magnitude.size > 64 else np.arange(magnitude.size)
+    points = points[magnitude[points] > 0]
+    if len(points) == 0:
+        return -1, -1, iris_frame
+    py, px = np.divmod(points, small.shape[1])
+    ux = gx[points] / magnitude[points]
+    uy = gy[points] / magnitude[points]
+
+    # displacements from every candidate center to every gradient point
+    dx = (px[None, :] - cx[:, None]).astype(np.float32)
+    dy = (py[None, :] - cy[:, None]).astype(np.float32)
+    norm = np.hypot(dx, dy)
+    norm[norm == 0] = np.inf
+    dots = (dx * ux + dy * uy) / norm
+    np.maximum(dots, 0, out=dots)
+    # dark centers are favored, as the pupil is the darkest part of the eye
+    scores = (dots * dots).sum(axis=1) * (255 - image[cy, cx])
+
+    best = int(np.argmax(scores))
+    x = (cx[best] + 0.5) * factor - 0.5
+    y = (cy[best] + 0.5) * factor - 0.5
+    return int(x), int(y), iris_frame
+
+
 class Pupil(object):
     """
     This class detects the iris of an eye and estimates
     the position of the pupil
     """
-    __slots__ = ["x", "y", "iris_frame", "threshold"]
+    __slots__ = ["x", "y", "iris_frame", "threshold", "backend"]
 
-    def __init__(self, eye_frame: np.ndarray, threshold: int):
+    def __init__(
+        self,
+        eye_frame: np.ndarray,
+        threshold: int,
+        out: Optional[np.ndarray] = None,
+        backend: str = DEFAULT_BACKEND
+    ):
+        """
+        Arguments:
+            eye_frame (numpy.ndarray): Frame containing an eye and nothing else
+            threshold (int): Threshold value used to binarize the eye frame
+            out (numpy.ndarray): Array of the eye frame shape receiving the iris frame,
+                reduced by the centroid and gradients backends
+            backend (str): Name of the localization backend, 'contours' (the most precise),
+                'centroid' or 'gradients' (faster), see BACKENDS
+        """
         self.iris_frame = None
         self.threshold = threshold
+        self.backend = backend
         self.x = -1
         self.y = -1
 
-        self.detect_iris(eye_frame)
+        self.detect_iris(eye_frame, out)
 
     @staticmethod
-    def image_processing(eye_frame: np.ndarray, threshold: int) -> np.ndarray:
+    def image_processing(eye_frame: np.ndarray, threshold: int, out: Optional[np.ndarray] = None) -> np.ndarray:
         """Performs operations on the eye frame to isolate the iris
 
         Arguments:
             eye_frame (numpy.ndarray): Frame containing an eye and nothing else
             threshold (int): Threshold value used to binarize the eye frame
+            out (numpy.ndarray): Array of the eye frame shape receiving the result,
+                a new one is allocated if omitted
 
         Returns:
             A frame with a single element representing the iris
         """
-        kernel = np.ones((3, 3), np.uint8)
-        new_frame = cv2.bilateralFilter(eye_frame, 10, 15, 15)
-        new_frame = cv2.erode(new_frame, kernel, iterations=3)
-        new_frame = cv2.threshold(new_frame, threshold, 255, cv2.THRESH_BINARY)[1]
+        new_frame = Pupil.smoothing(eye_frame, out)
+        cv2.threshold(new_frame, threshold, 255, cv2.THRESH_BINARY, dst=new_frame)
 
         return new_frame
 
-    def detect_iris(self, eye_frame: np.ndarray) -> None:
-        """Detects the iris and estimates the position of the iris by
-        calculating the centroid.
+    @staticmethod
+    def smoothing(eye_frame: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Filters and erodes the eye frame, the part of the image processing
+        which does not depend on the threshold
+
+        Arguments:
+            eye_frame (numpy.ndarray): Frame containing an eye and nothing else
+            out (numpy.ndarray): Array of the eye frame shape receiving the result,
+                a new one is allocated if omitted
+        """
+        new_frame = cv2.bilateralFilter(eye_frame, 10, 15, 15, dst=out)
+        cv2.erode(new_frame, _KERNEL, dst=new_frame, iterations=3)
+        return new_frame
+
+    def detect_iris(self, eye_frame: np.ndarray, out: Optional[np.ndarray] = None) -> None:
+        """Detects the iris and estimates the position of the pupil
+        with the backend of the pupil.
 
         Arguments:
             eye_frame (numpy.ndarray): Frame containing an eye and nothing else
+            out (numpy.ndarray): Array of the eye frame shape receiving the iris frame,
+                reduced by the centroid and gradients backends
         """
-        self.iris_frame = self.image_processing(eye_frame, self.threshold)
+        self.x, self.y, self.iris_frame = BACKENDS[self.backend](eye_frame, self.threshold, out)
 
-        contours, _ = cv2.findContours(self.iris_frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)[-2:]
-        contours = sorted(contours, key=cv2.contourArea)
 
-        try:
-            moments = cv2.moments(contours[-2])
-            self.x = int(moments['m10'] / moments['m00'])
-            self.y = int(moments['m01'] / moments['m00'])
-        except (IndexError, ZeroDivisionError):
-            pass
+register_backend("contours", _contours)
+register_backend("centroid", _centroid)
+register_backend("gradients", _gradients)
@@ -0,0 +1,364 @@
+import os
+import time
+import queue
+import threading
+import traceback
+import multiprocessing
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+import cv2
+
+from .calibration import Calibration
+from .gaze_tracking import GazeTracking, GazeTrackingFromVideo
+from .sample import SAMPLE_DTYPE
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+
+class FrameRing(object):
+    """
+    This class is a ring of preallocated frame slots in shared memory, so that
+    frames are handed over to other processes without being pickled.
+    A producer acquires a free slot, writes a frame into it and publishes it;
+    a consumer reads the published slot as a NumPy view and releases it.
+    Every published frame gets a sequence number, stored with the slot, which
+    identifies its results on the side channel.
+
+    The ring is passed to the other processes as an argument of
+    multiprocessing.Process, which attaches them to the same memory.
+    """
+    __slots__ = ["shape", "slots", "sequence", "dropped", "results",
+                 "_shm", "_owner", "_frames", "_sequences", "_timestamps", "_free", "_ready"]
+
+    def __init__(self, shape: Tuple[int, ...], slots: int = 8, context: Optional[Any] = None):
+        """
+        Arguments:
+            shape (tuple): Shape of the frames, e.g. (1080, 1920, 3)
+            slots (int): Number of frame slots
+            context: multiprocessing context creating the queues, the default one by default
+        """
+        if shared_memory is None:
+            raise OSError("shared memory needs Python 3.8 or newer")
+        context = context or multiprocessing.get_context()
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.sequence = 0
+        self.dropped = 0
+        self._shm = shared_memory.SharedMemory(create=True, size=self._size())
+        # forked processes inherit the ring as is, the creating process alone frees it
+        self._owner = os.getpid()
+        self._map()
+
+        # the queues carry slot indices only, the frames stay in the shared memory
+        self._free = context.Queue()
+        self._ready = context.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        # results is the side channel of the consumers, e.g. (sequence, sample bytes)
+        self.results = context.Queue()
+
+    def _size(self) -> int:
+        return self.slots * (16 + int(np.prod(self.shape)))
+
+    def _map(self) -> None:
+        """Creates the views of the slot headers and frames on the shared memory"""
+        buffer = self._shm.buf
+        self._sequences = np.ndarray((self.slots,), np.int64, buffer, 0)
+        self._timestamps = np.ndarray((self.slots,), np.float64, buffer, 8 * self.slots)
+        self._frames = np.ndarray((self.slots,) + self.shape, np.uint8, buffer, 16 * self.slots)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {
+            "shape": self.shape, "slots": self.slots, "name": self._shm.name,
+            "free": self._free, "ready": self._ready, "results": self.results,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.shape = state["shape"]
+        self.slots = state["slots"]
+        self.sequence = 0
+        self.dropped = 0
+        # the memory belongs to the creating process, which unlinks it
+        self._shm = shared_memory.SharedMemory(state["name"])
+        self._owner = None
+        self._map()
+        self._free = state["free"]
+        self._ready = state["ready"]
+        self.results = state["results"]
+
+    def acquire(self, block: bool = True, timeout: Optional[float] = None) -> Optional[int]:
+        """Returns a free slot to write a frame into, or None if there is none in time
+
+        Arguments:
+            block (bool): Wait for a slot to be released if they are all in use
+            timeout (float): Maximum number of seconds waited
+        """
+        try:
+            return self._free.get(block, timeout)
+        except queue.Empty:
+            return None
+
+    def frame(self, slot: int) -> np.ndarray:
+        """Returns the frame of a slot, a view on the shared memory"""
+        return self._frames[slot]
+
+    def publish(self, slot: int, timestamp: float = 0.0) -> int:
+        """Hands the frame written into an acquired slot over to the consumers
+
+        Returns:
+            The sequence number of the frame
+        """
+        sequence = self.sequence
+        self.sequence += 1
+        self._sequences[slot] = sequence
+        self._timestamps[slot] = timestamp
+        self._ready.put((slot, sequence))
+        return sequence
+
+    def write(self, frame: np.ndarray, timestamp: float = 0.0, block: bool = True) -> Optional[int]:
+        """Copies a frame into a free slot and publishes it
+
+        Arguments:
+            frame (numpy.ndarray): Frame of the ring shape
+            timestamp (float): Time of the frame in seconds
+            block (bool): Wait for a free slot, instead of dropping the frame
+
+        Returns:
+            The sequence number of the frame, or None if it was dropped
+        """
+        slot = self.acquire(block)
+        if slot is None:
+            self.dropped += 1
+            return None
+        np.copyto(self._frames[slot], frame)
+        return self.publish(slot, timestamp)
+
+    def read(self, timeout: Optional[float] = None) -> Optional[Tuple[int, int, float, np.ndarray]]:
+        """Returns the next published frame as (slot, sequence, timestamp, frame),
+        or None once the producer has stopped. The frame is a view on the shared
+        memory, valid until the slot is released.
+
+        Arguments:
+            timeout (float): Maximum number of seconds waited, queue.Empty is raised after it
+        """
+        item = self._ready.get(True, timeout)
+        if item is None:
+            return None
+        slot, sequence = item
+        if self._sequences[slot] != sequence:
+            raise RuntimeError(f"slot {slot} was overwritten before frame {sequence} was read")
+        return slot, sequence, float(self._timestamps[slot]), self._frames[slot]
+
+    def release(self, slot: int) -> None:
+        """Gives a slot read back to the producer"""
+        self._free.put(slot)
+
+    def stop(self, consumers: int = 1) -> None:
+        """Tells the consumers that no frame will be published anymore"""
+        for _ in range(consumers):
+            self._ready.put(None)
+
+    def close(self) -> None:
+        """Detaches the process from the shared memory, and frees it if the ring was created here"""
+        self._frames = self._sequences = self._timestamps = None
+        self._shm.close()
+        if self._owner == os.getpid():
+            self._shm.unlink()
+
+
+def _ring_worker(ring: FrameRing, calibration: Calibration, kwds: Dict[str, Any]) -> None:
+    """Analyzes the frames of the ring until the producer stops, sending
+    (sequence, sample bytes) to the results channel
+    """
+    gaze = GazeTracking(**kwds)
+    gaze.calibration = calibration
+    try:
+        while True:
+            item = ring.read()
+            if item is None:
+                break
+            slot, sequence, timestamp, frame = item
+            try:
+                gaze.refresh(frame, timestamp)
+                sample = gaze.sample
+            finally:
+                ring.release(slot)
+            ring.results.put((sequence, sample.tobytes()))
+    except Exception:
+        ring.results.put(("error", traceback.format_exc()))
+    finally:
+        ring.close()
+
+
+class LiveAnalyzer(object):
+    """
+    This class analyzes a live stream on several processes. The frames are
+    read straight into the slots of a shared-memory FrameRing, analyzed by
+    worker processes sharing the calibration, and their samples are yielded
+    in the order of the frames. At most `max_pending` frames are read ahead
+    of the samples yielded, so the results do not pile up in memory when the
+    consumer is slower than the workers.
+    """
+    __slots__ = ["gaze", "ring", "workers", "slots", "max_pending", "drop", "_kwds", "_processes", "_reader",
+                 "_stop", "_outstanding"]
+
+    def __init__(
+        self,
+        capture: Union[str, int, cv2.VideoCapture] = 0,
+        *,
+        workers: int = 4,
+        slots: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        flip: bool = False,
+        drop: Optional[bool] = None,
+        **kwds: Any
+    ):
+        """
+        Arguments:
+            capture: Video path, ID of camera or opened VideoCapture
+            workers (int): Number of analysis processes
+            slots (int): Number of frame slots of the ring, twice the workers by default
+            max_pending (int): Maximum number of frames read and not yet yielded,
+                twice the slots by default
+            flip (bool): Flip the frames horizontally
+            drop (bool): Drop the frames read while all the slots are in use or
+                max_pending frames are waiting, instead of waiting, by default true
+                for cameras and false for video files
+            kwds: Arguments passed to the GazeTracking of every worker
+        """
+        if kwds.get("adaptive_calibration"):
+            raise ValueError("the workers share a frozen calibration, it cannot be adaptive")
+        # the frames are analyzed in this process until the calibration is complete
+        self.gaze = GazeTrackingFromVideo(capture, flip=flip, **kwds)
+        self.ring: Optional[FrameRing] = None
+        self.workers = workers
+        self.slots = slots or 2 * workers
+        self.max_pending = max_pending or 2 * self.slots
+        self.drop = isinstance(capture, int) if drop is None else drop
+        self._kwds = kwds
+        self._processes: List[multiprocessing.Process] = []
+        self._reader: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # _outstanding counts the frames read and not yet yielded, released by __iter__
+        self._outstanding = threading.BoundedSemaphore(self.max_pending)
+
+    @property
+    def dropped_frames(self) -> int:
+        """Returns the number of frames read while all the slots were in use
+        or max_pending frames were waiting"""
+        return self.ring.dropped if self.ring is not None else 0
+
+    def _start(self, shape: Tuple[int, ...]) -> None:
+        """Creates the ring, the worker processes and the reader thread"""
+        self.ring = FrameRing(shape, self.slots)
+        for _ in range(self.workers):
+            process = multiprocessing.Process(
+                target=_ring_worker, args=(self.ring, self.gaze.calibration, self._kwds), daemon=True)
+            process.start()
+            self._processes.append(process)
+        self._reader = threading.Thread(target=self._read, name="gaze-ring", daemon=True)
+        self._reader.start()
+
+    def _read(self) -> None:
+        """Reads the capture into the slots of the ring, until the end of the stream"""
+        ring = self.ring
+        capture = self.gaze.capture
+        try:
+            while not self._stop.is_set():
+                if not self._outstanding.acquire(not self.drop, None if self.drop else 0.1):
+                    if self.drop:
+                        ring.dropped += 1
+                        if not capture.grab():
+                            break
+                    continue
+                slot = ring.acquire(not self.drop, 0.1)
+                if slot is None:
+                    self._outstanding.release()
+                    if self.drop:
+                        ring.dropped += 1
+                        if not capture.grab():
+                            break
+                    continue
+
+                view = ring.frame(slot)
+                if self.gaze.flip:
+                    ret, frame = capture.read()
+                    if ret:
+                        cv2.flip(frame, 1, dst=view)
+                else:
+                    # decoded in the slot itself when the shape matches
+                    ret, frame = capture.read(view)
+                    if ret and frame is not view:
+                        np.copyto(view, frame)
+                if not ret:
+                    ring.release(slot)
+                    self._outstanding.release()
+                    break
+                ring.publish(slot, self.gaze._timestamp())
+        finally:
+            ring.results.put(("end", ring.sequence))
+            ring.stop(self.workers)
+
+    def _drain(self) -> None:
+        """Discards the results not read yet"""
+        try:
+            while True:
+                self.ring.results.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __iter__(self) -> Iterator[np.void]:
+        """Yields the samples of the frames (see sample.SAMPLE_DTYPE), in order"""
+        gaze = self.gaze
+        while not (gaze.calibration.is_complete() and not gaze.calibration.is_checking()):
+            try:
+                next(gaze)
+            except StopIteration:
+                return
+            yield gaze.sample
+
+        self._start(gaze.frame.shape)
+        pending: Dict[int, bytes] = {}
+        expected = 0
+        total: Optional[int] = None
+        while total is None or expected < total:
+            try:
+                key, value = self.ring.results.get(True, 1.0)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self._processes):
+                    raise RuntimeError("the workers stopped before analyzing all the frames")
+                continue
+            if key == "error":
+                raise RuntimeError(f"a worker failed:\n{value}")
+            if key == "end":
+                total = value
+                continue
+            pending[key] = value
+            while expected in pending:
+                sample = np.frombuffer(pending.pop(expected), SAMPLE_DTYPE)[0]
+                expected += 1
+                self._outstanding.release()
+                yield sample
+
+    def release(self, timeout: float = 5.0) -> None:
+        """Stops the reader and the workers, and frees the ring.
+        The workers left running after timeout seconds are terminated.
+        """
+        self._stop.set()
+        if self._reader is not None:
+            self._reader.join()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            # a worker only exits once its results are flushed, so they are drained meanwhile
+            while process.is_alive() and time.monotonic() < deadline:
+                self._drain()
+                process.join(0.05)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.gaze.release()
+        if self.ring is not None:
+            self.ring.close()
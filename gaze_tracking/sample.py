@@ -0,0 +1,81 @@
+from __future__ import division
+import numpy as np
+
+
+RIGHT_THRESHOLD = 0.35
+LEFT_THRESHOLD = 0.65
+BLINKING_THRESHOLD = 3.8
+
+
+# One row per analyzed frame. Coordinates are in pixels of the full frame,
+# the eye sizes are the (width, height) of the isolated eye frames and the
+# timestamp is in seconds, nan when unknown.
+SAMPLE_DTYPE = np.dtype([
+    ("timestamp", np.float64),
+    ("located", np.bool_),
+    ("pupil_left", np.int32, (2,)),
+    ("pupil_right", np.int32, (2,)),
+    ("eye_left_origin", np.int32, (2,)),
+    ("eye_left_size", np.int32, (2,)),
+    ("eye_right_origin", np.int32, (2,)),
+    ("eye_right_size", np.int32, (2,)),
+    ("blinking_ratio", np.float64),
+    ("horizontal_ratio", np.float64),
+    ("vertical_ratio", np.float64),
+    ("is_left", np.bool_),
+    ("is_right", np.bool_),
+    ("is_center", np.bool_),
+    ("is_blinking", np.bool_),
+])
+
+
+def empty_samples(size: int) -> np.ndarray:
+    """Returns an array of samples where nothing has been located
+
+    Arguments:
+        size (int): Number of samples
+    """
+    samples = np.zeros(size, SAMPLE_DTYPE)
+    for name in ("pupil_left", "pupil_right", "eye_left_origin", "eye_left_size",
+                 "eye_right_origin", "eye_right_size"):
+        samples[name] = -1
+    for name in ("timestamp", "blinking_ratio", "horizontal_ratio", "vertical_ratio"):
+        samples[name] = np.nan
+    return samples
+
+
+def _pupil_ratio(samples: np.ndarray, axis: int) -> np.ndarray:
+    """Returns the mean position of both pupils relative to their eye frames,
+    on the given axis (0 for horizontal, 1 for vertical)
+    """
+    ratios = []
+    for side in ("left", "right"):
+        pupil = samples["pupil_" + side][:, axis] - samples[f"eye_{side}_origin"][:, axis]
+        size = samples[f"eye_{side}_size"][:, axis] // 2 * 2 - 10
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios.append(pupil / size)
+    return (ratios[0] + ratios[1]) / 2
+
+
+def compute_directions(samples: np.ndarray) -> np.ndarray:
+    """Fills the gaze ratios and the direction flags of the samples from
+    their pupil and eye positions, for the whole array at once.
+
+    Arguments:
+        samples (numpy.ndarray): Array of SAMPLE_DTYPE, modified in place
+
+    Returns:
+        The samples array
+    """
+    located = samples["located"]
+    horizontal = np.where(located, _pupil_ratio(samples, 0), np.nan)
+    vertical = np.where(located, _pupil_ratio(samples, 1), np.nan)
+    samples["horizontal_ratio"] = horizontal
+    samples["vertical_ratio"] = vertical
+
+    with np.errstate(invalid="ignore"):
+        samples["is_right"] = located & (horizontal <= RIGHT_THRESHOLD)
+        samples["is_left"] = located & (horizontal >= LEFT_THRESHOLD)
+        samples["is_blinking"] = located & (samples["blinking_ratio"] > BLINKING_THRESHOLD)
+    samples["is_center"] = located & ~samples["is_right"] & ~samples["is_left"]
+    return samples
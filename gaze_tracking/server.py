@@ -0,0 +1,388 @@
+import os
+import sys
+import time
+import queue
+import socket
+import struct
+import threading
+import socketserver
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple, Union
+import numpy as np
+import cv2
+
+from . import models
+from .calibration import Calibration
+from .detector import create_detector
+from .gaze_tracking import GazeTracking
+from .sample import SAMPLE_DTYPE, compute_directions, empty_samples
+
+
+# request: id, encoding (0 raw, 1 encoded image), channels, width, height, payload length, timestamp
+REQUEST = struct.Struct("<IBBHHId")
+# response: id, status (0 analyzed, 1 invalid frame, 2 analysis failed), followed by one SAMPLE_DTYPE row
+RESPONSE = struct.Struct("<IB")
+
+RAW = 0
+ENCODED = 1
+OK = 0
+INVALID = 1
+FAILED = 2
+
+# options keeping the state of a single stream, which the clients cannot share
+_STREAM_OPTIONS = ("track_face", "keyframe_interval", "multi_face", "adaptive_calibration")
+
+Address = Union[str, Tuple[str, int]]
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    """Returns exactly size bytes read from the socket, or None if it is closed"""
+    data = bytearray(size)
+    view = memoryview(data)
+    while view:
+        count = sock.recv_into(view)
+        if count == 0:
+            return None
+        view = view[count:]
+    return bytes(data)
+
+
+class _Request(object):
+    __slots__ = ["session", "frame", "timestamp", "sample", "status", "done"]
+
+    def __init__(self, session: "Session", frame: np.ndarray, timestamp: float):
+        self.session = session
+        self.frame = frame
+        self.timestamp = timestamp
+        self.sample = empty_samples(1)
+        self.status = FAILED
+        self.done = threading.Event()
+
+
+class Session(object):
+    """
+    This class holds the state of a client: its calibration,
+    shared by the workers analyzing its frames one after the other.
+    """
+    __slots__ = ["calibration", "frames"]
+
+    def __init__(self, calibration: Calibration):
+        """
+        Arguments:
+            calibration (calibration.Calibration): Calibration of the client, built
+                with the options of the server trackers
+        """
+        self.calibration = calibration
+        self.frames = 0
+
+
+class GazeServer(object):
+    """
+    This class serves the gaze analysis to local clients over a Unix socket
+    or a localhost TCP port. The models are loaded once and the trackers
+    stay warm; the frames of all the clients are grouped into batches
+    analyzed by a pool of worker threads, each client keeping its own
+    calibration. See GazeClient for the protocol.
+
+    The dlib face detector and landmark predictor hold the GIL, so the worker
+    threads run those stages one at a time: more workers overlap the socket
+    I/O, the decoding and the OpenCV stages, not the dlib ones. Every worker
+    has its own cascade classifier, which is not thread-safe.
+    """
+    __slots__ = ["address", "batch_size", "max_delay", "max_payload", "frames", "batches", "_server", "_serving",
+                 "_requests", "_trackers", "_calibration_factory", "_executor", "_scheduler", "_stop"]
+
+    def __init__(
+        self,
+        address: Address = ("127.0.0.1", 8765),
+        *,
+        workers: int = 2,
+        batch_size: int = 8,
+        max_delay: float = 0.005,
+        max_payload: int = 32 << 20,
+        **kwds: Any
+    ):
+        """
+        Arguments:
+            address: Path of the Unix socket, or (host, port) of the TCP socket
+            workers (int): Number of threads analyzing the batches, see above
+            batch_size (int): Maximum number of frames of a batch
+            max_delay (float): Maximum number of seconds a frame waits for the batch to fill
+            max_payload (int): Maximum number of bytes of a frame; a client sending a larger
+                one is answered INVALID and disconnected
+            kwds: Arguments passed to the GazeTracking of every worker, except the
+                options following a single stream (track_face, keyframe_interval, ...)
+        """
+        for option in _STREAM_OPTIONS:
+            if kwds.get(option):
+                raise ValueError(f"'{option}' follows a single stream, the server analyzes many")
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_payload = max_payload
+        self.frames = 0
+        self.batches = 0
+
+        models.preload(kwds.get("predictor_path"))
+        self._trackers: "queue.Queue[GazeTracking]" = queue.Queue()
+        detector = kwds.pop("face_detector", "hog")
+        for _ in range(workers):
+            self._trackers.put(GazeTracking(face_detector=create_detector(detector, shared=False), **kwds))
+        # the calibration of every client follows the options of the trackers, e.g. their profile
+        self._calibration_factory = self._trackers.queue[0]._new_calibration
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="gaze-server")
+        self._requests: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._stop = threading.Event()
+
+        handler = self._handler()
+        self._serving = False
+        if isinstance(address, str):
+            if _UnixServer is None:
+                raise OSError("Unix sockets are not available on this platform")
+            if os.path.exists(address):
+                os.remove(address)
+            self._server = _UnixServer(address, handler)
+        else:
+            self._server = _TCPServer(address, handler)
+        self.address = self._server.server_address
+
+        self._scheduler = threading.Thread(target=self._schedule, name="gaze-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def _handler(self) -> type:
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                server._serve_client(self.request)
+
+        return Handler
+
+    def _serve_client(self, sock: socket.socket) -> None:
+        """Answers the requests of a client, one at a time"""
+        try:
+            self._answer(sock, Session(self._calibration_factory()))
+        except ConnectionError:
+            pass
+
+    def _answer(self, sock: socket.socket, session: Session) -> None:
+        while not self._stop.is_set():
+            header = _recv_exact(sock, REQUEST.size)
+            if header is None:
+                return
+            request_id, encoding, channels, width, height, length, timestamp = REQUEST.unpack(header)
+            if length > self.max_payload or (encoding == RAW and length != width * height * channels):
+                # the payload is left unread, so the stream cannot go on after it
+                sock.sendall(RESPONSE.pack(request_id, INVALID) + empty_samples(1).tobytes())
+                return
+            payload = _recv_exact(sock, length)
+            if payload is None:
+                return
+
+            frame = self._decode(payload, encoding, channels, width, height)
+            if frame is None:
+                sock.sendall(RESPONSE.pack(request_id, INVALID) + empty_samples(1).tobytes())
+                continue
+            request = _Request(session, frame, timestamp)
+            self._requests.put(request)
+            request.done.wait()
+            sock.sendall(RESPONSE.pack(request_id, request.status) + request.sample.tobytes())
+
+    @staticmethod
+    def _decode(payload: bytes, encoding: int, channels: int, width: int, height: int) -> Optional[np.ndarray]:
+        """Returns the frame of a request, or None if it is invalid"""
+        buffer = np.frombuffer(payload, np.uint8)
+        if buffer.size == 0:
+            return None
+        if encoding == ENCODED:
+            try:
+                return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            except cv2.error:
+                return None
+        if encoding != RAW or channels not in (1, 3) or buffer.size != width * height * channels:
+            return None
+        frame = buffer.reshape(height, width, channels)
+        return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) if channels == 1 else frame
+
+    def _schedule(self) -> None:
+        """Groups the requests of the clients into batches for the workers"""
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.perf_counter() + self.max_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._requests.put(None)
+                    break
+                batch.append(request)
+            self.batches += 1
+            self.frames += len(batch)
+            self._executor.submit(self._analyze, batch)
+
+    def _analyze(self, batch: List[_Request]) -> None:
+        """Analyzes a batch on a warm tracker, with the calibration of every client.
+        A client waits for its answer before sending a new frame, so its
+        calibration is never used by two workers at once. A frame failing
+        the analysis is answered as such, the rest of the batch goes on.
+        """
+        gaze = self._trackers.get()
+        try:
+            for request in batch:
+                try:
+                    gaze.calibration = request.session.calibration
+                    gaze.refresh(request.frame)
+                    request.sample["timestamp"][0] = request.timestamp
+                    gaze._fill_sample(request.sample, 0)
+                    compute_directions(request.sample)
+                    request.session.frames += 1
+                    request.status = OK
+                except Exception:
+                    request.sample = empty_samples(1)
+                    request.status = FAILED
+                finally:
+                    request.done.set()
+        finally:
+            self._trackers.put(gaze)
+
+    def serve_forever(self) -> None:
+        """Answers the clients until shutdown is called"""
+        self._serving = True
+        self._server.serve_forever()
+
+    def shutdown(self) -> None:
+        """Stops serve_forever, the scheduler and the workers"""
+        self._stop.set()
+        if self._serving:
+            self._server.shutdown()
+        self._server.server_close()
+        self._requests.put(None)
+        self._scheduler.join()
+        self._executor.shutdown()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+else:  # Windows
+    _UnixServer = None
+
+
+class GazeClient(object):
+    """
+    This class sends frames to a GazeServer and receives their samples.
+    """
+    __slots__ = ["sock", "encoding", "_next_id"]
+
+    def __init__(self, address: Address = ("127.0.0.1", 8765), encoding: Optional[str] = None):
+        """
+        Arguments:
+            address: Path of the Unix socket, or (host, port) of the TCP socket of the server
+            encoding (str): Image extension the frames are encoded to, e.g. '.jpg',
+                raw pixels by default
+        """
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(address)
+        self.encoding = encoding
+        self._next_id = 0
+
+    def analyze(self, frame: np.ndarray, timestamp: float = 0.0) -> np.void:
+        """Returns the sample of a frame (see sample.SAMPLE_DTYPE)
+
+        Arguments:
+            frame (numpy.ndarray): BGR or grayscale frame
+            timestamp (float): Time of the frame in seconds, copied to the sample
+        """
+        height, width = frame.shape[:2]
+        channels = 1 if frame.ndim == 2 else frame.shape[2]
+        if self.encoding:
+            ok, payload = cv2.imencode(self.encoding, frame)
+            if not ok:
+                raise ValueError(f"cannot encode the frame to '{self.encoding}'")
+            payload = payload.tobytes()
+            encoding = ENCODED
+        else:
+            payload = np.ascontiguousarray(frame).tobytes()
+            encoding = RAW
+
+        request_id = self._next_id
+        self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+        self.sock.sendall(REQUEST.pack(request_id, encoding, channels, width, height, len(payload), timestamp))
+        self.sock.sendall(payload)
+
+        data = _recv_exact(self.sock, RESPONSE.size + SAMPLE_DTYPE.itemsize)
+        if data is None:
+            raise ConnectionError("the server closed the connection")
+        answer_id, status = RESPONSE.unpack_from(data)
+        if answer_id != request_id:
+            raise ConnectionError(f"unexpected answer {answer_id} to the request {request_id}")
+        if status == INVALID:
+            raise ValueError("the server could not read the frame")
+        if status != OK:
+            raise RuntimeError("the server failed to analyze the frame")
+        return np.frombuffer(data, SAMPLE_DTYPE, 1, RESPONSE.size)[0]
+
+    def close(self) -> None:
+        self.sock.close()
+
+    def __enter__(self) -> "GazeClient":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def main(*argv: str) -> None:
+    parse = ArgumentParser("gaze tracking server")
+    parse.add_argument("--unix", help="path of the Unix socket to listen on")
+    parse.add_argument("--host", default="127.0.0.1", help="address of the TCP socket")
+    parse.add_argument("--port", type=int, default=8765, help="port of the TCP socket")
+    parse.add_argument("-w", "--workers", type=int, default=2,
+        help="number of threads analyzing the frames, the dlib stages still run one at a time")
+    parse.add_argument("-b", "--batch-size", type=int, default=8, help="maximum number of frames of a batch")
+    parse.add_argument("--max-delay", type=float, default=5.0,
+        help="maximum number of milliseconds a frame waits for its batch to fill")
+    parse.add_argument("--max-payload", type=float, default=32.0,
+        help="maximum size of a frame in MiB, larger frames are rejected")
+    parse.add_argument("-e", "--equalizehist", action="store_true")
+    parse.add_argument("-s", "--scale", type=float, default=1.0,
+        help="scale of the frame the face detector runs on, e.g. 0.5 or 0.25")
+    parse.add_argument("-p", "--pupil-backend", default="contours", help="pupil localization backend")
+    parse.add_argument("-d", "--detector", default="hog", help="face detector backend")
+
+    args = parse.parse_args(argv)
+    server = GazeServer(
+        args.unix or (args.host, args.port), workers=args.workers, batch_size=args.batch_size,
+        max_delay=args.max_delay / 1000, max_payload=int(args.max_payload * (1 << 20)), equalizehist=args.equalizehist, detection_scale=args.scale,
+        pupil_backend=args.pupil_backend, face_detector=args.detector)
+    print(f"serving on {server.address}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(f"{server.frames} frames analyzed in {server.batches} batches", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,195 @@
+import json
+import time
+import bisect
+import threading
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Histogram(object):
+    """
+    This class counts durations in fixed latency buckets.
+    """
+    __slots__ = ["counts", "total", "count"]
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "buckets": dict(zip([str(bound) for bound in BUCKETS] + ["+Inf"], self.counts)),
+        }
+
+
+class Stats(object):
+    """
+    This class collects the latency of the analysis stages and
+    counts events such as frames, detected faces and located pupils.
+    """
+    __slots__ = ["histograms", "counters", "_lock"]
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Records the duration of a stage
+
+        Arguments:
+            stage (str): Name of the stage
+            seconds (float): Duration of the stage
+        """
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def lap(self, stage: str, start: float) -> float:
+        """Records the duration of a stage started at the given time
+
+        Returns:
+            The current time, start of the next stage
+        """
+        now = time.perf_counter()
+        self.observe(stage, now - start)
+        return now
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Increments a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns a copy of the histograms and counters"""
+        with self._lock:
+            return {
+                "stages": {stage: histogram.snapshot() for stage, histogram in self.histograms.items()},
+                "counters": dict(self.counters),
+            }
+
+
+def prometheus_text(snapshot: Dict[str, Any], prefix: str = "gaze") -> str:
+    """Formats a snapshot of GazeTracking.stats in the Prometheus text format"""
+    lines: List[str] = []
+    stages = snapshot.get("stages", {})
+    if stages:
+        lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+    for stage, histogram in stages.items():
+        cumulative = 0
+        for bound, count in histogram["buckets"].items():
+            cumulative += count
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+
+    for name, value in snapshot.get("counters", {}).items():
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+
+    for name, value in snapshot.get("gauges", {}).items():
+        if value is None:
+            continue
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {float(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class StatsReporter(object):
+    """
+    This class periodically dumps the snapshots of a stats source to a JSON
+    file, and/or serves them in the Prometheus text format on a local port.
+    """
+    __slots__ = ["source", "path", "interval", "_stop", "_thread", "_server"]
+
+    def __init__(
+        self,
+        source: Callable[[], Dict[str, Any]],
+        path: Optional[str] = None,
+        port: Optional[int] = None,
+        interval: float = 10.0
+    ):
+        """
+        Arguments:
+            source: Callable returning a snapshot, e.g. GazeTracking.stats
+            path (str): JSON file rewritten with the latest snapshot
+            port (int): Local port serving the snapshot on /metrics
+            interval (float): Seconds between two dumps to the file
+        """
+        self.source = source
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._server: Optional[_MetricsServer] = None
+
+        if port is not None:
+            self._server = _MetricsServer(("127.0.0.1", port), self._handler())
+            threading.Thread(target=self._server.serve_forever, name="gaze-metrics", daemon=True).start()
+        if path is not None:
+            self._thread = threading.Thread(target=self._run, name="gaze-stats", daemon=True)
+            self._thread.start()
+
+    def _handler(self) -> type:
+        source = self.source
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = prometheus_text(source()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        return Handler
+
+    def dump(self) -> None:
+        """Writes the current snapshot to the file"""
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.source(), f, indent=2)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def close(self) -> None:
+        """Stops the reporter, writing a last snapshot to the file"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.dump()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,63 @@
+import queue
+import threading
+from typing import Optional, Tuple
+import numpy as np
+import cv2
+
+
+class ThreadedVideoWriter(object):
+    """
+    This class encodes frames into a video file on a background thread,
+    fed through a bounded queue.
+    """
+    __slots__ = ["writer", "written", "_queue", "_thread", "_error"]
+
+    def __init__(self, path: str, fourcc: str, fps: float, size: Tuple[int, int], queue_size: int = 16):
+        """
+        Arguments:
+            path (str): Path of the video file
+            fourcc (str): Four character code of the codec, e.g. 'XVID'
+            fps (float): Frame rate of the video
+            size (tuple): (width, height) of the frames
+            queue_size (int): Maximum number of frames waiting to be encoded
+        """
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size, True)
+        if not self.writer.isOpened():
+            raise OSError(f"cannot open the video writer for '{path}'")
+        self.written = 0
+        self._error: Optional[BaseException] = None
+        self._queue: "queue.Queue[Optional[np.ndarray]]" = queue.Queue(max(queue_size, 1))
+        self._thread = threading.Thread(target=self._run, name="gaze-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is None:
+                    break
+                if self._error is None:
+                    try:
+                        self.writer.write(frame)
+                        self.written += 1
+                    except Exception as e:
+                        self._error = e
+        finally:
+            self.writer.release()
+
+    def write(self, frame: np.ndarray) -> None:
+        """Queues a frame to be encoded, waiting if the queue is full.
+        The frame must not be modified afterwards.
+
+        Arguments:
+            frame (numpy.ndarray): BGR frame of the video size
+        """
+        if self._error is not None:
+            raise OSError("failed to encode the video") from self._error
+        self._queue.put(frame)
+
+    def release(self) -> None:
+        """Encodes the remaining frames and closes the file"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
@@ -4,7 +4,7 @@
 import sys
 import cv2
 from argparse import ArgumentParser
-from gaze_tracking import GazeTrackingFromVideo
+from gaze_tracking import EventDetector, GazeTrackingFromVideo
 from screen_brightness_control import set_brightness
 
 parse = ArgumentParser()
@@ -16,22 +16,17 @@ parse.add_argument("-s", "--show", action="store_true")
 args = parse.parse_args()
 
 gaze = GazeTrackingFromVideo(
-    args.videocapture, equalizehist=args.equalizehist, flip=args.flip)
+    args.videocapture, equalizehist=args.equalizehist, flip=args.flip, threaded=True)
 
-count = 0
+# the pupils must be followed, or lost, for this number of seconds to change the brightness
+delay = 5
+detector = EventDetector(max_gap=2)
 
 try:
     for _ in gaze:
-        if gaze.pupils_located:
-            if count < 5:
-                count += 1
-            else:
-                set_brightness("+5")
-        else:
-            if count > 0:
-                count -= 1
-            else:
-                set_brightness("-5")
+        detector.update(gaze.sample)
+        if gaze.timestamp - detector.tracking_changed >= delay:
+            set_brightness("+5" if detector.tracking else "-5")
         
         if args.show:
             gaze.annotated_frame()
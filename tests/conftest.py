@@ -0,0 +1,53 @@
+import cv2
+import dlib
+import numpy as np
+import pytest
+
+from gaze_tracking import models
+
+
+# the face the fake detector finds, and the landmarks of its eyes
+FACE = dlib.rectangle(150, 150, 350, 300)
+LEFT_EYE = [(180, 200), (190, 192), (205, 192), (220, 200), (205, 207), (190, 207)]
+RIGHT_EYE = [(280, 200), (290, 192), (305, 192), (320, 200), (305, 207), (290, 207)]
+
+
+def _landmarks():
+    points = [dlib.point(250, 250)] * 68
+    for index, (x, y) in zip(range(36, 48), LEFT_EYE + RIGHT_EYE):
+        points[index] = dlib.point(x, y)
+    return points
+
+
+class FakeDetector(object):
+    """Finds the face of scene() in every frame large enough to hold it,
+    scaled to the width of the frame for the detection_scale copies
+    """
+
+    def __call__(self, frame, upsample=0):
+        scale = frame.shape[1] / 640
+        if scale < 0.25 or frame.shape[0] <= FACE.bottom() * scale:
+            return []
+        return [dlib.rectangle(*(int(round(value * scale)) for value in
+                                 (FACE.left(), FACE.top(), FACE.right(), FACE.bottom())))]
+
+
+def fake_predictor(frame, rect):
+    return dlib.full_object_detection(rect, _landmarks())
+
+
+def scene(seed=0, shift=0):
+    """Returns a 640x480 frame of the fake face, whose pupils are moved right by shift pixels"""
+    rng = np.random.RandomState(seed)
+    frame = rng.randint(150, 230, (480, 640, 3)).astype(np.uint8)
+    for eye in (LEFT_EYE, RIGHT_EYE):
+        center = ((eye[0][0] + eye[3][0]) // 2 + shift, eye[0][1])
+        cv2.circle(frame, center, 5, (20, 20, 20), -1)
+    return frame
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    """Replaces the dlib models of the registry, so that the tests need no trained model"""
+    monkeypatch.setitem(models._models, "face_detector", FakeDetector())
+    monkeypatch.setitem(models._models, "shape_predictor:" + models.PREDICTOR_PATH, fake_predictor)
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from gaze_tracking import GazeTracking
+from gaze_tracking.events import FIXATION, detect_events
+
+from conftest import scene
+
+
+def test_analyze_batch_timestamps(fake_models):
+    frames = [scene(seed) for seed in range(30)]
+    timestamps = np.arange(30) / 30
+    samples = GazeTracking().analyze_batch(frames, timestamps)
+    assert np.array_equal(samples["timestamp"], timestamps)
+    assert samples["located"].all()
+    # the events are found from the timestamps of the samples
+    events = detect_events(samples)
+    assert FIXATION in events["kind"]
+
+    samples = GazeTracking().analyze_batch(frames[:3])
+    assert not np.isnan(samples["timestamp"]).any()
+    assert (np.diff(samples["timestamp"]) >= 0).all()
+    with pytest.raises(ValueError):
+        GazeTracking().analyze_batch(frames, timestamps[:2])
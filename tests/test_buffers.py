@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from gaze_tracking import GazeTracking
+
+from conftest import scene
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"equalizehist": True},
+    {"detection_scale": 0.5},
+])
+def test_steady_state_frames_allocate_no_buffer(fake_models, options):
+    gaze = GazeTracking(**options)
+    # past the calibration, so that its frames and the following ones are both covered
+    frames = [scene(seed, shift=seed % 5 - 2) for seed in range(30)]
+    gaze.refresh(frames[0])
+    allocations = gaze.buffers.allocations
+    assert allocations > 0
+    for frame in frames[1:]:
+        gaze.refresh(frame)
+        assert gaze.pupils_located
+        assert gaze.buffers.allocations == allocations
+    gaze.release()
+
+
+def test_equalized_annotated_frame_reuses_its_buffer(fake_models):
+    gaze = GazeTracking(equalizehist=True)
+    frame = scene()
+    original = frame.copy()
+    gaze.refresh(frame)
+    first = gaze.annotated_frame()
+    allocations = gaze.buffers.allocations
+    gaze.refresh(scene(1))
+    assert np.shares_memory(gaze.annotated_frame(), first)
+    assert gaze.buffers.allocations == allocations
+    assert (frame == original).all()
+    gaze.release()
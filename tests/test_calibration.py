@@ -0,0 +1,42 @@
+import numpy as np
+
+from gaze_tracking.benchmark import synthetic_eyes
+from gaze_tracking.calibration import Calibration
+from gaze_tracking.pupil import Pupil
+
+
+def _sweep_threshold(eye_frame):
+    """The threshold search before the cumulative histogram: the whole image
+    processing run for every candidate threshold
+    """
+    trials = {}
+    for threshold in range(5, 100, 5):
+        iris_frame = Pupil.image_processing(eye_frame, threshold)
+        trials[threshold] = Calibration.iris_size(iris_frame)
+    best_threshold, iris_size = min(trials.items(), key=(lambda p: abs(p[1] - 0.48)))
+    return best_threshold
+
+
+def _random_eyes(count, seed=0):
+    rng = np.random.RandomState(seed)
+    eyes = []
+    for _ in range(count):
+        height, width = rng.randint(14, 40), rng.randint(24, 80)
+        eye = rng.randint(0, 256, (height, width)).astype(np.uint8)
+        # a white margin, as Eye leaves around the eye
+        eye[:5] = eye[-5:] = eye[:, :5] = eye[:, -5:] = 255
+        eyes.append(eye)
+    return eyes
+
+
+def test_find_best_threshold_matches_the_sweep():
+    eyes, _ = synthetic_eyes(300)
+    eyes += _random_eyes(200)
+    for eye in eyes:
+        assert Calibration.find_best_threshold(eye) == _sweep_threshold(eye)
+
+
+def test_find_best_threshold_scratch_array():
+    eye = synthetic_eyes(1)[0][0]
+    out = np.empty_like(eye)
+    assert Calibration.find_best_threshold(eye, out=out) == Calibration.find_best_threshold(eye)
@@ -0,0 +1,14 @@
+from gaze_tracking import GazeTracking
+
+from conftest import scene
+
+
+def test_keyframe_interval(fake_models):
+    gaze = GazeTracking(keyframe_interval=5)
+    frame = scene()
+    for _ in range(30):
+        gaze.refresh(frame)
+    # a keyframe, then 4 frames followed with optical flow
+    assert gaze.landmark_flow.keyframes == 6
+    assert gaze.landmark_flow.propagated == 24
+    gaze.release()
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from gaze_tracking.benchmark import synthetic_eyes
+from gaze_tracking.calibration import Calibration
+from gaze_tracking.pupil import BACKENDS, Pupil
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_backends_write_the_iris_frame_into_out(backend):
+    eyes, _ = synthetic_eyes(20)
+    for eye in eyes:
+        threshold = Calibration.find_best_threshold(eye)
+        out = np.empty_like(eye)
+        pupil = Pupil(eye, threshold, out, backend)
+        expected = Pupil(eye, threshold, None, backend)
+        assert (pupil.x, pupil.y) == (expected.x, expected.y)
+        assert np.array_equal(pupil.iris_frame, expected.iris_frame)
+        assert np.shares_memory(pupil.iris_frame, out)
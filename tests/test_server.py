@@ -0,0 +1,114 @@
+import socket
+import threading
+import numpy as np
+import pytest
+
+from gaze_tracking.gaze_tracking import GazeTracking
+from gaze_tracking.sample import SAMPLE_DTYPE
+from gaze_tracking.server import ENCODED, RAW, REQUEST, RESPONSE, INVALID, OK, GazeClient, GazeServer
+
+from conftest import scene
+
+
+@pytest.fixture
+def server(fake_models):
+    server = GazeServer(("127.0.0.1", 0), workers=2, batch_size=4, max_delay=0.2, max_payload=1 << 20)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join(5)
+
+
+def _send(address, encoding, payload, width=0, height=0, channels=3, length=None):
+    """Sends a single request by hand and returns the status of its answer,
+    and whether the server closed the connection after it
+    """
+    with socket.create_connection(address, timeout=10) as sock:
+        length = len(payload) if length is None else length
+        sock.sendall(REQUEST.pack(7, encoding, channels, width, height, length, 0.0) + payload)
+        data = b""
+        while len(data) < RESPONSE.size + SAMPLE_DTYPE.itemsize:
+            chunk = sock.recv(RESPONSE.size + SAMPLE_DTYPE.itemsize - len(data))
+            assert chunk, "the server closed the connection without answering"
+            data += chunk
+        request_id, status = RESPONSE.unpack_from(data)
+        assert request_id == 7
+        sock.settimeout(0.5)
+        try:
+            closed = sock.recv(1) == b""
+        except socket.timeout:
+            closed = False
+        return status, closed
+
+
+@pytest.mark.parametrize("encoding", [None, ".png"])
+def test_round_trip(server, encoding):
+    with GazeClient(server.address, encoding) as client:
+        sample = client.analyze(scene(), timestamp=1.5)
+        empty = client.analyze(scene()[:100])
+    assert sample["timestamp"] == 1.5
+    assert sample["located"]
+    assert tuple(sample["pupil_left"]) == (200, 200)
+    assert not empty["located"]
+
+
+def test_batches(server):
+    samples = []
+
+    def analyze(seed):
+        with GazeClient(server.address) as client:
+            samples.append(client.analyze(scene(seed)))
+
+    threads = [threading.Thread(target=analyze, args=(seed,), daemon=True) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(samples) == 4 and all(sample["located"] for sample in samples)
+    assert server.frames == 4
+    assert server.batches < 4
+
+
+def test_invalid_frames(server):
+    assert _send(server.address, ENCODED, b"") == (INVALID, False)
+    assert _send(server.address, ENCODED, b"not an image") == (INVALID, False)
+    assert _send(server.address, RAW, b"\0" * 32, 4, 4, 2) == (INVALID, False)
+    # payloads which are not read: their length is wrong or too large
+    assert _send(server.address, RAW, b"\0" * 10, 4, 4) == (INVALID, True)
+    assert _send(server.address, RAW, b"", 2000, 2000, length=2000 * 2000 * 3) == (INVALID, True)
+    assert _send(server.address, ENCODED, b"", length=0xFFFFFFFF) == (INVALID, True)
+    with GazeClient(server.address) as client:
+        with pytest.raises(ValueError):
+            client.analyze(np.zeros((4, 4, 2), np.uint8))
+        # the connection is still served after an invalid frame
+        assert client.analyze(scene())["located"]
+    assert _send(server.address, RAW, np.zeros((4, 4, 3), np.uint8).tobytes(), 4, 4)[0] == OK
+
+
+def test_failed_frame_does_not_stall_its_batch(server, monkeypatch):
+    refresh = GazeTracking.refresh
+
+    def failing_refresh(self, frame, *args, **kwds):
+        if frame.shape[0] == 99:
+            raise RuntimeError("analysis failure")
+        return refresh(self, frame, *args, **kwds)
+
+    monkeypatch.setattr(GazeTracking, "refresh", failing_refresh)
+    errors = []
+
+    def analyze(frame):
+        try:
+            with GazeClient(server.address) as client:
+                client.analyze(frame)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=analyze, args=(frame,), daemon=True)
+               for frame in (scene(1)[:99], scene(2), scene(3))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+        assert not thread.is_alive()
+    assert [type(e) for e in errors] == [RuntimeError]